@@ -1,66 +1,167 @@
 import argparse
+import asyncio
 import subprocess
 from pathlib import Path
 import json
+import hashlib
 import shutil
 import re
+import shlex
+import signal
 from typing import Callable
 import sys
 from datetime import datetime
 import time
 import os
+import zipfile
+import io
+import mmap
+from array import array
+import gzip
+import struct
+import threading
+import socket
+import socketserver
+import random
+import urllib.error
+import urllib.parse
+import urllib.request
+import bisect
+import glob
+import zlib
 
-from dataclasses import dataclass
+from concurrent.futures import (
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+)
+from dataclasses import asdict, dataclass
 
 
 class UnrealIni:
+    # Keeps every line of the file as read, so it writes back out exactly the same,
+    # plus an index of (section, key) -> line numbers so lookups and updates don't scan
+    # the whole file. Array operator lines (+Key=, -Key=, .Key=, !Key=) and duplicate
+    # keys are indexed under the plain key name, in file order.
+    ARRAY_OPERATORS = "+-.!"
+    _section_match = re.compile(r"\[(.*)\]")
+    _value_match = re.compile(r"([^=]*)=(.*)")
+
     def __init__(self, content: str):
-        commentmatch = re.compile(r";(.*)")
-        subsectionmatch = re.compile(r"\[(.*)\]")
-        valuematch = re.compile(r"([^=]*)=(.*)")
-        subsections = []
-        cur_section = []
-        cur_section_name = []
-        for line in content.splitlines():
-            m_comment = commentmatch.match(line)
-            m1 = subsectionmatch.match(line)
-            m2 = valuematch.match(line)
-            if m_comment is not None:
-                subsections.append((None, m_comment.group(1)))
-            elif m1 is not None:
-                if len(cur_section) > 0:
-                    subsections.append((cur_section_name, cur_section))
-                cur_section_name = m1.group(1)
-                cur_section = []
-            elif m2 is not None:
-                cur_section.append((m2.group(1), m2.group(2)))
-        if len(cur_section) > 0:
-            subsections.append((cur_section_name, cur_section))
-        self.subsections = subsections
-        assert self.reconstruct().strip("\n") == content.strip("\n")
+        self.lines = content.splitlines(keepends=True)
+        self.newline = "\n"
+        if len(self.lines) > 0 and self.lines[0].endswith("\r\n"):
+            self.newline = "\r\n"
+        self._trailing_newline = True
+        if len(self.lines) > 0 and not self.lines[-1].endswith(("\n", "\r")):
+            self.lines[-1] += self.newline
+            self._trailing_newline = False
+        self._reindex()
+        self._text = content
 
-    def reconstruct(self):
-        reconstructed = ""
-        for name, values in self.subsections:
-            if name is None:
-                reconstructed += ";" + values + "\n"
-            else:
-                reconstructed += "[" + name + "]\n"
-                for k, v in values:
-                    reconstructed += f"{k}={v}\n"
-                reconstructed += "\n"
-        return reconstructed
+    def _reindex(self):
+        # (section, key) -> list of (line number, operator)
+        self.index = {}
+        # section -> line number of the last key in that section
+        self.section_ends = {}
+        section = None
+        for line_number, line in enumerate(self.lines):
+            line = line.rstrip("\r\n")
+            if line.startswith(";"):
+                continue
+            m_section = self._section_match.match(line)
+            if m_section is not None:
+                section = m_section.group(1)
+                self.section_ends[section] = line_number
+                continue
+            m_value = self._value_match.match(line)
+            if m_value is not None and section is not None:
+                key = m_value.group(1)
+                operator = ""
+                if key[:1] in self.ARRAY_OPERATORS:
+                    operator, key = key[0], key[1:]
+                self.index.setdefault((section, key), []).append(
+                    (line_number, operator)
+                )
+                self.section_ends[section] = line_number
+
+    def _split_line(self, line_number):
+        line = self.lines[line_number]
+        body = line.rstrip("\r\n")
+        key, value = body.split("=", 1)
+        return key, value, line[len(body) :]
+
+    def _set_line(self, line_number, value):
+        key, _, ending = self._split_line(line_number)
+        self.lines[line_number] = f"{key}={value}{ending}"
+        self._text = None
+
+    def get_values(self, section, key):
+        # values of every line for this key, including array operator lines
+        return [
+            self._split_line(line_number)[1]
+            for line_number, _ in self.index.get((section, key), [])
+        ]
+
+    def get_value(self, section, key, default=None):
+        # the last plain key=value for this key
+        for line_number, operator in reversed(self.index.get((section, key), [])):
+            if operator == "":
+                return self._split_line(line_number)[1]
+        return default
 
     def update_value(self, enabled, value, modifier):
-        done_update = False
+        # modifies plain key=value lines, array operator lines are left alone so that
+        # removals (-Key=) and clears (!Key=) stay as they are
         (target_section, target_key) = value
-        for name, values in self.subsections:
-            if name == target_section:
-                for i, (k, v) in enumerate(values):
-                    if k == target_key:
-                        done_update = True
-                        values[i] = [k, modifier(enabled, v)]
-        print(self.reconstruct())
+        for line_number, operator in self.index.get((target_section, target_key), []):
+            if operator != "":
+                continue
+            current = self._split_line(line_number)[1]
+            self._set_line(line_number, modifier(enabled, current))
+
+    def set_value(self, section, key, value):
+        # set a plain key, adding it (and the section) if it isn't in the file already
+        plain_lines = [
+            line_number
+            for line_number, operator in self.index.get((section, key), [])
+            if operator == ""
+        ]
+        if len(plain_lines) > 0:
+            for line_number in plain_lines:
+                self._set_line(line_number, value)
+        else:
+            self.add_value(section, key, value, operator="")
+
+    def add_value(self, section, key, value, operator="+"):
+        new_line = f"{operator}{key}={value}{self.newline}"
+        if section in self.section_ends:
+            self.lines.insert(self.section_ends[section] + 1, new_line)
+        else:
+            if len(self.lines) > 0 and self.lines[-1].strip() != "":
+                self.lines.append(self.newline)
+            self.lines += [f"[{section}]{self.newline}", new_line]
+        self._text = None
+        self._reindex()
+
+    def reconstruct(self):
+        if self._text is None:
+            self._text = "".join(self.lines)
+            if not self._trailing_newline:
+                self._text = self._text.removesuffix(self.newline)
+        return self._text
+
+
+@dataclass
+class DecoderLimits:
+    # nominal hardware video decoder limits for a device, used to check videos
+    max_width: int
+    max_height: int
+    max_fps: float
+    max_bitrate_mbps: float
+    codecs: tuple[str, ...]
+    # longest gap between keyframes before seeking and looping get slow
+    max_keyframe_interval: float = 2.0
 
 
 @dataclass
@@ -70,6 +171,7 @@ class BuildFlavour:
     engine_keys: tuple[str,dict] | None = None
     engine_version_override: str | None = None
     dont_build: bool = False
+    decoder_limits: DecoderLimits | None = None
 
     def update_uproject(self, project_dict: dict, enabled: bool):
         if not self.plugin_name:
@@ -85,9 +187,7 @@ class BuildFlavour:
     def update_defaultengine(self, config_ini: UnrealIni, enabled: bool):
         if self.engine_keys != None:
             for val, modifier in self.engine_keys:
-                print(val, modifier)
                 config_ini.update_value(enabled, val, modifier)
-        return config_ini.reconstruct()
 
 
 BUILD_FLAVOURS = [
@@ -128,6 +228,7 @@ BUILD_FLAVOURS = [
                 lambda enabled, current: r"32" if enabled else current,
             ),
         ],
+        decoder_limits=DecoderLimits(5760, 2880, 60, 100, ("avc1", "hvc1", "hev1")),
     ),
     BuildFlavour(
         "android",
@@ -141,6 +242,7 @@ BUILD_FLAVOURS = [
                 lambda enabled, current: "False" if enabled else "True",
             ),
         ],
+        decoder_limits=DecoderLimits(3840, 2160, 60, 80, ("avc1", "hvc1", "hev1")),
     ),
     BuildFlavour(
         "pico",
@@ -175,18 +277,1136 @@ BUILD_FLAVOURS = [
                 ),
             ),
         ],
+        decoder_limits=DecoderLimits(7680, 3840, 30, 100, ("avc1", "hvc1", "hev1")),
+    ),
+    BuildFlavour(
+        "vivefocus",
+        "ViveOpenXR",
+        engine_version_override="5.3",
+        decoder_limits=DecoderLimits(5760, 2880, 30, 80, ("avc1", "hvc1", "hev1")),
     ),
-    BuildFlavour("vivefocus", "ViveOpenXR", engine_version_override="5.3"),
     BuildFlavour("old_pico", "PicoXR", dont_build=True),
 ]
 
 
+# adb executable, can be overridden e.g. with a fake adb for testing
+ADB = os.environ.get("ADB", "adb")
+
+LOG_PRIORITIES = "  VDIWEFS"
+
+
+@dataclass
+class AdbDevice:
+    serial: str
+    state: str
+    model: str | None = None
+
+    def ready(self):
+        # "unauthorized", "offline", "recovery" etc. devices can't be installed to
+        return self.state == "device"
+
+    def __str__(self):
+        if self.model:
+            return f"{self.serial} ({self.model})"
+        return self.serial
+
+
+def parse_device_list(text):
+    # "serial state key:value ..." lines, as from adb devices -l or host:track-devices-l
+    devices = []
+    for line in text.splitlines():
+        parts = line.split()
+        if len(parts) < 2 or line.startswith("List of devices"):
+            continue
+        info = dict(part.split(":", 1) for part in parts[2:] if ":" in part)
+        devices.append(AdbDevice(parts[0], parts[1], info.get("model")))
+    return devices
+
+
+class DeviceTracker:
+    # Talks to the adb server's host:track-devices-l service, which sends the whole device
+    # list straight away and again every time a device connects, disconnects or changes state.
+    def __init__(self, host="127.0.0.1", port=None):
+        self.host = host
+        self.port = port or int(os.environ.get("ANDROID_ADB_SERVER_PORT", 5037))
+        self._sock = None
+
+    def __enter__(self):
+        self._sock = socket.create_connection((self.host, self.port), timeout=5)
+        try:
+            request = b"host:track-devices-l"
+            self._sock.sendall(b"%04x" % len(request) + request)
+            status = self._read_exact(4)
+            if status != b"OKAY":
+                message = self._read_message().decode("utf-8", "replace")
+                raise ConnectionError(f"adb server refused device tracking: {message}")
+            # short timeout so that ctrl+c isn't blocked while waiting for changes
+            self._sock.settimeout(0.5)
+        except BaseException:
+            # __exit__ isn't called if __enter__ fails
+            self._sock.close()
+            raise
+        return self
+
+    def __exit__(self, *exc_info):
+        self._sock.close()
+
+    def _read_exact(self, length):
+        data = b""
+        while len(data) < length:
+            try:
+                chunk = self._sock.recv(length - len(data))
+            except socket.timeout:
+                continue
+            if not chunk:
+                raise ConnectionError("adb server closed the connection")
+            data += chunk
+        return data
+
+    def _read_message(self):
+        length = int(self._read_exact(4), 16)
+        return self._read_exact(length)
+
+    def updates(self):
+        # yields the current list of devices each time it changes
+        while True:
+            yield parse_device_list(self._read_message().decode("utf-8", "replace"))
+
+
+@dataclass
+class LogEntry:
+    timestamp: float
+    pid: int
+    tid: int
+    priority: int
+    tag: str
+    message: str
+
+    # Unreal logs everything under one logcat tag, with the log category at the start of the message
+    _category_match = re.compile(r"^(?:\[[^\]]*\])*\s*(\w+):")
+
+    def category(self):
+        m = self._category_match.match(self.message)
+        if m is None:
+            return None
+        return m.group(1)
+
+    def format(self):
+        # same layout as adb logcat -v threadtime
+        time_text = datetime.fromtimestamp(self.timestamp).strftime(
+            "%m-%d %H:%M:%S"
+        )
+        millis = int(self.timestamp * 1000) % 1000
+        priority = LOG_PRIORITIES[self.priority]
+        prefix = f"{time_text}.{millis:03d} {self.pid:5d} {self.tid:5d} {priority} {self.tag}: "
+        lines = self.message.splitlines() or [""]
+        return "".join(prefix + line + "\n" for line in lines)
+
+
+def read_logcat_binary(stream):
+    # parse the output of adb logcat -B, which is a sequence of struct logger_entry
+    header = struct.Struct("<HHiIIi")
+    while True:
+        data = stream.read(header.size)
+        if len(data) < header.size:
+            return
+        payload_len, header_size, pid, tid, sec, nsec = header.unpack(data)
+        # v1 entries have no header size field, later versions add extra fields we don't need
+        if header_size > header.size:
+            stream.read(header_size - header.size)
+        payload = stream.read(payload_len)
+        if len(payload) < payload_len:
+            return
+        if payload_len < 2:
+            continue
+        tag, _, message = payload[1:].partition(b"\0")
+        yield LogEntry(
+            sec + nsec / 1e9,
+            pid,
+            tid,
+            min(payload[0], len(LOG_PRIORITIES) - 1),
+            tag.decode("utf-8", "replace"),
+            message.rstrip(b"\0").decode("utf-8", "replace").rstrip("\n"),
+        )
+
+
+# Logs are indexed in blocks of about this much text. Rotated segments are gzipped a
+# block per gzip member, so that any block can be decompressed without the rest.
+LOG_INDEX_BLOCK = 256 * 1024
+LOG_INDEX_VERSION = 1
+LOG_INDEX_MAGIC = b"DVLI"
+# "MM-DD HH:MM:SS.mmm  pid  tid P tag: message"
+LOG_LINE_MATCH = re.compile(rb"\d\d-\d\d \d\d:\d\d:\d\d\.\d{3}\s+(\d+)\s+\d+ [VDIWEFS] (.*?): ")
+
+
+def log_index_path(log_path):
+    log_path = Path(log_path)
+    return log_path.with_name(log_path.name + ".idx")
+
+
+class LogIndexBuilder:
+    # Collects a log's index as it is written: the byte range and time range of each
+    # block, and the offset of every line for each logcat tag, Unreal log category and PID.
+    def __init__(self):
+        self.block_offsets = array("q")
+        self.block_start_times = array("d")
+        self.block_end_times = array("d")
+        self.compressed_offsets = None
+        self.tags = {}
+        self.pids = {}
+        self.lines = 0
+
+    def add_line(self, offset, timestamp, tag=None, pid=None, category=None):
+        if len(self.block_offsets) == 0 or (
+            offset - self.block_offsets[-1] >= LOG_INDEX_BLOCK
+        ):
+            self.block_offsets.append(offset)
+            self.block_start_times.append(float("inf"))
+            self.block_end_times.append(float("-inf"))
+        self.lines += 1
+        if timestamp is None:
+            return
+        # logcat merges its buffers, so timestamps aren't quite in order
+        if timestamp < self.block_start_times[-1]:
+            self.block_start_times[-1] = timestamp
+        if timestamp > self.block_end_times[-1]:
+            self.block_end_times[-1] = timestamp
+        for key in (tag, category):
+            if key is not None:
+                self.tags.setdefault(key, array("q")).append(offset)
+        if pid is not None:
+            self.pids.setdefault(pid, array("q")).append(offset)
+
+    def add_entry(self, offset, data, entry: LogEntry):
+        # multi-line messages are written as one line per message line
+        line_start = offset
+        for line in data.splitlines(keepends=True):
+            self.add_line(
+                line_start, entry.timestamp, entry.tag, entry.pid, entry.category()
+            )
+            line_start += len(line)
+
+    def write(self, log_path, text_size):
+        # header is JSON, followed by the arrays in native byte order
+        log_path = Path(log_path)
+        stat = log_path.stat()
+        times = [t for t in self.block_start_times if t != float("inf")]
+        start_time = min(times, default=None)
+        end_time = max(
+            (t for t in self.block_end_times if t != float("-inf")), default=None
+        )
+        tables = [self.block_offsets + array("q", [text_size])]
+        if self.compressed_offsets is not None:
+            tables.append(self.compressed_offsets + array("q", [stat.st_size]))
+        tables += [self.block_start_times, self.block_end_times]
+        # line offsets take half the space if the log is under 4GB
+        offset_type = "I" if text_size < 2**32 else "q"
+        lists = {}
+        list_start = 0
+        for kind, offsets in (("tags", self.tags), ("pids", self.pids)):
+            lists[kind] = {}
+            for key, key_offsets in offsets.items():
+                lists[kind][str(key)] = [list_start, len(key_offsets)]
+                list_start += len(key_offsets)
+                tables.append(array(offset_type, key_offsets))
+        header = {
+            "version": LOG_INDEX_VERSION,
+            "log_size": stat.st_size,
+            "log_mtime_ns": stat.st_mtime_ns,
+            "text_size": text_size,
+            "lines": self.lines,
+            "blocks": len(self.block_offsets),
+            "compressed": self.compressed_offsets is not None,
+            "offset_type": offset_type,
+            "start_time": start_time,
+            "end_time": end_time,
+            "year": datetime.fromtimestamp(start_time or time.time()).year,
+            **lists,
+        }
+        header_data = json.dumps(header).encode("utf-8")
+        # pad so the arrays are 8 byte aligned
+        header_data += b" " * (-(len(header_data) + 8) % 8)
+        with open(log_index_path(log_path), "wb") as f:
+            f.write(LOG_INDEX_MAGIC + struct.pack("<I", len(header_data)) + header_data)
+            for table in tables:
+                table.tofile(f)
+
+
+def build_log_index(log_path):
+    # index a log which was captured without one
+    log_path = Path(log_path)
+    index = LogIndexBuilder()
+    timestamps = LogTimestamps()
+    offset = 0
+    opener = gzip.open if log_path.suffix == ".gz" else open
+    with opener(log_path, "rb") as f:
+        for line in f:
+            m = LOG_LINE_MATCH.match(line)
+            if m is None:
+                index.add_line(offset, None)
+            else:
+                # adb pads short tags, e.g. "DEBUG   : "
+                tag = m.group(2).decode("utf-8", "replace").rstrip()
+                message = line[m.end() :].decode("utf-8", "replace")
+                category = LogEntry._category_match.match(message)
+                index.add_line(
+                    offset,
+                    timestamps.parse(line[:19].decode("ascii", "replace")),
+                    tag,
+                    int(m.group(1)),
+                    category.group(1) if category else None,
+                )
+            offset += len(line)
+    index.write(log_path, offset)
+
+
+class LogIndex:
+    # Reads a log through its index, only touching the blocks that can match a query.
+    def __init__(self, log_path):
+        self.log_path = Path(log_path)
+        with open(log_index_path(log_path), "rb") as f:
+            self._index_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._index_map[:4] != LOG_INDEX_MAGIC:
+            raise ValueError(f"{log_index_path(log_path)} is not a log index")
+        (header_size,) = struct.unpack_from("<I", self._index_map, 4)
+        self.header = json.loads(self._index_map[8 : 8 + header_size])
+        self._tables_start = 8 + header_size
+        blocks = self.header["blocks"]
+        self.block_offsets = self._table("q", 0, blocks + 1)
+        table_pos = blocks + 1
+        self.compressed_offsets = None
+        if self.header["compressed"]:
+            self.compressed_offsets = self._table("q", table_pos * 8, blocks + 1)
+            table_pos += blocks + 1
+        self.block_start_times = self._table("d", table_pos * 8, blocks)
+        self.block_end_times = self._table("d", (table_pos + blocks) * 8, blocks)
+        self._lists_start = (table_pos + blocks * 2) * 8
+        self._log_file = None
+        self._log_map = None
+        self._block_cache = (None, None)
+
+    def _table(self, typecode, position, count):
+        table = array(typecode)
+        start = self._tables_start + position
+        table.frombytes(self._index_map[start : start + count * table.itemsize])
+        return table
+
+    def stale(self):
+        stat = self.log_path.stat()
+        return (
+            self.header["version"] != LOG_INDEX_VERSION
+            or self.header["log_size"] != stat.st_size
+            or self.header["log_mtime_ns"] != stat.st_mtime_ns
+        )
+
+    def close(self):
+        self._index_map.close()
+        if self._log_map is not None:
+            self._log_map.close()
+        if self._log_file is not None:
+            self._log_file.close()
+
+    def line_offsets(self, kind, keys):
+        # sorted offsets of all lines with any of these tags / pids
+        found = []
+        for key in keys:
+            position = self.header[kind].get(str(key))
+            if position is not None:
+                offset_type = self.header["offset_type"]
+                found.append(
+                    self._table(
+                        offset_type,
+                        self._lists_start + position[0] * array(offset_type).itemsize,
+                        position[1],
+                    )
+                )
+        if len(found) == 1:
+            return found[0]
+        return sorted(set().union(*found))
+
+    def blocks_between(self, since=None, until=None):
+        return [
+            block
+            for block in range(self.header["blocks"])
+            if (since is None or self.block_end_times[block] >= since)
+            and (until is None or self.block_start_times[block] <= until)
+        ]
+
+    def block_text(self, block):
+        if self._block_cache[0] == block:
+            return self._block_cache[1]
+        start, end = self.block_offsets[block], self.block_offsets[block + 1]
+        if self._log_file is None:
+            self._log_file = open(self.log_path, "rb")
+            if self.log_path.suffix == ".gz" and self.compressed_offsets is None:
+                # gzipped as a single stream, so seeking means decompressing up to there
+                self._log_file = gzip.open(self._log_file, "rb")
+            elif self.log_path.stat().st_size > 0:
+                self._log_map = mmap.mmap(
+                    self._log_file.fileno(), 0, access=mmap.ACCESS_READ
+                )
+        if self.compressed_offsets is not None:
+            data = zlib.decompress(
+                self._log_map[
+                    self.compressed_offsets[block] : self.compressed_offsets[block + 1]
+                ],
+                wbits=31,
+            )
+        elif self._log_map is not None:
+            data = self._log_map[start:end]
+        else:
+            self._log_file.seek(start)
+            data = self._log_file.read(end - start)
+        self._block_cache = (block, data)
+        return data
+
+    def block_lines(self, block, offsets=None, grep=None):
+        # yields the lines of a block, or just the lines starting at the given offsets
+        data = self.block_text(block)
+        block_start = self.block_offsets[block]
+        if offsets is not None:
+            starts = (offset - block_start for offset in offsets)
+        elif grep is not None:
+            # search the whole block at once, then find the lines the matches are on
+            starts = []
+            search_pos = 0
+            while (m := grep.search(data, search_pos)) is not None:
+                line_start = data.rfind(b"\n", 0, m.start()) + 1
+                starts.append(line_start)
+                search_pos = data.find(b"\n", m.end())
+                if search_pos == -1:
+                    break
+            grep = None
+        else:
+            yield from data.splitlines()
+            return
+        for line_start in starts:
+            line_end = data.find(b"\n", line_start)
+            line = data[line_start : line_end if line_end != -1 else len(data)]
+            if grep is None or grep.search(line):
+                yield line
+
+    def query(self, tags=None, pids=None, since=None, until=None, grep=None):
+        offsets = None
+        if tags:
+            offsets = self.line_offsets("tags", tags)
+        if pids:
+            pid_offsets = self.line_offsets("pids", pids)
+            offsets = (
+                pid_offsets
+                if offsets is None
+                else sorted(set(offsets).intersection(pid_offsets))
+            )
+        timestamps = LogTimestamps(self.header["year"])
+        for block in self.blocks_between(since, until):
+            block_offsets = None
+            if offsets is not None:
+                block_offsets = offsets[
+                    bisect.bisect_left(offsets, self.block_offsets[block]) : (
+                        bisect.bisect_left(offsets, self.block_offsets[block + 1])
+                    )
+                ]
+                if len(block_offsets) == 0:
+                    continue
+            for line in self.block_lines(block, block_offsets, grep):
+                text = line.decode("utf-8", "replace")
+                if since is not None or until is not None:
+                    timestamp = timestamps.parse(text)
+                    if (
+                        timestamp is None
+                        or (since is not None and timestamp < since)
+                        or (until is not None and timestamp > until)
+                    ):
+                        continue
+                yield text
+
+
+def open_log_index(log_path):
+    # index the log if it has no index or has changed since it was indexed
+    log_path = Path(log_path)
+    index = None
+    if log_index_path(log_path).exists():
+        index = LogIndex(log_path)
+        if index.stale():
+            index.close()
+            index = None
+    if index is None:
+        print(f"Indexing {log_path}", file=sys.stderr)
+        build_log_index(log_path)
+        index = LogIndex(log_path)
+    return index
+
+
+def log_segments(log_path):
+    # a rotated capture is saved as numbered segments next to where the log would be
+    log_path = Path(log_path)
+    if log_path.exists():
+        return [log_path]
+    segments = log_path.parent.glob(
+        f"{glob.escape(log_path.stem)}-[0-9][0-9][0-9]{log_path.suffix}*"
+    )
+    return sorted(
+        (p for p in segments if p.suffix != ".idx"),
+        key=lambda p: p.name.removesuffix(".gz"),
+    )
+
+
+class LogcatCapture:
+    # Streams adb logcat to file, filtering as it goes. If rotation is set, the log is
+    # written in numbered segments and finished segments are gzipped in the background.
+    def __init__(
+        self,
+        log_path: Path,
+        serial=None,
+        tags=None,
+        min_priority="V",
+        rotate_bytes=None,
+        rotate_seconds=None,
+    ):
+        self.log_path = Path(log_path)
+        self.serial = serial
+        self.tags = set(tags) if tags else None
+        self.min_priority = LOG_PRIORITIES.index(min_priority)
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+        self.segments = []
+        self.entry_count = 0
+        self._proc = None
+        self._reader = None
+        self._out = None
+        self._index = None
+        self._compressor = None
+
+    def _wanted(self, entry: LogEntry):
+        if entry.priority < self.min_priority:
+            return False
+        if self.tags is None or entry.tag in self.tags:
+            return True
+        category = entry.category()
+        return category is not None and (
+            category in self.tags or category.removeprefix("Log") in self.tags
+        )
+
+    def _rotating(self):
+        return self.rotate_bytes is not None or self.rotate_seconds is not None
+
+    def _open_segment(self):
+        if self._rotating():
+            path = self.log_path.with_name(
+                f"{self.log_path.stem}-{len(self.segments):03d}{self.log_path.suffix}"
+            )
+        else:
+            path = self.log_path
+        self.segments.append(path)
+        self._out = open(path, "wb")
+        self._index = LogIndexBuilder()
+        self._segment_bytes = 0
+        self._segment_start = time.monotonic()
+
+    def _close_segment(self):
+        self._out.close()
+        self._out = None
+        if self._rotating():
+            self._compressor.submit(
+                self._compress, self.segments[-1], self._index, self._segment_bytes
+            )
+        else:
+            self._index.write(self.segments[-1], self._segment_bytes)
+
+    def _compress(self, path: Path, index: LogIndexBuilder, text_size):
+        # one gzip member per index block, so queries can decompress single blocks
+        gz_path = path.with_name(path.name + ".gz")
+        index.compressed_offsets = array("q")
+        block_ends = list(index.block_offsets[1:]) + [text_size]
+        with open(path, "rb") as f_in, open(gz_path, "wb") as f_out:
+            for block_start, block_end in zip(index.block_offsets, block_ends):
+                index.compressed_offsets.append(f_out.tell())
+                f_out.write(gzip.compress(f_in.read(block_end - block_start)))
+        index.write(gz_path, text_size)
+        path.unlink()
+        self.segments[self.segments.index(path)] = gz_path
+
+    def _read(self):
+        for entry in read_logcat_binary(self._proc.stdout):
+            if not self._wanted(entry):
+                continue
+            data = entry.format().encode("utf-8")
+            self._index.add_entry(self._segment_bytes, data, entry)
+            self._out.write(data)
+            self._segment_bytes += len(data)
+            self.entry_count += 1
+            if (
+                self.rotate_bytes is not None and self._segment_bytes >= self.rotate_bytes
+            ) or (
+                self.rotate_seconds is not None
+                and time.monotonic() - self._segment_start >= self.rotate_seconds
+            ):
+                self._close_segment()
+                self._open_segment()
+
+    def start(self):
+        cmdline = [ADB]
+        if self.serial:
+            cmdline += ["-s", self.serial]
+        # exec-out, because adb shell can mangle line endings in binary output
+        cmdline += ["exec-out", "logcat", "-B"]
+        self._compressor = ThreadPoolExecutor(max_workers=1)
+        self._open_segment()
+        self._proc = subprocess.Popen(
+            cmdline, stdout=subprocess.PIPE, bufsize=1024 * 1024
+        )
+        self._reader = threading.Thread(target=self._read, daemon=True)
+        self._reader.start()
+
+    def stop(self):
+        if self._proc.poll() is None:
+            self._proc.terminate()
+        # the reader drains whatever adb wrote before it exited, so the tail isn't lost
+        self._reader.join()
+        self._proc.wait()
+        self._close_segment()
+        self._compressor.shutdown(wait=True)
+
+    def is_running(self):
+        return self._reader is not None and self._reader.is_alive()
+
+    def run(self):
+        # capture until adb exits or ctrl+c
+        self.start()
+        try:
+            while self.is_running():
+                self._reader.join(0.5)
+        except KeyboardInterrupt:
+            print("Stopping log capture")
+        finally:
+            self.stop()
+        print(f"Captured {self.entry_count} log lines to", *self.segments)
+
+
+class Mp4Parser:
+    # Reads the sample tables of an MP4 (ISO-BMFF) file through mmap, so only the boxes
+    # we look at are ever read - the media data itself is never touched. Tables are
+    # copied out into numpy arrays, so that nothing still refers to the map when it is
+    # closed, even if parsing fails part way.
+    CONTAINER_BOXES = {b"moov", b"trak", b"mdia", b"minf", b"stbl", b"edts"}
+
+    def __init__(self, np, mm):
+        self.np = np
+        self.mm = mm
+
+    def boxes(self, start, end):
+        # yields (type, payload start, box end)
+        pos = start
+        while pos + 8 <= end:
+            size, box_type = struct.unpack_from(">I4s", self.mm, pos)
+            header = 8
+            if size == 1:
+                (size,) = struct.unpack_from(">Q", self.mm, pos + 8)
+                header = 16
+            elif size == 0:
+                size = end - pos
+            if size < header:
+                return
+            yield box_type, pos + header, min(pos + size, end)
+            pos += size
+
+    def find(self, start, end, box_type):
+        for found_type, payload, box_end in self.boxes(start, end):
+            if found_type == box_type:
+                return payload, box_end
+        return None
+
+    def find_path(self, start, end, path):
+        for box_type in path:
+            found = self.find(start, end, box_type)
+            if found is None:
+                return None
+            start, end = found
+        return start, end
+
+    def table(self, offset, count, columns=1):
+        table = self.np.frombuffer(
+            self.mm, dtype=">u4", count=count * columns, offset=offset
+        ).astype(self.np.int64)
+        if columns > 1:
+            table = table.reshape(count, columns)
+        return table
+
+    def video_track(self):
+        moov = self.find(0, len(self.mm), b"moov")
+        if moov is None:
+            return None
+        for box_type, payload, box_end in self.boxes(*moov):
+            if box_type != b"trak":
+                continue
+            hdlr = self.find_path(payload, box_end, [b"mdia", b"hdlr"])
+            if hdlr is not None and self.mm[hdlr[0] + 8 : hdlr[0] + 12] == b"vide":
+                return payload, box_end
+        return None
+
+    def sample_description(self, stbl):
+        stsd, _ = self.find(*stbl, b"stsd")
+        # first sample entry, after version/flags and entry count
+        entry = stsd + 8
+        size, codec = struct.unpack_from(">I4s", self.mm, entry)
+        width, height = struct.unpack_from(">HH", self.mm, entry + 32)
+        info = {
+            "codec": codec.decode("ascii", "replace"),
+            "width": width,
+            "height": height,
+            "profile": None,
+            "level": None,
+        }
+        # codec configuration boxes follow the 86 byte visual sample entry
+        for box_type, payload, _ in self.boxes(entry + 86, entry + size):
+            if box_type == b"avcC":
+                info["profile"] = self.mm[payload + 1]
+                info["level"] = self.mm[payload + 3] / 10
+            elif box_type == b"hvcC":
+                info["profile"] = self.mm[payload + 1] & 0x1F
+                info["level"] = self.mm[payload + 12] / 30
+        return info
+
+    def inspect(self, window_seconds=1.0):
+        np = self.np
+        track = self.video_track()
+        if track is None:
+            return None
+        mdia = self.find(*track, b"mdia")
+        mdhd, _ = self.find(*mdia, b"mdhd")
+        if self.mm[mdhd] == 1:
+            timescale, duration = struct.unpack_from(">IQ", self.mm, mdhd + 20)
+        else:
+            timescale, duration = struct.unpack_from(">II", self.mm, mdhd + 12)
+        stbl = self.find_path(*mdia, [b"minf", b"stbl"])
+        info = self.sample_description(stbl)
+        info["duration"] = duration / timescale
+
+        stts, _ = self.find(*stbl, b"stts")
+        (entry_count,) = struct.unpack_from(">I", self.mm, stts + 4)
+        stts_table = self.table(stts + 8, entry_count, 2)
+        deltas = np.repeat(stts_table[:, 1], stts_table[:, 0])
+        frame_count = len(deltas)
+        if frame_count == 0:
+            # fragmented MP4, sample tables are in the fragments instead
+            info["fragmented"] = True
+            return info
+        # in timescale units, as float seconds would put frames either side of a window
+        sample_ticks = np.cumsum(deltas) - deltas
+        sample_times = sample_ticks / timescale
+        media_duration = deltas.sum() / timescale
+        info["frames"] = frame_count
+        info["fps"] = frame_count / media_duration
+
+        stsz, _ = self.find(*stbl, b"stsz")
+        sample_size, sample_count = struct.unpack_from(">II", self.mm, stsz + 4)
+        if sample_size != 0:
+            sizes = np.full(sample_count, sample_size, dtype=np.int64)
+        else:
+            sizes = self.table(stsz + 12, sample_count)
+        sizes = sizes[:frame_count]
+        info["mean_bitrate_mbps"] = sizes.sum() * 8 / media_duration / 1e6
+        # peak bitrate over any window, using cumulative sizes at each frame
+        total_bytes = np.concatenate([[0], np.cumsum(sizes)])
+        window_ticks = round(window_seconds * timescale)
+        window_end = np.searchsorted(sample_ticks, sample_ticks + window_ticks)
+        window_bits = (total_bytes[window_end] - total_bytes[: len(sizes)]) * 8
+        peak = int(window_bits.argmax())
+        info["peak_bitrate_mbps"] = window_bits[peak] / window_seconds / 1e6
+        info["peak_bitrate_time"] = float(sample_times[peak])
+
+        stss = self.find(*stbl, b"stss")
+        if stss is None:
+            # no sync sample table means every frame is a keyframe
+            keyframe_times = sample_times
+        else:
+            (keyframe_count,) = struct.unpack_from(">I", self.mm, stss[0] + 4)
+            keyframes = self.table(stss[0] + 8, keyframe_count) - 1
+            keyframe_times = sample_times[keyframes[keyframes < frame_count]]
+        intervals = np.diff(np.append(keyframe_times, media_duration))
+        info["keyframes"] = len(keyframe_times)
+        info["max_keyframe_interval"] = float(intervals.max())
+        info["mean_keyframe_interval"] = float(intervals.mean())
+        return info
+
+
+def inspect_video(path, window_seconds=1.0):
+    np = import_numpy()
+    with open(path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            info = Mp4Parser(np, mm).inspect(window_seconds)
+        finally:
+            mm.close()
+    if info is not None:
+        info = {
+            k: float(v) if isinstance(v, np.floating) else v for k, v in info.items()
+        }
+    return info
+
+
+def check_video(info, limits: DecoderLimits):
+    problems = []
+    if info["codec"] not in limits.codecs:
+        problems.append(f"codec {info['codec']} not supported")
+    pixels = info["width"] * info["height"]
+    if (
+        pixels > limits.max_width * limits.max_height
+        or max(info["width"], info["height"]) > max(limits.max_width, limits.max_height)
+    ):
+        problems.append(
+            f"resolution {info['width']}x{info['height']} "
+            f"over {limits.max_width}x{limits.max_height}"
+        )
+    elif "fps" in info and pixels * info["fps"] > (
+        limits.max_width * limits.max_height * limits.max_fps
+    ):
+        problems.append(
+            f"{info['fps']:.1f}fps at {info['width']}x{info['height']} is too high a "
+            f"pixel rate (max {limits.max_fps}fps at {limits.max_width}x{limits.max_height})"
+        )
+    if info.get("peak_bitrate_mbps", 0) > limits.max_bitrate_mbps:
+        problems.append(
+            f"peak bitrate {info['peak_bitrate_mbps']:.1f}Mbps "
+            f"over {limits.max_bitrate_mbps}Mbps at {info['peak_bitrate_time']:.1f}s"
+        )
+    if info.get("max_keyframe_interval", 0) > limits.max_keyframe_interval:
+        problems.append(
+            f"keyframe interval up to {info['max_keyframe_interval']:.1f}s "
+            f"(max {limits.max_keyframe_interval}s)"
+        )
+    return problems
+
+
+def open_log(path):
+    # logs are plain text, or gzipped if they came from a rotated capture
+    path = Path(path)
+    if path.suffix == ".gz":
+        return gzip.open(path, "rt", encoding="utf-8", errors="replace")
+    return open(path, "rt", encoding="utf-8", errors="replace")
+
+
+# things we pull out of captured logs
+# FPSDisplay prints the current frame rate, e.g. "FPS: 71.9"
+FPS_MATCH = re.compile(r"\bFPS\b[:=\s]+([0-9]+(?:\.[0-9]*)?)", re.IGNORECASE)
+FRAME_TIME_MATCH = re.compile(
+    r"\bframe ?time\b[:=\s]+([0-9]+(?:\.[0-9]*)?)\s*ms", re.IGNORECASE
+)
+DROP_MATCH = re.compile(
+    r"\bdropp?(?:ed|ing)?\b.*\bframes?\b|\bframes?\b.*\bdropp?(?:ed|ing)?\b",
+    re.IGNORECASE,
+)
+DECODE_MATCH = re.compile(r"MediaCodec|\bdecod(?:e|er|ed|ing)\b", re.IGNORECASE)
+LOAD_MAP_MATCH = re.compile(r"LoadMap: .*?/Game/(\w+)")
+RENDER_MODE_MATCH = re.compile(r"\brender ?mode\b\W*(\w+)", re.IGNORECASE)
+THREADTIME_MATCH = re.compile(r"(\d\d)-(\d\d) (\d\d):(\d\d):(\d\d)\.(\d{3}) ")
+# where frame time samples came from: FPS readings are averages over a period, so
+# 1000/fps isn't the time of any one frame, whereas frame time lines are per frame
+SAMPLE_SOURCES = ["sampled fps", "frame times"]
+
+
+class LogTimestamps:
+    # logcat threadtime lines have no year, and parsing every date is slow,
+    # so dates are converted once per minute and cached
+    def __init__(self, year=None):
+        self.year = year or datetime.now().year
+        self._minutes = {}
+
+    def parse(self, line):
+        m = THREADTIME_MATCH.match(line)
+        if m is None:
+            return None
+        minute_key = line[:11]
+        minute_start = self._minutes.get(minute_key)
+        if minute_start is None:
+            month, day, hour, minute = (int(x) for x in m.groups()[:4])
+            minute_start = datetime(self.year, month, day, hour, minute).timestamp()
+            self._minutes[minute_key] = minute_start
+        return minute_start + int(m.group(5)) + int(m.group(6)) / 1000
+
+
+class LogSamples:
+    # Frame timing samples from a log, kept in compact arrays. Memory depends on the
+    # number of samples, not the size of the log, which is streamed a line at a time.
+    def __init__(self):
+        self.timestamps = array("d")
+        self.frame_times = array("f")
+        self.sample_sources = array("b")
+        self.sample_segments = array("i")
+        # (label, start time, end time, drop count, decode message count)
+        self.segments = []
+        self.lines = 0
+        self.drops = 0
+        self.decode_messages = 0
+        self._timestamps = LogTimestamps()
+        self._last_time = 0.0
+
+    def _start_segment(self, label, timestamp):
+        if len(self.segments) > 0 and self.segments[-1][0] == label:
+            return
+        self.segments.append([label, timestamp, timestamp, 0, 0])
+
+    def add_line(self, line):
+        self.lines += 1
+        timestamp = self._timestamps.parse(line)
+        if timestamp is None:
+            timestamp = self._last_time
+        self._last_time = timestamp
+        if len(self.segments) == 0:
+            self._start_segment("start", timestamp)
+        segment = self.segments[-1]
+        segment[2] = timestamp
+
+        if "FPS" in line or "fps" in line:
+            m = FPS_MATCH.search(line)
+            if m is not None and float(m.group(1)) > 0:
+                self._add_sample(timestamp, 1000.0 / float(m.group(1)), 0)
+                return
+        if "ime" in line:
+            m = FRAME_TIME_MATCH.search(line)
+            if m is not None:
+                self._add_sample(timestamp, float(m.group(1)), 1)
+                return
+        if "LoadMap" in line:
+            m = LOAD_MAP_MATCH.search(line)
+            if m is not None:
+                self._start_segment(m.group(1), timestamp)
+                return
+        if "ode" in line:
+            m = RENDER_MODE_MATCH.search(line)
+            if m is not None:
+                self._start_segment(m.group(1).lower(), timestamp)
+                return
+        if DROP_MATCH.search(line):
+            self.drops += 1
+            segment[3] += 1
+        elif DECODE_MATCH.search(line):
+            self.decode_messages += 1
+            segment[4] += 1
+
+    def _add_sample(self, timestamp, frame_time, source):
+        self.timestamps.append(timestamp)
+        self.frame_times.append(frame_time)
+        self.sample_sources.append(source)
+        self.sample_segments.append(len(self.segments) - 1)
+
+    def add_log(self, path):
+        with open_log(path) as f:
+            for line in f:
+                self.add_line(line)
+
+
+def frame_time_stats(np, frame_times, hitch_ms=None):
+    if len(frame_times) == 0:
+        return {"samples": 0}
+    p50, p95, p99 = np.percentile(frame_times, [50, 95, 99])
+    mean = float(frame_times.mean())
+    if hitch_ms is None:
+        # anything taking twice as long as a typical frame
+        hitch_ms = 2 * p50
+    return {
+        "samples": int(len(frame_times)),
+        "mean_ms": mean,
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+        "max_ms": float(frame_times.max()),
+        "mean_fps": 1000.0 / mean,
+        "hitch_ms": float(hitch_ms),
+        "hitches": int((frame_times > hitch_ms).sum()),
+    }
+
+
+def sample_stats(np, frame_times, sample_sources, hitch_ms=None):
+    # per frame times if the log has them, otherwise times from the FPS readings, which
+    # smooth out single slow frames so percentiles and hitches are of averages
+    per_frame = sample_sources == 1
+    source = 1 if per_frame.any() else 0
+    return {
+        "source": SAMPLE_SOURCES[source],
+        **frame_time_stats(np, frame_times[sample_sources == source], hitch_ms),
+    }
+
+
+def import_numpy():
+    try:
+        import numpy
+    except ImportError:
+        print("This command needs numpy, install it with 'pip install numpy'")
+        sys.exit(-1)
+    return numpy
+
+
+def analyze_logs(log_paths, hitch_ms=None, warmup_seconds=0):
+    np = import_numpy()
+    samples = LogSamples()
+    for path in log_paths:
+        samples.add_log(path)
+    frame_times = np.frombuffer(samples.frame_times, dtype=np.float32).astype(
+        np.float64
+    )
+    sample_sources = np.frombuffer(samples.sample_sources, dtype=np.int8)
+    sample_segments = np.frombuffer(samples.sample_segments, dtype=np.int32)
+    if warmup_seconds > 0 and len(frame_times) > 0:
+        timestamps = np.frombuffer(samples.timestamps, dtype=np.float64)
+        keep = timestamps >= timestamps[0] + warmup_seconds
+        frame_times = frame_times[keep]
+        sample_sources = sample_sources[keep]
+        sample_segments = sample_segments[keep]
+    results = {
+        "logs": [str(x) for x in log_paths],
+        "lines": samples.lines,
+        "drops": samples.drops,
+        "decode_messages": samples.decode_messages,
+        "overall": sample_stats(np, frame_times, sample_sources, hitch_ms),
+        "segments": [],
+    }
+    for segment_index, (label, start, end, drops, decodes) in enumerate(
+        samples.segments
+    ):
+        results["segments"].append(
+            {
+                "label": label,
+                "start": start,
+                "end": end,
+                "duration": end - start,
+                "drops": drops,
+                "decode_messages": decodes,
+                **sample_stats(
+                    np,
+                    frame_times[sample_segments == segment_index],
+                    sample_sources[sample_segments == segment_index],
+                    hitch_ms,
+                ),
+            }
+        )
+    return results
+
+
+def read_telemetry(path):
+    # the header and {column name: array} of a TelemetrySampler file
+    data = Path(path).read_bytes()
+    if data[:4] != TELEMETRY_MAGIC:
+        raise ValueError(f"{path} is not a telemetry file")
+    (header_size,) = struct.unpack_from("<I", data, 4)
+    header = json.loads(data[8 : 8 + header_size])
+    columns = {}
+    pos = 8 + header_size
+    for column in header["columns"]:
+        values = array(column["type"])
+        size = values.itemsize * header["rows"]
+        values.frombytes(data[pos : pos + size])
+        columns[column["name"]] = values
+        pos += size
+    return header, columns
+
+
+def telemetry_stats(np, header, columns, start=None, end=None):
+    # min, mean and max of each column over a time range of the log
+    times = np.frombuffer(columns["time"], dtype=np.float64)
+    keep = np.ones(len(times), dtype=bool)
+    if start is not None:
+        keep &= times >= start
+    if end is not None:
+        keep &= times <= end
+    stats = {}
+    for column in header["columns"][1:]:
+        values = np.frombuffer(columns[column["name"]], dtype=np.float32)[keep]
+        values = values[~np.isnan(values)]
+        if len(values) > 0:
+            stats[column["name"]] = {
+                "unit": column["unit"],
+                "min": float(values.min()),
+                "mean": float(values.mean()),
+                "max": float(values.max()),
+            }
+    return stats
+
+
+def print_telemetry_stats(label, stats):
+    for name, column in stats.items():
+        print(
+            f"{label:20} {name:24} min {column['min']:8.1f}  "
+            f"mean {column['mean']:8.1f}  max {column['max']:8.1f} {column['unit']}"
+        )
+
+
+def print_frame_stats(label, stats):
+    if stats["samples"] == 0:
+        print(f"{label:20} no frame samples")
+        return
+    if stats.get("source") == "frame times":
+        samples, hitches = "frames", "hitches"
+    else:
+        # only averages, so it is 1000/fps and slow samples, not frame times and hitches
+        samples, hitches = "fps samples", "slow samples"
+    print(
+        f"{label:20} {stats['samples']:8d} {samples}  {stats['mean_fps']:6.1f} fps  "
+        f"mean {stats['mean_ms']:6.2f}ms  p50 {stats['p50_ms']:6.2f}ms  "
+        f"p95 {stats['p95_ms']:6.2f}ms  p99 {stats['p99_ms']:6.2f}ms  "
+        f"{stats['hitches']} {hitches}"
+    )
+
+
 parser = argparse.ArgumentParser(
     prog="MakeReleases",
     description="Makes releases of directvideoexample for a particular target device",
 )
 
 subparsers = parser.add_subparsers(help="Command to run", required=True, dest="command")
+
+
+def add_log_arguments(subparser):
+    subparser.add_argument(
+        "--grablog",
+        "-g",
+        help="Run app and save log to log_<date>.txt",
+        action="store_true",
+    )
+    subparser.add_argument("--logname", "-l", help="Set log text file name")
+    subparser.add_argument(
+        "--logfilter",
+        nargs="+",
+        help="Only keep log lines with these logcat tags or Unreal log categories (e.g. DirectVideo LogPlayLevel Vulkan)",
+    )
+    subparser.add_argument(
+        "--logpriority",
+        default="V",
+        choices=list("VDIWEF"),
+        help="Only keep log lines of at least this priority",
+    )
+    subparser.add_argument(
+        "--logrotate-mb",
+        type=float,
+        help="Start a new gzipped log segment after this many megabytes",
+    )
+    subparser.add_argument(
+        "--logrotate-minutes",
+        type=float,
+        help="Start a new gzipped log segment after this many minutes",
+    )
+    subparser.add_argument(
+        "--trace",
+        help="Also record a Perfetto system trace, saved next to the log",
+        action="store_true",
+    )
+    subparser.add_argument(
+        "--telemetry",
+        nargs="?",
+        const=0.5,
+        type=float,
+        metavar="SECONDS",
+        help="Also sample device temperatures, clocks and app memory every SECONDS (default 0.5), saved next to the log",
+    )
+
+
+def add_device_arguments(subparser):
+    subparser.add_argument(
+        "--devices",
+        nargs="+",
+        help="Serials of the devices to install and run on, or 'all' for every connected device",
+    )
+
 parser_launch = subparsers.add_parser(
     "launch", help="Launch the uproject in Unreal Editor"
 )
@@ -220,18 +1440,42 @@ parser_build.add_argument(
 parser_build.add_argument(
     "--run", "-r", help="Run app after build", action="store_true"
 )
+add_log_arguments(parser_build)
+add_device_arguments(parser_build)
+parser_build.add_argument(
+    "--sanitizer", "-s", help="Set sanitizer", choices=["asan", "ubsan", "tsan"]
+)
+parser_build.add_argument(
+    "--skipbuild", "-sb", help="Skip the build step", action="store_true"
+)
 parser_build.add_argument(
-    "--grablog",
-    "-g",
-    help="Run app and save log to log_<date>.txt",
+    "--patch",
+    "-p",
+    help="For content changes, cook and push a patch pak against the last full build, then relaunch",
     action="store_true",
 )
-parser_build.add_argument("--logname", "-l", help="Set log text file name")
 parser_build.add_argument(
-    "--sanitizer", "-s", help="Set sanitizer", choices=["asan", "ubsan", "tsan"]
+    "--jobs",
+    "-j",
+    default=1,
+    type=int,
+    help="Build this many flavours in parallel, each in its own workspace (0 = as many as cores and memory allow)",
 )
 parser_build.add_argument(
-    "--skipbuild", "-sb", help="Skip the build step", action="store_true"
+    "--keep-generations",
+    type=int,
+    default=2,
+    help="Number of previous builds of each flavour to keep in Releases/.previous",
+)
+parser_build.add_argument(
+    "--rebuild",
+    help="Build even if the archived build is up to date with the project",
+    action="store_true",
+)
+parser_build.add_argument(
+    "--artifact-cache",
+    help="Shared folder of builds keyed on their input hash, so that other machines can reuse them",
+    type=Path,
 )
 validation_group = parser_build.add_mutually_exclusive_group()
 validation_group.add_argument(
@@ -240,12 +1484,21 @@ validation_group.add_argument(
 validation_group.add_argument(
     "--novalidation", help="Don't do vulkan validation", action="store_false"
 )
+# [(section, key, value)] set in DefaultEngine.ini for every flavour, for builds made
+# by other commands
+parser_build.set_defaults(engine_settings=[])
 parser_release = subparsers.add_parser("release", help="Upload github release")
 
 parser_release.add_argument("version", help="version tag for release")
 parser_release.add_argument(
     "--force", "-f", help="Update existing release if tag exists", action="store_true"
 )
+parser_release.add_argument(
+    "--jobs", "-j", type=int, default=4, help="Number of uploads to run at once"
+)
+parser_release.add_argument(
+    "--retries", type=int, default=5, help="Attempts per upload before giving up"
+)
 
 parser_run = subparsers.add_parser(
     "run", help="Run the project on device"
@@ -256,31 +1509,1117 @@ parser_run.add_argument(
     choices=[x.flavour_name for x in BUILD_FLAVOURS],
 )
 parser_run.add_argument("--development", "-d", help="Run development build", action="store_true")
-parser_run.add_argument(
-    "--grablog",
-    "-g",
-    help="Run app and save log to log_<date>.txt",
-    action="store_true",
+add_log_arguments(parser_run)
+add_device_arguments(parser_run)
+
+parser_analyze = subparsers.add_parser(
+    "analyze", help="Get frame timing statistics from captured logs"
+)
+parser_analyze.add_argument(
+    "logs", nargs="+", type=Path, help="Log files (or gzipped log segments) in order"
+)
+parser_analyze.add_argument(
+    "--hitch-ms",
+    type=float,
+    help="Frames longer than this count as hitches (default twice the median frame time)",
+)
+parser_analyze.add_argument(
+    "--telemetry",
+    type=Path,
+    help="Device telemetry recorded with the log (default: <log>.telemetry if there is one)",
 )
-parser_run.add_argument("--logname", "-l", help="Set log text file name")
+parser_analyze.add_argument("--json", type=Path, help="Save results to a JSON file")
 
+parser_crashes = subparsers.add_parser(
+    "crashes",
+    help="Summarise sanitizer reports and native crashes in logs",
+)
+parser_crashes.add_argument(
+    "logs",
+    nargs="*",
+    type=Path,
+    help="Logs, one per run, or the name a rotated log was captured as (default: latest log)",
+)
+parser_crashes.add_argument(
+    "--symbols",
+    nargs="+",
+    type=Path,
+    help="Extra unstripped .so files or folders (builds from here are found automatically)",
+)
+parser_crashes.add_argument(
+    "--frames", type=int, default=8, help="Number of stack frames to show per issue"
+)
+parser_crashes.add_argument("--json", type=Path, help="Save results to a JSON file")
 
-args = parser.parse_args()
+parser_log = subparsers.add_parser("log", help="Index and search captured device logs")
+log_subparsers = parser_log.add_subparsers(
+    help="Log command", required=True, dest="log_command"
+)
+parser_log_index = log_subparsers.add_parser(
+    "index", help="(Re)build the index of logs captured without one"
+)
+parser_log_index.add_argument("logs", nargs="+", type=Path, help="Log files")
+parser_log_query = log_subparsers.add_parser(
+    "query", help="Print matching lines from a log, using its index"
+)
+parser_log_query.add_argument(
+    "logs",
+    nargs="*",
+    type=Path,
+    help="Log files, or the name a rotated log was captured as (default: latest log)",
+)
+parser_log_query.add_argument(
+    "--tag", nargs="+", help="Only lines with these logcat tags or Unreal log categories"
+)
+parser_log_query.add_argument(
+    "--pid", nargs="+", type=int, help="Only lines from these process IDs"
+)
+parser_log_query.add_argument(
+    "--since",
+    help="Start time, as 'MM-DD HH:MM:SS.mmm', 'HH:MM:SS.mmm', or +seconds into the log",
+)
+parser_log_query.add_argument("--until", help="End time, in the same forms as --since")
+parser_log_query.add_argument("--grep", help="Only lines matching this regular expression")
+parser_log_query.add_argument(
+    "--ignore-case", "-i", help="Case insensitive --grep", action="store_true"
+)
 
-if getattr(args,"logname",None) is not None:
-    args.grablog = True
+parser_inspect_video = subparsers.add_parser(
+    "inspect-video", help="Check videos against each device's video decoder limits"
+)
+parser_inspect_video.add_argument(
+    "videos",
+    nargs="*",
+    type=Path,
+    help="MP4 files to check (default: the mp4 files in Content/Movies)",
+)
+parser_inspect_video.add_argument(
+    "--device",
+    nargs="+",
+    help="Devices to check against (default: all of them)",
+    choices=[x.flavour_name for x in BUILD_FLAVOURS],
+)
+parser_inspect_video.add_argument(
+    "--window", type=float, default=1.0, help="Seconds to measure peak bitrate over"
+)
+parser_inspect_video.add_argument("--json", type=Path, help="Save results to a JSON file")
 
-project_folder = Path(__file__).parent
+parser_ddc = subparsers.add_parser(
+    "ddc", help="Report on, trim or prewarm the per engine / flavour derived data caches"
+)
+ddc_subparsers = parser_ddc.add_subparsers(
+    help="DDC command", required=True, dest="ddc_command"
+)
+ddc_subparsers.add_parser("report", help="Show the size of each cache")
+parser_ddc_evict = ddc_subparsers.add_parser(
+    "evict", help="Delete least recently used cache files down to a size budget"
+)
+parser_ddc_evict.add_argument("budget", help="Total size to keep, e.g. 100G or 500M")
+parser_ddc_evict.add_argument(
+    "--dry-run", "-n", help="Only say what would be deleted", action="store_true"
+)
+parser_ddc_prune = ddc_subparsers.add_parser(
+    "prune", help="Delete caches for engine versions which aren't used any more"
+)
+parser_ddc_prune.add_argument(
+    "--engine-version",
+    nargs="+",
+    default=["5.5"],
+    help="Engine versions in use (flavour engine overrides are always kept)",
+)
+parser_ddc_prune.add_argument(
+    "--dry-run", "-n", help="Only say what would be deleted", action="store_true"
+)
+parser_ddc_prewarm = ddc_subparsers.add_parser(
+    "prewarm", help="Fill a flavour's cache in the background ahead of a build"
+)
+parser_ddc_prewarm.add_argument(
+    "device",
+    help="Flavour to prewarm the cache for",
+    choices=[x.flavour_name for x in BUILD_FLAVOURS],
+)
+parser_ddc_prewarm.add_argument(
+    "--ue-path", "-ue", default="c:\\epic\\", help="Path to Unreal Engine builds"
+)
+parser_ddc_prewarm.add_argument(
+    "--engine-version", default="5.5", help="Version of engine to use", type=str
+)
+parser_ddc_prewarm.add_argument(
+    "--target-platform",
+    default="Android_ASTC",
+    help="Cook platform to fill the cache for",
+)
+parser_ddc_prewarm.add_argument(
+    "--wait", "-w", help="Wait for the prewarm to finish", action="store_true"
+)
 
-project_short_name = project_folder.name
+parser_size = subparsers.add_parser(
+    "size", help="Show what takes up space in a build, or what changed between builds"
+)
+parser_size.add_argument(
+    "target",
+    help="Flavour name, release folder, or an apk / obb / zip / pak / utoc file",
+)
+parser_size.add_argument(
+    "--diff",
+    help="Flavour, folder or file to compare against, e.g. Releases/.previous/quest.1",
+)
+parser_size.add_argument(
+    "--depth", type=int, default=2, help="Folder depth to total sizes at"
+)
+parser_size.add_argument(
+    "--top", type=int, default=25, help="Number of folders to show"
+)
+parser_size.add_argument("--json", type=Path, help="Save results to a JSON file")
+
+parser_benchmark = subparsers.add_parser(
+    "benchmark", help="Measure frame timing on device for each render mode"
+)
+parser_benchmark.add_argument(
+    "device",
+    help="A device to run on.",
+    choices=[x.flavour_name for x in BUILD_FLAVOURS],
+)
+parser_benchmark.add_argument(
+    "--development", "-d", help="Run development build", action="store_true"
+)
+parser_benchmark.add_argument(
+    "--install", "-i", help="Install the build before benchmarking", action="store_true"
+)
+parser_benchmark.add_argument(
+    "--modes",
+    nargs="+",
+    default=["texture", "mesh"],
+    help="Render modes to measure, either texture, mesh or name=/Game/MapName",
+)
+parser_benchmark.add_argument(
+    "--duration", type=float, default=30, help="Seconds to measure each run for"
+)
+parser_benchmark.add_argument(
+    "--warmup", type=float, default=5, help="Seconds at the start of each run to ignore"
+)
+parser_benchmark.add_argument(
+    "--repeats", "-n", type=int, default=3, help="Number of runs of each mode"
+)
+parser_benchmark.add_argument("--output", "-o", type=Path, help="Results JSON file")
+parser_benchmark.add_argument(
+    "--baseline", type=Path, help="Earlier results file to check for regressions against"
+)
+parser_benchmark.add_argument(
+    "--max-regression",
+    type=float,
+    default=5,
+    help="Fail if fps or p95 frame time is this many percent worse than the baseline",
+)
+
+parser_harvest_pso = subparsers.add_parser(
+    "harvest-pso",
+    help="Record the shader pipelines the app uses and precompile them in the build",
+)
+parser_harvest_pso.add_argument(
+    "device",
+    nargs="+",
+    help="One or more flavours to harvest, or 'all'",
+    choices=[x.flavour_name for x in BUILD_FLAVOURS] + ["all"],
+)
+parser_harvest_pso.add_argument(
+    "--ue-path", "-ue", default="c:\\epic\\", help="Path to Unreal Engine builds"
+)
+parser_harvest_pso.add_argument(
+    "--engine-version", default="5.5", help="Version of engine to use", type=str
+)
+parser_harvest_pso.add_argument(
+    "--devices",
+    nargs="+",
+    help="Serial of the device to run each flavour on, in the same order",
+)
+parser_harvest_pso.add_argument(
+    "--modes",
+    nargs="+",
+    default=["texture", "mesh"],
+    help="Render modes to run, either texture, mesh or name=/Game/MapName",
+)
+parser_harvest_pso.add_argument(
+    "--duration", type=float, default=60, help="Seconds to run each mode for"
+)
+parser_harvest_pso.add_argument(
+    "--jobs", "-j", default=1, type=int, help="Build this many flavours in parallel"
+)
+# always a development build, as shipping builds can't record pipelines
+parser_harvest_pso.set_defaults(development=True)
+
+parser_stress_video = subparsers.add_parser(
+    "stress-video",
+    help="Find the video sizes, bitrates and codecs a device can play in each render mode",
+)
+parser_stress_video.add_argument(
+    "device",
+    help="A device to run on.",
+    choices=[x.flavour_name for x in BUILD_FLAVOURS],
+)
+parser_stress_video.add_argument(
+    "clips",
+    nargs="+",
+    type=Path,
+    help="Test clips, or folders of them, covering the resolutions, bitrates and codecs to try",
+)
+parser_stress_video.add_argument(
+    "--development", "-d", help="Run development build", action="store_true"
+)
+parser_stress_video.add_argument(
+    "--install", "-i", help="Install the build before testing", action="store_true"
+)
+parser_stress_video.add_argument(
+    "--modes",
+    nargs="+",
+    default=["texture", "mesh"],
+    help="Render modes to test, either texture, mesh or name=/Game/MapName",
+)
+parser_stress_video.add_argument(
+    "--duration", type=float, default=30, help="Seconds to play each clip for"
+)
+parser_stress_video.add_argument(
+    "--warmup", type=float, default=5, help="Seconds at the start of each run to ignore"
+)
+parser_stress_video.add_argument(
+    "--min-fps",
+    type=float,
+    help="Lowest app frame rate that counts as playable (default 90%% of the best clip's)",
+)
+parser_stress_video.add_argument(
+    "--max-drop-rate",
+    type=float,
+    default=1,
+    help="Most dropped frames per minute that counts as playable",
+)
+parser_stress_video.add_argument("--output", "-o", type=Path, help="Results JSON file")
+
+parser_daemon = subparsers.add_parser(
+    "daemon",
+    help="Run a long-lived daemon that takes build, run and benchmark jobs from submit",
+)
+parser_daemon.add_argument(
+    "--port", type=int, default=0, help="Local port to listen on (default: any free port)"
+)
+
+parser_submit = subparsers.add_parser(
+    "submit",
+    help="Run a build, run or benchmark command in the daemon and show its output, or list the daemon's jobs",
+)
+parser_submit.add_argument(
+    "--cancel",
+    type=int,
+    metavar="ID",
+    help="Cancel a job, stopping it if it is running",
+)
+parser_submit.add_argument(
+    "job",
+    nargs=argparse.REMAINDER,
+    help="The command and its arguments, e.g. 'build quest -d'. Identical jobs already in the daemon are joined",
+)
+
+
+def parse_arguments(argv=None):
+    args = parser.parse_args(argv)
+    if getattr(args, "logname", None) is not None:
+        args.grablog = True
+    if getattr(args, "trace", False):
+        args.grablog = True
+    if getattr(args, "telemetry", None):
+        args.grablog = True
+    return args
+
+
+project_folder = Path(__file__).parent
+
+project_short_name = project_folder.name
 
 
 project_file = list(project_folder.glob("*.uproject"))[0]
 defaultengine_file = project_folder / "Config/DefaultEngine.ini"
-if (args.command != "release") and getattr(args, "development", False):
-    release_folder = Path(__file__).parent / "DevReleases"
-else:
-    release_folder = Path(__file__).parent / "Releases"
+# set from the command line in main, development builds go in DevReleases
+release_folder = Path(__file__).parent / "Releases"
+
+
+PACKAGE_NAME = "com.YourCompany.DirectVideoExample"
+ACTIVITY_NAME = f"{PACKAGE_NAME}/com.epicgames.unreal.GameActivity"
+
+
+def device_project_folder():
+    # the project folder on the device's external storage
+    return (
+        f"/sdcard/Android/data/{PACKAGE_NAME}/files/UnrealGame/"
+        f"{project_file.stem}/{project_file.stem}"
+    )
+
+
+def device_pak_folder():
+    # paks here are mounted as well as the ones in the OBB
+    return f"{device_project_folder()}/Content/Paks"
+
+
+def find_flavour(flavour_name):
+    for f in BUILD_FLAVOURS:
+        if f.flavour_name == flavour_name:
+            return f
+    print(f"Unknown device {flavour_name}")
+    sys.exit(-1)
+
+
+def print_device_problems(devices):
+    if len(devices) == 0:
+        print("No Android device detected by adb. Please connect a device.")
+    for device in devices:
+        if device.state == "unauthorized":
+            print(f"Device {device.serial} is unauthorized, accept USB debugging on it")
+        elif not device.ready():
+            print(f"Device {device.serial} is {device.state}, waiting for it")
+
+
+def wait_for_device(serial=None):
+    # returns the connected devices which are ready to use (or just the one asked for)
+    def wanted(devices):
+        return [d for d in devices if d.ready() and serial in (None, d.serial)]
+
+    print("Checking for connected Android devices...")
+    for attempt in range(2):
+        try:
+            with DeviceTracker() as tracker:
+                for devices in tracker.updates():
+                    ready = wanted(devices)
+                    if len(ready) > 0:
+                        for device in ready:
+                            print(f"Found connected Android device {device}")
+                        return ready
+                    print_device_problems(devices)
+        except OSError:
+            if attempt == 0:
+                # probably no adb server running yet
+                subprocess.run([ADB, "start-server"], capture_output=True)
+
+    # can't talk to the adb server directly, so let adb do the waiting
+    while True:
+        cmdline = [ADB]
+        if serial:
+            cmdline += ["-s", serial]
+        subprocess.check_call(cmdline + ["wait-for-device"])
+        result = subprocess.run(
+            [ADB, "devices", "-l"], capture_output=True, text=True, check=True
+        )
+        devices = parse_device_list(result.stdout)
+        ready = wanted(devices)
+        if len(ready) > 0:
+            for device in ready:
+                print(f"Found connected Android device {device}")
+            return ready
+        print_device_problems(devices)
+        time.sleep(1)
+
+
+def adb_command(serial, *adb_args):
+    if serial:
+        return [ADB, "-s", serial, *adb_args]
+    return [ADB, *adb_args]
+
+
+def install_build(platform_folder, serial=None):
+    # find the install batch file, which takes an optional device serial
+    for b in platform_folder.glob("*.bat"):
+        if b.name.lower().startswith("install"):
+            cmdline = [str(b)]
+            if serial:
+                cmdline.append(serial)
+            subprocess.check_call(cmdline, shell=True, cwd=str(platform_folder))
+            break
+
+
+@dataclass
+class DeployFile:
+    local_path: Path
+    remote_path: str
+    size: int
+    sha256: str
+
+
+class DeployManifest:
+    # what we last put on each device, so unchanged files can be spotted from a
+    # cheap remote stat rather than hashing gigabytes of OBB on the device
+    def __init__(self, manifest_file: Path):
+        self.manifest_file = manifest_file
+        self.lock = threading.Lock()
+        self.devices = {}
+        if manifest_file.exists():
+            try:
+                self.devices = json.loads(manifest_file.read_text())
+            except ValueError:
+                pass
+
+    def get(self, serial, remote_path):
+        with self.lock:
+            return self.devices.get(serial, {}).get(remote_path)
+
+    def set(self, serial, remote_path, record):
+        with self.lock:
+            self.devices.setdefault(serial, {})[remote_path] = record
+            self.manifest_file.parent.mkdir(parents=True, exist_ok=True)
+            self.manifest_file.write_text(json.dumps(self.devices, indent=4))
+
+
+def plan_deploy(platform_folder):
+    # the files to put on a device, or None if this isn't a layout we can deploy natively
+    apks = sorted(platform_folder.glob("*.apk"))
+    if len(apks) == 0:
+        return None
+    hash_cache = FileHashCache(project_folder / "Saved" / "build_hash_cache.json")
+    files = []
+    for local_path in apks[:1] + sorted(platform_folder.glob("*.obb")):
+        if local_path.suffix == ".apk":
+            remote_path = "apk"
+        else:
+            remote_path = f"/sdcard/Android/obb/{PACKAGE_NAME}/{local_path.name}"
+        files.append(
+            DeployFile(
+                local_path,
+                remote_path,
+                local_path.stat().st_size,
+                hash_cache.file_hash(local_path),
+            )
+        )
+    hash_cache.save()
+    return files
+
+
+def adb_shell_output(serial, shell_command):
+    result = subprocess.run(
+        adb_command(serial, "shell", shell_command), capture_output=True, text=True
+    )
+    return result.stdout
+
+
+def remote_stats(serial, remote_paths):
+    # {path: [size, modified time]} for the files which exist on the device
+    quoted = " ".join(shlex.quote(x) for x in remote_paths)
+    stats = {}
+    output = adb_shell_output(serial, f"stat -c '%s %Y %n' {quoted} 2>/dev/null")
+    for line in output.splitlines():
+        parts = line.split(" ", 2)
+        if len(parts) == 3 and parts[0].isdigit():
+            stats[parts[2]] = [int(parts[0]), int(parts[1])]
+    return stats
+
+
+def remote_sha256(serial, remote_path):
+    output = adb_shell_output(
+        serial, f"sha256sum {shlex.quote(remote_path)} 2>/dev/null"
+    )
+    return output.split(" ", 1)[0] if output else None
+
+
+def installed_apk_path(serial):
+    output = adb_shell_output(serial, f"pm path {PACKAGE_NAME}").strip()
+    if not output.startswith("package:"):
+        return None
+    return output.splitlines()[0].removeprefix("package:")
+
+
+def remote_unchanged(serial, deploy_file, remote_path, stats, manifest):
+    # compares size first, then our record of what we pushed, and only then hashes on device
+    if stats.get(remote_path, [None])[0] != deploy_file.size:
+        return False
+    record = manifest.get(serial, deploy_file.remote_path)
+    if (
+        record is not None
+        and record["path"] == remote_path
+        and record["stat"] == stats[remote_path]
+    ):
+        return record["sha256"] == deploy_file.sha256
+    return remote_sha256(serial, remote_path) == deploy_file.sha256
+
+
+def install_apk(serial, apk_path):
+    for install_options in [["-r", "--streaming"], ["-r"]]:
+        result = subprocess.run(
+            adb_command(serial, "install", *install_options, str(apk_path)),
+            capture_output=True,
+            text=True,
+        )
+        output = result.stdout + result.stderr
+        if result.returncode == 0 and "Failure" not in output:
+            return
+        if "INSTALL_FAILED_UPDATE_INCOMPATIBLE" in output:
+            # signed with a different key, so the old one has to go first
+            subprocess.run(adb_command(serial, "uninstall", PACKAGE_NAME))
+    raise subprocess.CalledProcessError(result.returncode, "adb install", output)
+
+
+def remove_pushed_patch(serial, manifest):
+    # only the patch paks that push_patch recorded, not any the user put there
+    record = manifest.get(serial, "patch")
+    if record is None or len(record["paths"]) == 0:
+        return
+    quoted = " ".join(shlex.quote(x) for x in record["paths"])
+    adb_shell_output(serial, f"rm -f {quoted}")
+    manifest.set(serial, "patch", {"paths": []})
+
+
+def deploy_build(platform_folder, deploy_files, serial, manifest):
+    # install the APK and push OBBs, skipping anything already on the device
+    if deploy_files is None:
+        install_build(platform_folder, serial)
+        return
+    apk, obbs = deploy_files[0], deploy_files[1:]
+    obb_paths = [x.remote_path for x in obbs]
+    installed_path = installed_apk_path(serial)
+    stats = remote_stats(serial, [installed_path or "", *obb_paths])
+    if installed_path and remote_unchanged(
+        serial, apk, installed_path, stats, manifest
+    ):
+        print(f"{serial}: {apk.local_path.name} already installed")
+    else:
+        print(f"{serial}: installing {apk.local_path.name}")
+        install_apk(serial, apk.local_path)
+        installed_path = installed_apk_path(serial)
+        # n.b. reinstalling may have removed the OBBs
+        stats = remote_stats(serial, [installed_path or "", *obb_paths])
+    manifest.set(
+        serial,
+        apk.remote_path,
+        {
+            "path": installed_path,
+            "stat": stats.get(installed_path),
+            "sha256": apk.sha256,
+        },
+    )
+
+    for obb in obbs:
+        if remote_unchanged(serial, obb, obb.remote_path, stats, manifest):
+            print(f"{serial}: {obb.local_path.name} unchanged")
+        else:
+            print(f"{serial}: pushing {obb.local_path.name}")
+            subprocess.check_call(
+                adb_command(serial, "push", str(obb.local_path), obb.remote_path),
+                stdout=subprocess.DEVNULL,
+            )
+        manifest.set(
+            serial,
+            obb.remote_path,
+            {
+                "path": obb.remote_path,
+                "stat": remote_stats(serial, [obb.remote_path]).get(obb.remote_path),
+                "sha256": obb.sha256,
+            },
+        )
+
+    # a patch from build --patch would be mounted over the new build
+    remove_pushed_patch(serial, manifest)
+
+    for permission in ["READ_EXTERNAL_STORAGE", "WRITE_EXTERNAL_STORAGE"]:
+        subprocess.run(
+            adb_command(
+                serial,
+                "shell",
+                "pm",
+                "grant",
+                PACKAGE_NAME,
+                f"android.permission.{permission}",
+            ),
+            capture_output=True,
+        )
+
+
+def launch_args(unreal_cmdline=None):
+    launch = ["shell", "am", "start", "-n", ACTIVITY_NAME]
+    if unreal_cmdline:
+        # GameActivity appends the cmdline intent extra to the Unreal command line
+        launch += ["--es", "cmdline", shlex.quote(unreal_cmdline)]
+    return launch
+
+
+def launch_app(unreal_cmdline=None, serial=None):
+    subprocess.check_call(adb_command(serial, *launch_args(unreal_cmdline)))
+
+
+def stop_app(serial=None):
+    subprocess.check_call(
+        adb_command(serial, "shell", "am", "force-stop", PACKAGE_NAME)
+    )
+
+
+# Scheduling, CPU / GPU frequency, and atrace slices from the app and the media codec
+# services (MediaCodec shows up under the video category). Trace timestamps use the
+# realtime clock, the same as logcat, so trace and log line up without conversion.
+PERFETTO_CONFIG = """\
+buffers {{
+  size_kb: 65536
+  fill_policy: RING_BUFFER
+}}
+buffers {{
+  size_kb: 4096
+  fill_policy: RING_BUFFER
+}}
+data_sources {{
+  config {{
+    name: "linux.ftrace"
+    target_buffer: 0
+    ftrace_config {{
+      ftrace_events: "sched/sched_switch"
+      ftrace_events: "sched/sched_waking"
+      ftrace_events: "power/cpu_frequency"
+      ftrace_events: "power/cpu_idle"
+      ftrace_events: "power/gpu_frequency"
+      atrace_categories: "video"
+      atrace_categories: "gfx"
+      atrace_categories: "view"
+      atrace_apps: "{package}"
+      atrace_apps: "media.codec"
+      atrace_apps: "media.swcodec"
+    }}
+  }}
+}}
+data_sources {{
+  config {{
+    name: "linux.process_stats"
+    target_buffer: 1
+    process_stats_config {{
+      scan_all_processes_on_start: true
+    }}
+  }}
+}}
+builtin_data_sources {{
+  primary_trace_clock: BUILTIN_CLOCK_REALTIME
+}}
+write_into_file: true
+file_write_period_ms: 2500
+max_file_size_bytes: {max_bytes}
+"""
+PERFETTO_CONFIG_PATH = "/data/local/tmp/directvideo.pbtxt"
+PERFETTO_TRACE_FOLDER = "/data/misc/perfetto-traces"
+
+
+class PerfettoTrace:
+    # Records a system trace with the device's own perfetto, driven only through adb.
+    def __init__(self, trace_path: Path, serial=None, max_bytes=1024 * 1024 * 1024):
+        self.trace_path = Path(trace_path)
+        self.serial = serial
+        self.max_bytes = max_bytes
+        self.remote_path = f"{PERFETTO_TRACE_FOLDER}/{self.trace_path.name}"
+        self._pid = None
+
+    def start(self):
+        config_file = self.trace_path.with_name(self.trace_path.name + ".pbtxt")
+        config_file.write_text(
+            PERFETTO_CONFIG.format(package=PACKAGE_NAME, max_bytes=self.max_bytes)
+        )
+        subprocess.check_call(
+            adb_command(self.serial, "push", str(config_file), PERFETTO_CONFIG_PATH),
+            stdout=subprocess.DEVNULL,
+        )
+        config_file.unlink()
+        # tracing is off by default before Android 11
+        subprocess.run(
+            adb_command(self.serial, "shell", "setprop", "persist.traced.enable", "1")
+        )
+        # perfetto can't open files in /data/local/tmp itself, so the config goes on stdin
+        output = adb_shell_output(
+            self.serial,
+            f"cat {PERFETTO_CONFIG_PATH} | perfetto --txt -c - "
+            f"-o {self.remote_path} --background",
+        )
+        pids = re.findall(r"^\s*(\d+)\s*$", output, re.MULTILINE)
+        if len(pids) == 0:
+            raise subprocess.CalledProcessError(1, "perfetto", output)
+        self._pid = int(pids[-1])
+
+    def stop(self, timeout=30):
+        if self._pid is None:
+            return None
+        # perfetto writes out the rest of the trace when it gets SIGTERM
+        adb_shell_output(
+            self.serial,
+            f"kill -TERM {self._pid}; for i in $(seq {timeout * 10}); do "
+            f"kill -0 {self._pid} 2>/dev/null || break; sleep 0.1; done",
+        )
+        self._pid = None
+        subprocess.check_call(
+            adb_command(self.serial, "pull", self.remote_path, str(self.trace_path)),
+            stdout=subprocess.DEVNULL,
+        )
+        subprocess.run(adb_command(self.serial, "shell", "rm", "-f", self.remote_path))
+        return self.trace_path
+
+
+# Device telemetry, sampled alongside the log to tell thermal throttling and clock
+# drops apart from our own frame drops. Everything but memory is read from sysfs with
+# shell builtins in one adb shell session, so sampling starts no processes on device.
+TELEMETRY_MAGIC = b"DVTM"
+TELEMETRY_VERSION = 1
+TELEMETRY_END = "__telemetry_end__"
+# dumpsys meminfo is the one expensive sample, so it is taken less often
+TELEMETRY_MEMINFO_SECONDS = 5
+# the thermal zones worth watching, out of the dozens most devices have
+TELEMETRY_THERMAL_MATCH = re.compile(
+    r"cpu|gpu|skin|soc|battery|xo-therm|ddr", re.IGNORECASE
+)
+# (column name, unit, scale, sysfs path glob)
+TELEMETRY_SOURCES = [
+    ("cpu", "MHz", 1e-3, "/sys/devices/system/cpu/cpufreq/policy*/scaling_cur_freq"),
+    ("gpu", "MHz", 1e-6, "/sys/class/kgsl/kgsl-3d0/devfreq/cur_freq"),
+    ("gpu", "MHz", 1e-6, "/sys/class/devfreq/*.mali/cur_freq"),
+    ("battery", "C", 0.1, "/sys/class/power_supply/battery/temp"),
+]
+MEMINFO_TOTAL_MATCH = re.compile(r"^\s*TOTAL(?: PSS)?:?\s+(\d+)", re.MULTILINE)
+
+
+class TelemetrySampler:
+    # Samples device clocks, temperatures and app memory at a fixed rate, and writes
+    # them as columns (JSON header, then one array per column) when stopped. Times are
+    # on the same clock as timestamps parsed from the log.
+    def __init__(self, telemetry_path: Path, serial=None, interval=0.5):
+        self.telemetry_path = Path(telemetry_path)
+        self.serial = serial
+        self.interval = interval
+        self.columns = []
+        self.times = array("d")
+        self.values = []
+        self._scales = []
+        self._proc = None
+        self._thread = None
+        self._stopping = threading.Event()
+        self._time_offset = 0.0
+
+    def _command(self, command):
+        # run a command in the shell session, returns its output lines
+        self._proc.stdin.write(f"{command}; echo {TELEMETRY_END}\n")
+        self._proc.stdin.flush()
+        lines = []
+        for line in self._proc.stdout:
+            line = line.rstrip("\r\n")
+            if line == TELEMETRY_END:
+                return lines
+            lines.append(line)
+        raise OSError("adb shell exited")
+
+    def _discover(self):
+        # (path, name, unit, scale) of the sources this device has
+        sources = []
+        for name, unit, scale, path_glob in TELEMETRY_SOURCES:
+            for path in self._command(
+                f'for f in {path_glob}; do [ -r "$f" ] && echo "$f"; done'
+            ):
+                sources.append((path, name, unit, scale))
+        for line in self._command(
+            "for z in /sys/class/thermal/thermal_zone*; do "
+            'read t < "$z/type" && read v < "$z/temp" && echo "$z/temp $t"; done'
+        ):
+            path, _, zone_type = line.partition(" ")
+            if TELEMETRY_THERMAL_MATCH.search(zone_type):
+                sources.append((path, zone_type, "C", None))
+        return sources
+
+    def _set_up(self):
+        self._command("exec 2>/dev/null")
+        # logcat shows device local time, and log timestamps are parsed as host local
+        # time, so sample times are shifted the same way
+        lines = self._command("date +'%s.%N %z'; read u i < /proc/uptime; echo $u")
+        now, device_utc_offset = lines[0].split()
+        # older toolbox date has no %N
+        now = float(now.removesuffix(".%N"))
+        device_utc_offset = int(device_utc_offset[0] + "1") * (
+            int(device_utc_offset[1:3]) * 3600 + int(device_utc_offset[3:5]) * 60
+        )
+        host_utc_offset = datetime.fromtimestamp(now).astimezone().utcoffset()
+        self._time_offset = (
+            now - float(lines[1]) + device_utc_offset - host_utc_offset.total_seconds()
+        )
+
+        sources = self._discover()
+        names = [name for _, name, _, _ in sources]
+        reads = []
+        for index, (path, name, unit, scale) in enumerate(sources):
+            # number the columns for sources which there are several of, e.g. cpu0, cpu1
+            if names.count(name) > 1:
+                name = f"{name}{names[:index].count(name)}"
+            self.columns.append({"name": name, "unit": unit, "path": path})
+            self._scales.append(scale)
+            reads.append(f'v{index}=nan; read v{index} < "{path}"')
+        self.columns.append(
+            {"name": "app_pss", "unit": "MB", "path": "dumpsys meminfo"}
+        )
+        self.values = [array("f") for _ in self.columns]
+        variables = " ".join(f"$v{index}" for index in range(len(sources)))
+        self._command(
+            "s() { read u i < /proc/uptime; "
+            + "".join(f"{read}; " for read in reads)
+            + f'echo "$u {variables}"; }}'
+        )
+
+    def _memory_mb(self):
+        output = "\n".join(self._command(f"dumpsys meminfo {PACKAGE_NAME}"))
+        m = MEMINFO_TOTAL_MATCH.search(output)
+        return int(m.group(1)) / 1024 if m is not None else float("nan")
+
+    def _sample(self, with_memory):
+        fields = self._command("s")[0].split()
+        if len(fields) != len(self._scales) + 1:
+            raise ValueError(f"unexpected sample {fields}")
+        row = []
+        for scale, field in zip(self._scales, fields[1:]):
+            try:
+                value = float(field)
+            except ValueError:
+                value = float("nan")
+            if scale is None:
+                # thermal zones are mostly in millidegrees, a few in degrees
+                scale = 0.001 if abs(value) >= 500 else 1
+            row.append(value * scale)
+        row.append(self._memory_mb() if with_memory else float("nan"))
+        self.times.append(float(fields[0]) + self._time_offset)
+        for column, value in zip(self.values, row):
+            column.append(value)
+
+    def _run(self):
+        next_sample = time.monotonic()
+        next_memory = next_sample
+        try:
+            while not self._stopping.is_set():
+                now = time.monotonic()
+                self._sample(now >= next_memory)
+                if now >= next_memory:
+                    next_memory = now + TELEMETRY_MEMINFO_SECONDS
+                # fixed rate, skipping samples rather than bunching up if we fall behind
+                next_sample += self.interval
+                if next_sample < time.monotonic():
+                    next_sample = time.monotonic()
+                self._stopping.wait(next_sample - time.monotonic())
+        except (OSError, IndexError, ValueError) as e:
+            print(f"Telemetry stopped: {e}")
+
+    def start(self):
+        self._proc = subprocess.Popen(
+            adb_command(self.serial, "shell"),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            errors="replace",
+        )
+        self._set_up()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return None
+        self._stopping.set()
+        self._thread.join()
+        self._thread = None
+        try:
+            self._proc.stdin.close()
+        except OSError:
+            pass
+        self._proc.terminate()
+        self._proc.wait()
+        self.write()
+        return self.telemetry_path
+
+    def write(self):
+        # same layout as the log index, the arrays are 8 byte aligned after the header
+        header = {
+            "version": TELEMETRY_VERSION,
+            "serial": self.serial,
+            "interval": self.interval,
+            "rows": len(self.times),
+            "columns": [{"name": "time", "unit": "s", "type": "d"}]
+            + [{**column, "type": "f"} for column in self.columns],
+        }
+        header_data = json.dumps(header).encode("utf-8")
+        header_data += b" " * (-(len(header_data) + 8) % 8)
+        with open(self.telemetry_path, "wb") as f:
+            f.write(TELEMETRY_MAGIC + struct.pack("<I", len(header_data)) + header_data)
+            self.times.tofile(f)
+            for column in self.values:
+                column.tofile(f)
+
+
+def select_devices(args):
+    if args.devices is None:
+        devices = wait_for_device()
+        if len(devices) > 1:
+            print(f"Several devices connected, using {devices[0]} (see --devices)")
+        return devices[:1]
+    if "all" in args.devices:
+        return wait_for_device()
+    return [wait_for_device(serial)[0] for serial in args.devices]
+
+
+@dataclass
+class DeviceRunResult:
+    serial: str
+    model: str | None
+    installed: bool = False
+    launched: bool = False
+    log: str | None = None
+    log_lines: int = 0
+    trace: str | None = None
+    telemetry: str | None = None
+    error: str | None = None
+    seconds: float = 0
+
+
+async def adb_async(serial, *adb_args):
+    proc = await asyncio.create_subprocess_exec(
+        *adb_command(serial, *adb_args),
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT,
+    )
+    output, _ = await proc.communicate()
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, adb_args, output)
+    return output.decode("utf-8", "replace")
+
+
+async def start_on_device(
+    args, device, platform_folder, deploy_files, manifest, launch, log_name
+):
+    result = DeviceRunResult(device.serial, device.model)
+    capture = None
+    trace = None
+    sampler = None
+    start_time = time.monotonic()
+    try:
+        # the install step is a batch file or blocking adb calls, so gets a thread
+        await asyncio.to_thread(
+            deploy_build, platform_folder, deploy_files, device.serial, manifest
+        )
+        result.installed = True
+        if log_name is not None:
+            await adb_async(device.serial, "logcat", "-c")
+            capture = make_log_capture(args, log_name, device.serial)
+            capture.start()
+            result.log = str(log_name)
+            if args.trace:
+                trace_path = log_name.with_suffix(".perfetto-trace")
+                perfetto = PerfettoTrace(trace_path, device.serial)
+                await asyncio.to_thread(perfetto.start)
+                trace = perfetto
+            if args.telemetry:
+                sampler = TelemetrySampler(
+                    log_name.with_suffix(".telemetry"), device.serial, args.telemetry
+                )
+                await asyncio.to_thread(sampler.start)
+        if launch:
+            await adb_async(device.serial, *launch_args())
+            result.launched = True
+    except Exception as e:
+        # anything going wrong on one device is recorded for it, so the others carry
+        # on and what was started here is still stopped by run_on_devices
+        result.error = str(e) or type(e).__name__
+        print(f"{device}: {result.error}")
+    result.seconds = time.monotonic() - start_time
+    return result, capture, trace, sampler
+
+
+async def start_on_devices(args, devices, platform_folder, launch):
+    deploy_files = plan_deploy(platform_folder)
+    manifest = DeployManifest(project_folder / "Saved" / "deploy_manifest.json")
+    log_names = [None] * len(devices)
+    if args.grablog:
+        log_name = log_file_name(args)
+        if len(devices) == 1:
+            log_names = [log_name]
+        else:
+            log_names = [
+                log_name.with_name(f"{log_name.stem}-{device.serial}{log_name.suffix}")
+                for device in devices
+            ]
+    return await asyncio.gather(
+        *[
+            start_on_device(
+                args, device, platform_folder, deploy_files, manifest, launch, log_name
+            )
+            for device, log_name in zip(devices, log_names)
+        ]
+    )
+
+
+def save_trace(result, trace):
+    try:
+        result.trace = str(trace.stop())
+    except (subprocess.CalledProcessError, OSError) as e:
+        result.error = f"trace failed: {e}"
+        print(f"{result.serial}: {result.error}")
+
+
+def run_on_devices(args, platform_folder, launch=True):
+    # install (and launch) on every selected device at once, then capture their logs
+    devices = select_devices(args)
+    started = asyncio.run(start_on_devices(args, devices, platform_folder, launch))
+    results = [result for result, _, _, _ in started]
+    captures = [(result, capture) for result, capture, _, _ in started if capture]
+    traces = [(result, trace) for result, _, trace, _ in started if trace]
+    samplers = [(result, sampler) for result, _, _, sampler in started if sampler]
+    if len(captures) > 0:
+        print("Grabbing logs to", *[result.log for result, _ in captures])
+        print("Press ctrl+c to exit")
+        try:
+            while any(capture.is_running() for _, capture in captures):
+                time.sleep(0.5)
+        except KeyboardInterrupt:
+            print("Stopping log capture")
+        finally:
+            for result, sampler in samplers:
+                try:
+                    result.telemetry = str(sampler.stop())
+                except Exception as e:
+                    result.error = f"telemetry failed: {e}"
+                    print(f"{result.serial}: {result.error}")
+            for result, capture in captures:
+                capture.stop()
+                result.log_lines = capture.entry_count
+                result.log = " ".join(str(x) for x in capture.segments)
+            if len(traces) > 0:
+                print("Saving traces")
+                with ThreadPoolExecutor() as pool:
+                    for result, trace in traces:
+                        pool.submit(save_trace, result, trace)
+
+    for result in results:
+        status = "ok" if result.error is None else f"failed: {result.error}"
+        print(f"{result.serial} ({result.model}): {status} in {result.seconds:.1f}s")
+        if result.log:
+            print(f"    {result.log_lines} log lines in {result.log}")
+        if result.trace:
+            print(f"    trace in {result.trace}")
+        if result.telemetry:
+            print(f"    telemetry in {result.telemetry}")
+    if args.grablog and len(results) > 1:
+        summary_file = log_file_name(args).with_suffix(".devices.json")
+        summary_file.write_text(json.dumps([asdict(x) for x in results], indent=4))
+        print(f"Saved device results to {summary_file}")
+    if any(result.error is not None for result in results):
+        sys.exit(-1)
+
+
+def log_file_name(args):
+    if args.logname:
+        return project_folder / args.logname
+    now = datetime.now()
+    return project_folder / now.strftime(f"{project_short_name}-%Y_%m_%d-%H_%M_%S.txt")
+
+
+def make_log_capture(args, log_name, serial=None):
+    return LogcatCapture(
+        log_name,
+        serial=serial,
+        tags=args.logfilter,
+        min_priority=args.logpriority,
+        rotate_bytes=(
+            int(args.logrotate_mb * 1024 * 1024) if args.logrotate_mb else None
+        ),
+        rotate_seconds=(
+            args.logrotate_minutes * 60 if args.logrotate_minutes else None
+        ),
+    )
 
 
 def command_launch(args):
@@ -311,189 +2650,1100 @@ def command_launch(args):
         sys.exit(-1)
 
 
-def command_build(args):
-    use_validation_layer = False
-    if args.development:
-        use_validation_layer = args.novalidation
-    else:
-        use_validation_layer = args.validation
+# rough per-build resource needs of a RunUAT buildcookrun, used to limit parallel builds
+CORES_PER_BUILD = 8
+MEMORY_PER_BUILD = 16 * 1024 * 1024 * 1024
 
-    enabled_build_plugins = []
-    if "all" in args.device:
-        enabled_build_plugins = [f for f in BUILD_FLAVOURS if not f.dont_build]
-    else:
-        for f in BUILD_FLAVOURS:
-            if f.flavour_name in args.device:
-                enabled_build_plugins.append(f)
+# top level project items which are build outputs or local state, so aren't copied into build workspaces
+WORKSPACE_SKIP = [
+    "Binaries",
+    "DerivedDataCache",
+    "DevReleases",
+    "Intermediate",
+    "PSOHarvest",
+    "Releases",
+    "Saved",
+    "StressTests",
+    "Workspaces",
+]
+# build outputs at any depth (the project's and each plugin's) which stay in the
+# workspace between runs so that builds are incremental
+WORKSPACE_KEEP = ["Binaries", "Intermediate", "Saved"]
 
-    if args.install:
-        if len(enabled_build_plugins) != 1:
-            print("Can only call install with a single build flavour")
-            sys.exit(-1)
 
-    print("Building for:", [f.flavour_name for f in enabled_build_plugins])
-    print("*****************************")
+def available_memory_bytes():
+    if sys.platform == "win32":
+        import ctypes
 
-    orig_project_file = project_file.read_text()
-    uproject_data = json.loads(orig_project_file)
-    orig_defaultengine_file = defaultengine_file.read_text()
+        class MEMORYSTATUSEX(ctypes.Structure):
+            _fields_ = [
+                ("dwLength", ctypes.c_ulong),
+                ("dwMemoryLoad", ctypes.c_ulong),
+                ("ullTotalPhys", ctypes.c_ulonglong),
+                ("ullAvailPhys", ctypes.c_ulonglong),
+                ("ullTotalPageFile", ctypes.c_ulonglong),
+                ("ullAvailPageFile", ctypes.c_ulonglong),
+                ("ullTotalVirtual", ctypes.c_ulonglong),
+                ("ullAvailVirtual", ctypes.c_ulonglong),
+                ("ullAvailExtendedVirtual", ctypes.c_ulonglong),
+            ]
 
+        status = MEMORYSTATUSEX()
+        status.dwLength = ctypes.sizeof(MEMORYSTATUSEX)
+        if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+            return status.ullAvailPhys
+        return None
     try:
-        defaultengine_data = UnrealIni(orig_defaultengine_file)
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
 
-        release_folder.mkdir(exist_ok=True)
 
-        for current_flavour in enabled_build_plugins:
-            for all_flavour in BUILD_FLAVOURS:
-                enabled = all_flavour.flavour_name == current_flavour.flavour_name
-                plugin_found = all_flavour.update_uproject(uproject_data, enabled)
-                if not plugin_found and enabled and not all_flavour.dont_build:
-                    print(
-                        f"Plugin {all_flavour.plugin_name} not found in uproject file"
-                    )
-                    sys.exit(-1)
-                all_flavour.update_defaultengine(defaultengine_data, enabled)
-            if current_flavour.engine_version_override is None:
-                engine_path = Path(args.ue_path) / f"UE_{args.engine_version}"
-            else:
-                engine_path = (
-                    Path(args.ue_path) / f"UE_{current_flavour.engine_version_override}"
-                )
+def build_job_count(requested_jobs, flavour_count):
+    # jobs=0 means work it out from the machine
+    limits = [flavour_count]
+    if requested_jobs > 0:
+        limits.append(requested_jobs)
+    limits.append(max(1, (os.cpu_count() or 1) // CORES_PER_BUILD))
+    free_memory = available_memory_bytes()
+    if free_memory is not None:
+        limits.append(max(1, free_memory // MEMORY_PER_BUILD))
+    return max(1, min(limits))
 
-            # set derived data cache path to be different for each build flavour
-            # because e.g. quest, pico, and android versions of cached assets are incompatible
-            # and don't always get rebuilt if the plugins change
-            engine_version = (
-                current_flavour.engine_version_override or args.engine_version
-            )
-            os.environ["UE-LocalDataCachePath"] = str(
-                project_folder
-                / "DerivedDataCache"
-                / engine_version
-                / current_flavour.flavour_name
-            )
 
-            # do vulkan validation in dev builds (or if --validation is on)
-            for plugin_info in uproject_data["Plugins"]:
-                name = plugin_info["Name"]
-                if name == "AndroidVulkanValidation":
-                    plugin_info["Enabled"] = use_validation_layer
+def flavour_engine_version(args, flavour: BuildFlavour):
+    return flavour.engine_version_override or args.engine_version
 
-            project_file.write_text(json.dumps(uproject_data, indent=4))
-            defaultengine_file.write_text(defaultengine_data.reconstruct())
 
-            platform_folder = release_folder / current_flavour.flavour_name
-            if args.skipbuild:
-                print(f"Skipping build for {current_flavour.flavour_name}")
-            else:
-                intermediate_source_folder = Path("Intermediate\\Source")
-                # remove the intermediate source folder so that it is rebuilt
-                # because it has autogen project source files which are engine version dependent
-                if (project_folder / intermediate_source_folder).exists():
-                    shutil.rmtree(
-                        project_folder / intermediate_source_folder, ignore_errors=True
-                    )
-                print(
-                    f"Building for {current_flavour.flavour_name} in {platform_folder}"
-                )
-                if platform_folder.exists():
-                    shutil.rmtree(platform_folder, ignore_errors=True)
-                platform_folder.mkdir(exist_ok=True)
-                if args.development:
-                    config = "Development"
-                else:
-                    config = "Shipping"
-
-                cmdline = [
-                    f"{str(engine_path)}\\Engine\\Build\\BatchFiles\\RunUAT.bat",
-                    "buildcookrun",
-                    f"-project={str(project_file)}",
-                    "-platform=android",
-                    "-build",
-                    "-stage",
-                    "-skipbuildeditor",
-                    "-nocompileeditor",
-                    "-package",
-                    "-pak",
-                    "-cook",
-                    "-compressed",
-                    f"-configuration={config}",
-                    "-archive",
-                    f"-archivedirectory={platform_folder}",
-                ]
-                if args.sanitizer:
-                    cmdline.append(
-                        {
-                            "asan": "-EnableASan",
-                            "ubsan": "-EnableUBSan",
-                            "tsan": "-EnableTSan",
-                        }[args.sanitizer]
-                    )
-                subprocess.check_call(cmdline, shell=True)
-            # if the build is to a subfolder of the target folder (e.g. Android / Android_ASTC etc.) then move that up one
-            if (platform_folder / "Android").exists():
-                for x in (platform_folder / "Android").iterdir():
-                    shutil.move(x, platform_folder)
-
-            if args.install or args.run or args.grablog:
-                # Check for connected devices before install/run
-                while True:
-                    print("Checking for connected Android devices...")
-                    result = subprocess.run(
-                        ["adb", "devices"], capture_output=True, text=True
-                    )
-                    lines = result.stdout.strip().splitlines()
-                    if len(lines) < 2 or not any(line.strip() for line in lines[1:]):
-                        print(
-                            "No Android device detected by adb. Please connect a device and try again."
-                        )
-                        time.sleep(2)
-                    else:
-                        print("Found connected Android device")
-                        break
-                # find the install batch file
-                for b in platform_folder.glob("*.bat"):
-                    if b.name.lower().startswith("install"):
-                        subprocess.check_call(
-                            [str(b)], shell=True, cwd=str(platform_folder)
-                        )
-                        break
+def make_flavour_files(
+    orig_project_file,
+    orig_defaultengine_file,
+    build_flavours,
+    use_validation_layer,
+    engine_settings=(),
+):
+    # work out uproject and DefaultEngine.ini contents for each flavour
+    # n.b. this is cumulative, flavours are switched in the same order as the build loop always has
+    uproject_data = json.loads(orig_project_file)
+    defaultengine_data = UnrealIni(orig_defaultengine_file)
+    flavour_files = {}
+    for current_flavour in build_flavours:
+        for all_flavour in BUILD_FLAVOURS:
+            enabled = all_flavour.flavour_name == current_flavour.flavour_name
+            plugin_found = all_flavour.update_uproject(uproject_data, enabled)
+            if not plugin_found and enabled and not all_flavour.dont_build:
+                print(f"Plugin {all_flavour.plugin_name} not found in uproject file")
+                sys.exit(-1)
+            all_flavour.update_defaultengine(defaultengine_data, enabled)
+        for section, key, value in engine_settings:
+            defaultengine_data.set_value(section, key, value)
 
-            if args.grablog:
-                subprocess.check_call(
-                    ["adb", "logcat", "-c"], shell=True, cwd=str(project_folder)
-                )
+        # do vulkan validation in dev builds (or if --validation is on)
+        for plugin_info in uproject_data["Plugins"]:
+            name = plugin_info["Name"]
+            if name == "AndroidVulkanValidation":
+                plugin_info["Enabled"] = use_validation_layer
 
-            if args.run or args.grablog:
-                subprocess.check_call(
-                    [
-                        "adb",
-                        "shell",
-                        "am",
-                        "start",
-                        "-n",
-                        "com.YourCompany.DirectVideoExample/com.epicgames.unreal.GameActivity",
-                    ]
-                )
+        flavour_files[current_flavour.flavour_name] = (
+            json.dumps(uproject_data, indent=4),
+            defaultengine_data.reconstruct(),
+        )
+    return flavour_files
 
-            if args.grablog:
-                if args.logname:
-                    log_name = args.logname
-                else:
-                    now = datetime.now()
-                    log_name = now.strftime(
-                        f"{project_short_name}-%Y_%m_%d-%H_%M_%S.txt"
-                    )
-                print(f"Grabbing log to {log_name}. Press ctrl+c to exit")
-                subprocess.check_call(
-                    ["adb", "logcat", ">", str(log_name)],
-                    shell=True,
-                    cwd=str(project_folder),
-                )
 
+def link_or_copy(src, dst):
+    # hard link files into a workspace so they don't take any space,
+    # falling back to a copy if that isn't possible (e.g. different drives)
+    dst = Path(dst)
+    if dst.exists():
+        if os.path.samefile(src, dst):
+            return dst
+        # never write through an existing link, or we would modify the original
+        dst.unlink()
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+    return dst
+
+
+def replace_with_copy(src, dst):
+    # a real copy, for files the build might write to
+    dst = Path(dst)
+    # unlink first, as copying over a hard link would write to the original
+    dst.unlink(missing_ok=True)
+    shutil.copy2(src, dst)
+    return dst
+
+
+def mirror_folder(src: Path, dst: Path, copy_function, skip):
+    # make dst the same as src, including removing anything deleted from src,
+    # apart from items that skip(name) is true for, which are left alone in dst
+    dst.mkdir(parents=True, exist_ok=True)
+    names = set()
+    for item in src.iterdir():
+        if skip(item.name):
+            continue
+        names.add(item.name)
+        target = dst / item.name
+        if item.is_dir():
+            if target.is_symlink() or target.is_file():
+                target.unlink()
+            mirror_folder(
+                item, target, copy_function, lambda name: name in WORKSPACE_KEEP
+            )
+        else:
+            if target.is_dir() and not target.is_symlink():
+                shutil.rmtree(target)
+            copy_function(item, target)
+    for target in list(dst.iterdir()):
+        if target.name in names or skip(target.name):
+            continue
+        if target.is_dir() and not target.is_symlink():
+            shutil.rmtree(target)
+        else:
+            target.unlink()
+
+
+def workspace_skip(name):
+    return (
+        name in WORKSPACE_SKIP
+        or name in WORKSPACE_KEEP
+        or name.startswith((".", "__"))
+        or name.endswith(".py")
+    )
+
+
+def make_workspace(flavour: BuildFlavour, uproject_text, defaultengine_text):
+    # a lightweight copy of the project for one flavour, so flavours can build side by side
+    # Intermediate, Saved etc. stay in the workspace between runs so that builds are incremental
+    workspace = project_folder / "Workspaces" / flavour.flavour_name
+    # Config is copied rather than linked, as the build may write to ini files in place
+    mirror_folder(
+        project_folder,
+        workspace,
+        link_or_copy,
+        lambda name: workspace_skip(name) or name == "Config",
+    )
+    mirror_folder(
+        project_folder / "Config",
+        workspace / "Config",
+        replace_with_copy,
+        lambda name: name in WORKSPACE_KEEP,
+    )
+    # the flavour specific files are real files, not links to the originals
+    workspace_project_file = workspace / project_file.name
+    workspace_defaultengine_file = workspace / "Config" / "DefaultEngine.ini"
+    for target, text in [
+        (workspace_project_file, uproject_text),
+        (workspace_defaultengine_file, defaultengine_text),
+    ]:
+        target.unlink(missing_ok=True)
+        target.write_text(text)
+    return workspace
+
+
+# UAT prints a banner at the start and end of each buildcookrun stage
+UAT_PHASE_MATCH = re.compile(
+    r"\*{5,}\s*(BUILD|COOK|STAGE|PACKAGE|ARCHIVE|DEPLOY)\s+COMMAND\s+(STARTED|COMPLETED)"
+)
+# pak / IoStore container creation happens inside the stage command
+UAT_PAK_MATCH = re.compile(r"UnrealPak|-run=IoStore|Creating pak", re.IGNORECASE)
+SHADERS_LEFT_MATCH = re.compile(r"shaders left to compile (\d+)", re.IGNORECASE)
+# e.g. "foo.cpp(12): warning C4996: ..." or "LogCook: Warning: ..."
+BUILD_WARNING_MATCH = re.compile(r"\bwarning\b\s*(?:[A-Z]+\d+\s*)?:", re.IGNORECASE)
+BUILD_ERROR_MATCH = re.compile(r"\berror\b\s*(?:[A-Z]+\d+\s*)?:", re.IGNORECASE)
+
+
+class BuildLogParser:
+    # Follows RunUAT output, timestamping the start and end of each phase and counting
+    # shader compiles, warnings and errors, for timing JSON and a chrome://tracing file.
+    MAX_MESSAGES = 100
+
+    def __init__(self, name):
+        self.name = name
+        self.start_time = time.time()
+        self._start = time.monotonic()
+        # [name, start, end] in seconds from the start of the build
+        self.phases = [["startup", 0.0, None]]
+        self.shaders_to_compile = 0
+        self.warnings = []
+        self.errors = []
+        self.warning_count = 0
+        self.error_count = 0
+        self.returncode = None
+
+    def _now(self):
+        return time.monotonic() - self._start
+
+    def _start_phase(self, name):
+        now = self._now()
+        if self.phases[-1][2] is None:
+            self.phases[-1][2] = now
+        self.phases.append([name, now, None])
+
+    def feed(self, line):
+        m = UAT_PHASE_MATCH.search(line)
+        if m is not None:
+            phase = m.group(1).lower()
+            if m.group(2) == "STARTED":
+                self._start_phase(phase)
+            else:
+                self._start_phase("between phases")
+            return
+        current_phase = self.phases[-1][0]
+        if current_phase == "stage" and UAT_PAK_MATCH.search(line):
+            self._start_phase("pak")
+        m = SHADERS_LEFT_MATCH.search(line)
+        if m is not None:
+            self.shaders_to_compile = max(self.shaders_to_compile, int(m.group(1)))
+        if BUILD_ERROR_MATCH.search(line):
+            self.error_count += 1
+            if len(self.errors) < self.MAX_MESSAGES:
+                self.errors.append(line.strip())
+        elif BUILD_WARNING_MATCH.search(line):
+            self.warning_count += 1
+            if len(self.warnings) < self.MAX_MESSAGES:
+                self.warnings.append(line.strip())
+
+    def finish(self, returncode):
+        self.returncode = returncode
+        self.phases[-1][2] = self._now()
+        # gaps between one phase's end banner and the next one's start are just noise
+        self.phases = [
+            p for p in self.phases if p[0] != "between phases" or p[2] - p[1] >= 1
+        ]
+
+    def timing(self):
+        phase_totals = {}
+        for name, start, end in self.phases:
+            phase_totals[name] = phase_totals.get(name, 0) + end - start
+        return {
+            "name": self.name,
+            "started": datetime.fromtimestamp(self.start_time).isoformat(
+                timespec="seconds"
+            ),
+            "total_seconds": self.phases[-1][2],
+            "returncode": self.returncode,
+            "phase_seconds": phase_totals,
+            "phases": [
+                {"name": name, "start": start, "end": end}
+                for name, start, end in self.phases
+            ],
+            "shaders_to_compile": self.shaders_to_compile,
+            "warning_count": self.warning_count,
+            "error_count": self.error_count,
+            "warnings": self.warnings,
+            "errors": self.errors,
+        }
+
+    def trace(self):
+        # chrome trace event format, times are in microseconds. pids have to be
+        # integers, so each build name gets a fixed one (so traces of parallel builds
+        # can be loaded together), and the name is set with a metadata event
+        pid = zlib.crc32(self.name.encode("utf-8")) & 0x7FFFFFFF
+        events = [
+            {"name": "process_name", "ph": "M", "pid": pid, "args": {"name": self.name}}
+        ]
+        events += [
+            {
+                "name": name,
+                "cat": "build",
+                "ph": "X",
+                "ts": int((self.start_time + start) * 1e6),
+                "dur": int((end - start) * 1e6),
+                "pid": pid,
+                "tid": 1,
+            }
+            for name, start, end in self.phases
+        ]
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def run_build_command(cmdline, env, name, prefix=None):
+    # streams the build output through BuildLogParser, showing it live and keeping
+    # a gzipped copy, then writes <name>-<date>.timing.json / .trace.json in BuildLogs
+    log_folder = project_folder / "BuildLogs"
+    log_folder.mkdir(exist_ok=True)
+    log_stem = log_folder / datetime.now().strftime(f"{name}-%Y_%m_%d-%H_%M_%S")
+    parser = BuildLogParser(name)
+    proc = subprocess.Popen(
+        cmdline,
+        shell=True,
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        errors="replace",
+    )
+    try:
+        with gzip.open(f"{log_stem}.log.gz", "wt", encoding="utf-8") as full_log:
+            for line in proc.stdout:
+                full_log.write(line)
+                parser.feed(line)
+                # parallel builds get their output prefixed so that it can be told apart
+                if prefix is None:
+                    print(line, end="", flush=True)
+                else:
+                    print(f"[{prefix}] {line}", end="", flush=True)
+        proc.wait()
     finally:
-        project_file.write_text(orig_project_file)
-        defaultengine_file.write_text(orig_defaultengine_file)
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        parser.finish(proc.returncode)
+        Path(f"{log_stem}.timing.json").write_text(
+            json.dumps(parser.timing(), indent=4)
+        )
+        Path(f"{log_stem}.trace.json").write_text(json.dumps(parser.trace()))
+    phase_seconds = parser.timing()["phase_seconds"]
+    phase_summary = ", ".join(
+        f"{phase} {seconds:.0f}s" for phase, seconds in phase_seconds.items()
+    )
+    print(
+        f"{name}: {phase_summary}, {parser.warning_count} warnings, "
+        f"{parser.error_count} errors, timings in {log_stem}.timing.json"
+    )
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmdline)
+
+
+def ddc_folder(engine_version, flavour_name):
+    return project_folder / "DerivedDataCache" / engine_version / flavour_name
+
+
+def build_configuration(args):
+    if args.development:
+        return "Development"
+    else:
+        return "Shipping"
+
+
+# project folders which feed into a build, hashed to tell if a flavour needs rebuilding
+BUILD_INPUT_FOLDERS = ["Build", "Config", "Content", "Plugins", "Source"]
+BUILD_MANIFEST_NAME = "build_manifest.json"
+# folders with code in, if these are unchanged a patch can use the last binaries
+SOURCE_INPUT_FOLDERS = ["Plugins", "Source"]
+
+
+def hash_file(path, digest=None):
+    if digest is None:
+        digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            digest.update(chunk)
+    return digest
+
+
+class FileHashCache:
+    # file hashes keyed on path, size and modification time,
+    # so that unchanged content doesn't get re-read on every build
+    def __init__(self, cache_file: Path):
+        self.cache_file = cache_file
+        self.hashes = {}
+        if cache_file.exists():
+            try:
+                self.hashes = json.loads(cache_file.read_text())
+            except ValueError:
+                pass
+
+    def file_hash(self, path: Path):
+        stat = path.stat()
+        key = str(path)
+        stamp = [stat.st_size, stat.st_mtime_ns]
+        cached = self.hashes.get(key)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        value = hash_file(path).hexdigest()
+        self.hashes[key] = [stamp, value]
+        return value
+
+    def tree_hash(self, folder: Path):
+        digest = hashlib.sha256()
+        if folder.exists():
+            for path in sorted(folder.rglob("*")):
+                rel_path = path.relative_to(folder)
+                if any(
+                    part in ("Binaries", "Intermediate", "Saved")
+                    for part in rel_path.parts
+                ):
+                    continue
+                if path.is_file():
+                    digest.update(rel_path.as_posix().encode())
+                    digest.update(self.file_hash(path).encode())
+        return digest.hexdigest()
+
+    def save(self):
+        self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+        self.cache_file.write_text(json.dumps(self.hashes))
+
+
+def build_input_hash(
+    args, flavour: BuildFlavour, uproject_text, defaultengine_text, hash_cache
+):
+    engine_version = flavour_engine_version(args, flavour)
+    engine_folder = Path(args.ue_path) / f"UE_{engine_version}" / "Engine"
+    digest = hashlib.sha256()
+    for value in [
+        flavour.flavour_name,
+        engine_version,
+        build_configuration(args),
+        args.sanitizer or "",
+        uproject_text,
+        defaultengine_text,
+    ]:
+        digest.update(value.encode())
+        digest.update(b"\0")
+    for folder in BUILD_INPUT_FOLDERS:
+        digest.update(hash_cache.tree_hash(project_folder / folder).encode())
+    # engine hotfix versions and marketplace plugin (e.g. DirectVideo) updates also need a rebuild
+    engine_files = [engine_folder / "Build" / "Build.version"]
+    engine_files += sorted(
+        (engine_folder / "Plugins" / "Marketplace").glob("*/*.uplugin")
+    )
+    for path in engine_files:
+        if path.exists():
+            digest.update(hash_cache.file_hash(path).encode())
+    return digest.hexdigest()
+
+
+def source_input_hash(args, flavour: BuildFlavour, workspace_folder: Path):
+    hash_cache = FileHashCache(project_folder / "Saved" / "build_hash_cache.json")
+    digest = hashlib.sha256()
+    for value in [
+        flavour_engine_version(args, flavour),
+        build_configuration(args),
+        args.sanitizer or "",
+        (workspace_folder / project_file.name).read_text(),
+    ]:
+        digest.update(value.encode())
+        digest.update(b"\0")
+    for folder in SOURCE_INPUT_FOLDERS:
+        digest.update(hash_cache.tree_hash(workspace_folder / folder).encode())
+    return digest.hexdigest()
+
+
+def release_version_folder(platform_folder: Path):
+    # UAT's record of what was cooked into the last full build, for patches to be
+    # made against. Starts with . so that release doesn't zip it
+    return platform_folder.with_name(f".release-version-{platform_folder.name}")
+
+
+def staging_folder_for(platform_folder: Path):
+    # starts with . so that release doesn't zip it
+    return platform_folder.with_name(f".staging-{platform_folder.name}")
+
+
+def swap_into_place(staging_folder: Path, platform_folder: Path, keep_generations):
+    # move a finished build into Releases/<flavour>, keeping the previous ones
+    # as .previous/<flavour>.1, .previous/<flavour>.2 etc.
+    previous_folder = platform_folder.parent / ".previous"
+    name = platform_folder.name
+    if platform_folder.exists():
+        previous_folder.mkdir(exist_ok=True)
+        oldest = previous_folder / f"{name}.{max(keep_generations, 1)}"
+        if oldest.exists():
+            shutil.rmtree(oldest)
+        for generation in range(keep_generations - 1, 0, -1):
+            older = previous_folder / f"{name}.{generation}"
+            if older.exists():
+                os.replace(older, previous_folder / f"{name}.{generation + 1}")
+        os.replace(platform_folder, previous_folder / f"{name}.1")
+    os.replace(staging_folder, platform_folder)
+    if keep_generations == 0:
+        shutil.rmtree(previous_folder / f"{name}.1", ignore_errors=True)
+
+
+def invalidate_intermediate_source(
+    workspace_folder: Path, engine_path: Path, engine_version
+):
+    # Intermediate/Source has autogenerated project source files which are engine version
+    # dependent, so it is removed and rebuilt, but only if the engine has changed since
+    # the last build in this workspace
+    stamp = engine_version
+    build_version_file = engine_path / "Engine" / "Build" / "Build.version"
+    if build_version_file.exists():
+        stamp += "\n" + build_version_file.read_text()
+    stamp_file = workspace_folder / "Intermediate" / "engine_version.stamp"
+    if stamp_file.exists() and stamp_file.read_text() == stamp:
+        return
+    intermediate_source_folder = workspace_folder / "Intermediate" / "Source"
+    if intermediate_source_folder.exists():
+        print(f"Engine changed, removing {intermediate_source_folder}")
+        shutil.rmtree(intermediate_source_folder, ignore_errors=True)
+    stamp_file.parent.mkdir(parents=True, exist_ok=True)
+    stamp_file.write_text(stamp)
+
+
+def read_build_manifest(folder: Path):
+    try:
+        return json.loads((folder / BUILD_MANIFEST_NAME).read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def write_build_manifest(
+    args, flavour: BuildFlavour, platform_folder, input_hash, source_hash=None
+):
+    manifest = {
+        "flavour": flavour.flavour_name,
+        "input_hash": input_hash,
+        "source_hash": source_hash,
+        "engine_version": flavour_engine_version(args, flavour),
+        "configuration": build_configuration(args),
+        "sanitizer": args.sanitizer,
+        "built": datetime.now().isoformat(timespec="seconds"),
+    }
+    (platform_folder / BUILD_MANIFEST_NAME).write_text(json.dumps(manifest, indent=4))
+
+
+def restore_cached_build(args, flavour: BuildFlavour, input_hash):
+    # true if the archived build for this flavour is already up to date,
+    # either in the release folder or in the shared artifact cache
+    platform_folder = release_folder / flavour.flavour_name
+    if args.rebuild:
+        return False
+    manifest = read_build_manifest(platform_folder)
+    if manifest is not None and manifest["input_hash"] == input_hash:
+        print(f"Build for {flavour.flavour_name} is up to date, skipping")
+        return True
+    if args.artifact_cache is None:
+        return False
+    cached_folder = Path(args.artifact_cache) / f"{flavour.flavour_name}-{input_hash}"
+    manifest = read_build_manifest(cached_folder)
+    if manifest is None or manifest["input_hash"] != input_hash:
+        return False
+    print(f"Using cached build for {flavour.flavour_name} from {cached_folder}")
+    staging_folder = staging_folder_for(platform_folder)
+    if staging_folder.exists():
+        shutil.rmtree(staging_folder, ignore_errors=True)
+    shutil.copytree(cached_folder, staging_folder)
+    swap_into_place(staging_folder, platform_folder, args.keep_generations)
+    return True
+
+
+def store_cached_build(args, flavour: BuildFlavour, input_hash):
+    if args.artifact_cache is None:
+        return
+    platform_folder = release_folder / flavour.flavour_name
+    cached_folder = Path(args.artifact_cache) / f"{flavour.flavour_name}-{input_hash}"
+    if cached_folder.exists():
+        return
+    # copy then rename, so other machines never see a half written build
+    temp_folder = cached_folder.with_name(cached_folder.name + f".tmp{os.getpid()}")
+    try:
+        shutil.copytree(platform_folder, temp_folder)
+        os.replace(temp_folder, cached_folder)
+        print(f"Stored build for {flavour.flavour_name} in {cached_folder}")
+    except OSError as e:
+        print(f"Couldn't store build in artifact cache: {e}")
+        shutil.rmtree(temp_folder, ignore_errors=True)
+
+
+def build_flavour(
+    args, current_flavour: BuildFlavour, workspace_folder, input_hash, prefix=None
+):
+    engine_version = flavour_engine_version(args, current_flavour)
+    engine_path = Path(args.ue_path) / f"UE_{engine_version}"
+    build_project_file = workspace_folder / project_file.name
+
+    # set derived data cache path to be different for each build flavour
+    # because e.g. quest, pico, and android versions of cached assets are incompatible
+    # and don't always get rebuilt if the plugins change
+    env = os.environ.copy()
+    env["UE-LocalDataCachePath"] = str(
+        ddc_folder(engine_version, current_flavour.flavour_name)
+    )
+
+    platform_folder = release_folder / current_flavour.flavour_name
+    version_folder = release_version_folder(platform_folder)
+    version_staging = version_folder.with_name(version_folder.name + ".new")
+    shutil.rmtree(version_staging, ignore_errors=True)
+    invalidate_intermediate_source(workspace_folder, engine_path, engine_version)
+    # archive into a staging folder, so that the last good build stays in place
+    # until this one has succeeded
+    staging_folder = staging_folder_for(platform_folder)
+    print(f"Building for {current_flavour.flavour_name} in {platform_folder}")
+    if staging_folder.exists():
+        shutil.rmtree(staging_folder, ignore_errors=True)
+    staging_folder.mkdir()
+    config = build_configuration(args)
+
+    cmdline = [
+        f"{str(engine_path)}\\Engine\\Build\\BatchFiles\\RunUAT.bat",
+        "buildcookrun",
+        f"-project={str(build_project_file)}",
+        "-platform=android",
+        "-build",
+        "-stage",
+        "-skipbuildeditor",
+        "-nocompileeditor",
+        "-package",
+        "-pak",
+        "-cook",
+        "-compressed",
+        f"-configuration={config}",
+        "-archive",
+        f"-archivedirectory={staging_folder}",
+        f"-createreleaseversion={current_flavour.flavour_name}",
+        f"-createreleaseversionbasepath={version_staging}",
+    ]
+    if args.sanitizer:
+        cmdline.append(
+            {
+                "asan": "-EnableASan",
+                "ubsan": "-EnableUBSan",
+                "tsan": "-EnableTSan",
+            }[args.sanitizer]
+        )
+    run_build_command(cmdline, env, current_flavour.flavour_name, prefix)
+    # if the build is to a subfolder of the target folder (e.g. Android / Android_ASTC etc.) then move that up one
+    if (staging_folder / "Android").exists():
+        for x in (staging_folder / "Android").iterdir():
+            shutil.move(x, staging_folder)
+        (staging_folder / "Android").rmdir()
+    write_build_manifest(
+        args,
+        current_flavour,
+        staging_folder,
+        input_hash,
+        source_input_hash(args, current_flavour, workspace_folder),
+    )
+    swap_into_place(staging_folder, platform_folder, args.keep_generations)
+    shutil.rmtree(version_folder, ignore_errors=True)
+    if version_staging.exists():
+        os.replace(version_staging, version_folder)
+    store_symbols(workspace_folder / "Binaries" / "Android")
+    store_cached_build(args, current_flavour, input_hash)
+
+
+def patch_build(args, current_flavour: BuildFlavour):
+    # Cooks just what changed and makes a patch pak against the last full build,
+    # using its binaries. Returns the patch files, or None if it needs a full build.
+    platform_folder = release_folder / current_flavour.flavour_name
+    version_folder = release_version_folder(platform_folder)
+    manifest = read_build_manifest(platform_folder)
+    if manifest is None or not version_folder.exists():
+        print(f"No full build of {current_flavour.flavour_name} to patch against")
+        return None
+    if manifest.get("source_hash") != source_input_hash(
+        args, current_flavour, project_folder
+    ):
+        print("Source has changed since the last full build")
+        return None
+
+    engine_version = flavour_engine_version(args, current_flavour)
+    engine_path = Path(args.ue_path) / f"UE_{engine_version}"
+    env = os.environ.copy()
+    env["UE-LocalDataCachePath"] = str(
+        ddc_folder(engine_version, current_flavour.flavour_name)
+    )
+    patch_folder = platform_folder.with_name(f".patch-{platform_folder.name}")
+    if patch_folder.exists():
+        shutil.rmtree(patch_folder, ignore_errors=True)
+    patch_folder.mkdir()
+    print(f"Patching {current_flavour.flavour_name} build in {platform_folder}")
+    # no -build, -package or -archive, the binaries and APK of the last build are kept
+    cmdline = [
+        f"{str(engine_path)}\\Engine\\Build\\BatchFiles\\RunUAT.bat",
+        "buildcookrun",
+        f"-project={str(project_file)}",
+        "-platform=android",
+        "-skipbuildeditor",
+        "-nocompileeditor",
+        "-cook",
+        "-iterate",
+        "-stage",
+        "-pak",
+        "-compressed",
+        f"-configuration={build_configuration(args)}",
+        f"-stagingdirectory={patch_folder}",
+        "-generatepatch",
+        f"-basedonreleaseversion={current_flavour.flavour_name}",
+        f"-basedonreleaseversionbasepath={version_folder}",
+    ]
+    run_build_command(cmdline, env, f"{current_flavour.flavour_name}-patch")
+    return sorted(
+        path
+        for path in patch_folder.rglob("*_P.*")
+        if path.suffix in (".pak", ".utoc", ".ucas")
+    )
+
+
+def push_patch(args, patch_files):
+    # replaces any earlier patch on each device, then restarts the app
+    remote_folder = device_pak_folder()
+    manifest = DeployManifest(project_folder / "Saved" / "deploy_manifest.json")
+    devices = select_devices(args)
+    for device in devices:
+        stop_app(device.serial)
+        remove_pushed_patch(device.serial, manifest)
+        adb_shell_output(device.serial, f"mkdir -p {remote_folder}")
+        remote_paths = []
+        for path in patch_files:
+            print(f"{device}: pushing {path.name} ({format_size(path.stat().st_size)})")
+            remote_paths.append(f"{remote_folder}/{path.name}")
+            # recorded before the push, so a half pushed file is cleared up too
+            manifest.set(device.serial, "patch", {"paths": list(remote_paths)})
+            subprocess.check_call(
+                adb_command(device.serial, "push", str(path), remote_paths[-1]),
+                stdout=subprocess.DEVNULL,
+            )
+        launch_app(None, device.serial)
+    if args.grablog:
+        make_log_capture(args, log_file_name(args), devices[0].serial).run()
+
+
+def build_parallel(args, build_flavours, flavour_files, jobs):
+    print(f"Building {len(build_flavours)} flavours, {jobs} at a time")
+
+    def build_in_workspace(flavour: BuildFlavour, input_hash):
+        start_time = time.monotonic()
+        workspace = make_workspace(flavour, *flavour_files[flavour.flavour_name])
+        build_flavour(args, flavour, workspace, input_hash, prefix=flavour.flavour_name)
+        return time.monotonic() - start_time
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {
+            executor.submit(build_in_workspace, f, input_hash): f
+            for f, input_hash in build_flavours
+        }
+        for future in as_completed(futures):
+            flavour_name = futures[future].flavour_name
+            try:
+                build_time = future.result()
+                print(f"Finished {flavour_name} in {build_time:.0f}s")
+            except (subprocess.CalledProcessError, OSError) as e:
+                print(f"Build failed for {flavour_name}: {e}")
+                failed.append(flavour_name)
+    if failed:
+        print("Failed builds:", failed)
+        sys.exit(-1)
+
+
+def command_build(args):
+    use_validation_layer = False
+    if args.development:
+        use_validation_layer = args.novalidation
+    else:
+        use_validation_layer = args.validation
+
+    enabled_build_plugins = []
+    if "all" in args.device:
+        enabled_build_plugins = [f for f in BUILD_FLAVOURS if not f.dont_build]
+    else:
+        for f in BUILD_FLAVOURS:
+            if f.flavour_name in args.device:
+                enabled_build_plugins.append(f)
+
+    if args.install:
+        if len(enabled_build_plugins) != 1:
+            print("Can only call install with a single build flavour")
+            sys.exit(-1)
+
+    print("Building for:", [f.flavour_name for f in enabled_build_plugins])
+    print("*****************************")
+
+    orig_project_file = project_file.read_text()
+    orig_defaultengine_file = defaultengine_file.read_text()
+    flavour_files = make_flavour_files(
+        orig_project_file,
+        orig_defaultengine_file,
+        enabled_build_plugins,
+        use_validation_layer,
+        args.engine_settings,
+    )
+
+    release_folder.mkdir(exist_ok=True)
+
+    if args.patch:
+        if len(enabled_build_plugins) != 1:
+            print("Can only patch a single build flavour")
+            sys.exit(-1)
+        start_time = time.monotonic()
+        current_flavour = enabled_build_plugins[0]
+        uproject_text, defaultengine_text = flavour_files[current_flavour.flavour_name]
+        try:
+            project_file.write_text(uproject_text)
+            defaultengine_file.write_text(defaultengine_text)
+            patch_files = patch_build(args, current_flavour)
+        finally:
+            project_file.write_text(orig_project_file)
+            defaultengine_file.write_text(orig_defaultengine_file)
+        if patch_files is not None:
+            if len(patch_files) == 0:
+                print("Nothing changed since the last full build")
+            push_patch(args, patch_files)
+            print(f"Patched in {time.monotonic() - start_time:.0f}s")
+            return
+        print("Doing a full build and install instead")
+        args.install = True
+
+    flavours_to_build = []
+    if args.skipbuild:
+        for current_flavour in enabled_build_plugins:
+            print(f"Skipping build for {current_flavour.flavour_name}")
+    else:
+        hash_cache = FileHashCache(project_folder / "Saved" / "build_hash_cache.json")
+        for current_flavour in enabled_build_plugins:
+            input_hash = build_input_hash(
+                args,
+                current_flavour,
+                *flavour_files[current_flavour.flavour_name],
+                hash_cache,
+            )
+            if not restore_cached_build(args, current_flavour, input_hash):
+                flavours_to_build.append((current_flavour, input_hash))
+        hash_cache.save()
+
+    jobs = build_job_count(args.jobs, len(flavours_to_build))
+    if len(flavours_to_build) == 0:
+        pass
+    elif jobs > 1 or args.jobs != 1:
+        # asking for parallel builds always builds in workspaces, and leaves the
+        # project's files alone, even when only one flavour needs building
+        build_parallel(args, flavours_to_build, flavour_files, jobs)
+    else:
+        try:
+            for current_flavour, input_hash in flavours_to_build:
+                uproject_text, defaultengine_text = flavour_files[
+                    current_flavour.flavour_name
+                ]
+                project_file.write_text(uproject_text)
+                defaultengine_file.write_text(defaultengine_text)
+                build_flavour(args, current_flavour, project_folder, input_hash)
+        finally:
+            project_file.write_text(orig_project_file)
+            defaultengine_file.write_text(orig_defaultengine_file)
+
+    for current_flavour in enabled_build_plugins:
+        platform_folder = release_folder / current_flavour.flavour_name
+
+        if args.install or args.run or args.grablog:
+            run_on_devices(args, platform_folder, launch=args.run or args.grablog)
+
+
+# files which are already compressed, so deflating them again is wasted time
+STORED_SUFFIXES = {
+    ".apk",
+    ".gz",
+    ".jpg",
+    ".mp4",
+    ".obb",
+    ".pak",
+    ".png",
+    ".ucas",
+    ".utoc",
+    ".zip",
+}
+
+
+def checksum_file(path: Path):
+    return path.with_name(path.name + ".sha256")
+
+
+def make_release_zip(folder: Path, zip_path: Path):
+    # runs in a worker process - files are streamed into the zip a chunk at a time
+    temp_path = zip_path.with_name(zip_path.name + ".tmp")
+    with zipfile.ZipFile(
+        temp_path, "w", compression=zipfile.ZIP_DEFLATED, allowZip64=True
+    ) as zf:
+        for path in sorted(folder.rglob("*")):
+            if not path.is_file():
+                continue
+            # our record of how the build was made, for the build cache, not the user
+            if path == folder / BUILD_MANIFEST_NAME:
+                continue
+            if path.suffix.lower() in STORED_SUFFIXES:
+                compress_type = zipfile.ZIP_STORED
+            else:
+                compress_type = zipfile.ZIP_DEFLATED
+            arcname = (Path(folder.name) / path.relative_to(folder)).as_posix()
+            zf.write(path, arcname, compress_type=compress_type)
+    checksum = hash_file(temp_path).hexdigest()
+    os.replace(temp_path, zip_path)
+    checksum_file(zip_path).write_text(f"{checksum}  {zip_path.name}\n")
+    return zip_path, checksum
+
+
+class ReleaseApi:
+    # Just the parts of the GitHub releases REST API that we need. GITHUB_API_URL can
+    # point it at a local stand-in server, which has to give its own upload_url.
+    def __init__(self, repo, token, api_url=None):
+        self.repo = repo
+        self.token = token
+        self.api_url = (
+            api_url or os.environ.get("GITHUB_API_URL", "https://api.github.com")
+        ).rstrip("/")
+
+    def request(self, method, url, data=None, headers=None, timeout=60):
+        if not url.startswith(("http://", "https://")):
+            url = f"{self.api_url}/repos/{self.repo}/{url}"
+        request = urllib.request.Request(
+            url,
+            data=data,
+            method=method,
+            headers={
+                "Accept": "application/vnd.github+json",
+                "Authorization": f"Bearer {self.token}",
+                **(headers or {}),
+            },
+        )
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            body = response.read()
+        return json.loads(body) if body else None
+
+    def get_release(self, tag):
+        try:
+            return self.request("GET", f"releases/tags/{urllib.parse.quote(tag)}")
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                return None
+            raise
+
+    def create_release(self, tag):
+        data = json.dumps({"tag_name": tag, "name": tag, "body": f"Release {tag}"})
+        return self.request("POST", "releases", data.encode("utf-8"))
+
+    def assets(self, release):
+        assets = []
+        page = 1
+        while True:
+            found = self.request(
+                "GET", f"releases/{release['id']}/assets?per_page=100&page={page}"
+            )
+            assets += found
+            if len(found) < 100:
+                return {asset["name"]: asset for asset in assets}
+            page += 1
+
+    def download(self, asset):
+        # public link, as the API link redirects to storage which rejects our token
+        with urllib.request.urlopen(asset["browser_download_url"], timeout=60) as r:
+            return r.read()
+
+    def delete_asset(self, asset):
+        self.request("DELETE", f"releases/assets/{asset['id']}")
+
+    def upload_asset(self, release, path: Path):
+        upload_url = release["upload_url"].split("{")[0]
+        with open(path, "rb") as f:
+            return self.request(
+                "POST",
+                f"{upload_url}?name={urllib.parse.quote(path.name)}",
+                f,
+                {
+                    "Content-Type": "application/octet-stream",
+                    "Content-Length": str(path.stat().st_size),
+                },
+                timeout=600,
+            )
+
+
+def github_repo():
+    repo = os.environ.get("GITHUB_REPOSITORY")
+    if repo:
+        return repo
+    remote = subprocess.check_output(
+        ["git", "remote", "get-url", "origin"], cwd=project_folder, text=True
+    ).strip()
+    m = re.search(r"github\.com[:/](.+?/.+?)(?:\.git)?$", remote)
+    if m is None:
+        print(f"Can't tell the GitHub repository from {remote}, set GITHUB_REPOSITORY")
+        sys.exit(-1)
+    return m.group(1)
+
+
+def github_token():
+    token = os.environ.get("GITHUB_TOKEN") or os.environ.get("GH_TOKEN")
+    if token:
+        return token
+    return subprocess.check_output(["gh", "auth", "token"], text=True).strip()
+
+
+class ReleaseManifest:
+    # What we have published, so that a rerun after a failure only does what's left.
+    # Saved after every upload, which happen on several threads at once.
+    def __init__(self, path: Path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.releases = {}
+        if path.exists():
+            self.releases = json.loads(path.read_text())
+
+    def get(self, tag, name):
+        with self.lock:
+            return self.releases.get(tag, {}).get(name)
+
+    def set(self, tag, name, record):
+        with self.lock:
+            self.releases.setdefault(tag, {})[name] = record
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = self.path.with_name(self.path.name + ".tmp")
+            temp_path.write_text(json.dumps(self.releases, indent=4))
+            os.replace(temp_path, self.path)
+
+
+def with_retries(action, description, attempts):
+    # retry network failures and server errors, backing off exponentially
+    for attempt in range(attempts):
+        try:
+            return action()
+        except (urllib.error.URLError, OSError) as e:
+            if isinstance(e, urllib.error.HTTPError) and e.code < 500 and e.code != 429:
+                raise
+            if attempt == attempts - 1:
+                raise
+            delay = 2**attempt + random.random()
+            print(f"{description} failed ({e}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def asset_unchanged(api, assets, name, sha256, published):
+    asset = assets.get(name)
+    if asset is None:
+        return False
+    # trust our record of the upload if the asset still looks the same
+    if (
+        published is not None
+        and published["sha256"] == sha256
+        and published["size"] == asset["size"]
+    ):
+        return True
+    # GitHub reports a digest for newer uploads, otherwise use our .sha256 file
+    digest = asset.get("digest") or ""
+    if digest.startswith("sha256:"):
+        return digest.removeprefix("sha256:") == sha256
+    checksum_asset = assets.get(name + ".sha256")
+    if checksum_asset is None:
+        return False
+    return api.download(checksum_asset).decode("utf-8").split(" ", 1)[0] == sha256
+
+
+def publish_asset(api, release, path: Path, sha256, manifest, retries):
+    tag = release["tag_name"]
+
+    def upload():
+        # a failed upload can leave a broken asset behind, which blocks the name
+        existing = api.assets(release).get(path.name)
+        if existing is not None:
+            api.delete_asset(existing)
+        return api.upload_asset(release, path)
+
+    start_time = time.monotonic()
+    asset = with_retries(upload, f"Uploading {path.name}", retries)
+    manifest.set(
+        tag,
+        path.name,
+        {
+            "sha256": sha256,
+            "size": path.stat().st_size,
+            "url": asset.get("browser_download_url"),
+            "published": datetime.now().isoformat(timespec="seconds"),
+        },
+    )
+    return time.monotonic() - start_time
 
 
 def command_release(args):
@@ -501,27 +3751,77 @@ def command_release(args):
     if not version.startswith("v"):
         version = "v" + version
     print("Version:", version)
-    cmdline = ["gh", "release", "create", version, "--notes", f"Release {version}"]
-    if args.force:
-        # ignore if release already exists
-        subprocess.call(cmdline)
-    else:
-        subprocess.check_call(cmdline)
-    uploading_zips = []
-    for subfolder in release_folder.iterdir():
-        if subfolder.is_dir():
-            # make a zip from this folder
+    api = ReleaseApi(github_repo(), github_token())
+    release = with_retries(
+        lambda: api.get_release(version), "Checking release", args.retries
+    )
+    if release is None:
+        # a create that failed part way may still have made the release, so look for
+        # it again before each attempt
+        release = with_retries(
+            lambda: api.get_release(version) or api.create_release(version),
+            "Creating release",
+            args.retries,
+        )
+    elif not args.force:
+        print(f"Release {version} already exists, use --force to update it")
+        sys.exit(-1)
+    made_zips = []
+    subfolders = [
+        x for x in release_folder.iterdir() if x.is_dir() and not x.name.startswith(".")
+    ]
+    # one process per zip, as deflate is single threaded
+    with ProcessPoolExecutor(max_workers=max(1, len(subfolders))) as executor:
+        futures = []
+        for subfolder in subfolders:
             print(f"Making zip {subfolder}")
-            uploading_zips.append(
-                shutil.make_archive(
-                    str(subfolder), format="zip", root_dir=subfolder, base_dir=subfolder
+            futures.append(
+                executor.submit(
+                    make_release_zip,
+                    subfolder,
+                    subfolder.with_name(subfolder.name + ".zip"),
                 )
             )
-    print("Uploading:", *uploading_zips)
-    subprocess.check_call(
-        ["gh", "release", "upload", version, "--clobber"]
-        + [str(x) for x in uploading_zips]
-    )
+        for future in futures:
+            zip_path, checksum = future.result()
+            print(f"Made {zip_path} sha256:{checksum}")
+            made_zips.append((zip_path, checksum))
+
+    # only upload zips which differ from what is already attached to the release
+    manifest = ReleaseManifest(project_folder / "Saved" / "release_manifest.json")
+    assets = with_retries(lambda: api.assets(release), "Listing assets", args.retries)
+    uploads = []
+    for zip_path, checksum in made_zips:
+        published = manifest.get(version, zip_path.name)
+        if asset_unchanged(api, assets, zip_path.name, checksum, published):
+            print(f"{zip_path.name} is unchanged")
+            continue
+        uploads.append((zip_path, checksum))
+        sums_path = checksum_file(zip_path)
+        uploads.append((sums_path, hash_file(sums_path).hexdigest()))
+    if len(uploads) == 0:
+        print("Nothing to upload")
+        return
+    print("Uploading:", *[path.name for path, _ in uploads])
+    failed = False
+    with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as executor:
+        futures = {
+            executor.submit(
+                publish_asset, api, release, path, sha256, manifest, args.retries
+            ): path
+            for path, sha256 in uploads
+        }
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                seconds = future.result()
+                print(f"Uploaded {path.name} in {seconds:.1f}s")
+            except (urllib.error.URLError, OSError) as e:
+                print(f"Failed to upload {path.name}: {e}")
+                failed = True
+    if failed:
+        sys.exit(-1)
+
 
 def command_run(args):
     device = args.device
@@ -530,71 +3830,2343 @@ def command_run(args):
     else:
         print(f"Running release build on {device}")
 
-    current_flavour = None
-    for f in BUILD_FLAVOURS:
-        if f.flavour_name == args.device:
-            current_flavour = f
-    
-    if current_flavour is None:
-        print(f"Unknown device {args.device}")
-        sys.exit(-1)
+    current_flavour = find_flavour(args.device)
 
-    while True:
-        print("Checking for connected Android devices...")
-        result = subprocess.run(
-            ["adb", "devices"], capture_output=True, text=True
+    # install, run and log it
+    platform_folder = release_folder / current_flavour.flavour_name
+    run_on_devices(args, platform_folder)
+
+
+def command_analyze(args):
+    results = analyze_logs(args.logs, args.hitch_ms)
+    print(
+        f"{results['lines']} log lines, {results['drops']} dropped frame messages, "
+        f"{results['decode_messages']} decoder messages"
+    )
+    print_frame_stats("overall", results["overall"])
+    for segment in results["segments"]:
+        print_frame_stats(segment["label"], segment)
+    overall = results["overall"]
+    if overall["samples"] > 0 and overall["source"] == "sampled fps":
+        print(
+            "No per frame times in the log, these are 1000/fps of periodic FPS "
+            "readings, so percentiles and slow samples are of averages over "
+            "several frames"
         )
-        lines = result.stdout.strip().splitlines()
-        if len(lines) < 2 or not any(line.strip() for line in lines[1:]):
-            print(
-                "No Android device detected by adb. Please connect a device and try again."
-            )
-            time.sleep(2)
-        else:
-            print("Found connected Android device")
-            break
-    # find the install batch file
-    platform_folder = release_folder / current_flavour.flavour_name    
-    for b in platform_folder.glob("*.bat"):
-        if b.name.lower().startswith("install"):
-            subprocess.check_call(
-                [str(b)], shell=True, cwd=str(platform_folder)
+    telemetry_path = args.telemetry
+    if telemetry_path is None and args.logs[0].with_suffix(".telemetry").exists():
+        telemetry_path = args.logs[0].with_suffix(".telemetry")
+    if telemetry_path is not None:
+        # clocks and temperatures over each part of the log, to spot throttling
+        np = import_numpy()
+        header, columns = read_telemetry(telemetry_path)
+        results["telemetry"] = telemetry_stats(np, header, columns)
+        print_telemetry_stats("overall", results["telemetry"])
+        for segment in results["segments"]:
+            segment["telemetry"] = telemetry_stats(
+                np, header, columns, segment["start"], segment["end"]
             )
-            break
+            print_telemetry_stats(segment["label"], segment["telemetry"])
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=4))
+        print(f"Saved results to {args.json}")
 
-    if args.grablog:
-        subprocess.check_call(
-            ["adb", "logcat", "-c"], shell=True, cwd=str(project_folder)
+
+# sanitizer reports and tombstones in captured logs
+LOGCAT_LINE_MATCH = re.compile(
+    r"(\d\d-\d\d \d\d:\d\d:\d\d\.\d{3})\s+(\d+)\s+(\d+) [VDIWEFS] (.*?)\s*: (.*)$"
+)
+REPORT_START_MATCHES = [
+    ("asan", re.compile(r"==\d+==ERROR: (?:HW)?AddressSanitizer: (\S+)")),
+    ("tsan", re.compile(r"WARNING: ThreadSanitizer: (.+?)(?: \(pid=\d+\))?$")),
+    ("ubsan", re.compile(r"runtime error: (.+)$")),
+    # the minimal UBSan runtime, as used on Android
+    ("ubsan", re.compile(r"^ubsan: (\S+)")),
+]
+TOMBSTONE_START = "*** *** *** *** *** *** *** *** *** *** *** *** *** *** *** ***"
+TOMBSTONE_SIGNAL_MATCH = re.compile(r"^signal \d+ \((\w+)\), code -?\d+ \((\w+)\)")
+# "#1 0x7a1b2c (/data/app/.../lib/arm64/libUnreal.so+0x1234) (BuildId: 0a1b)"
+SANITIZER_FRAME_MATCH = re.compile(
+    r"^\s*#(\d+) 0x[0-9a-f]+ +(?:in (.+?) +)?\(([^()]+?)\+0x([0-9a-f]+)\)"
+    r"(?: \(BuildId: ([0-9a-f]+)\))?"
+)
+# "#1 0x7a1b2c in Foo::Bar() /src/Foo.cpp:12:3", already symbolized on device
+SYMBOLIZED_FRAME_MATCH = re.compile(
+    r"^\s*#(\d+) 0x[0-9a-f]+ in (.+?) (\S+:\d+(?::\d+)?)$"
+)
+# "#01 pc 0000000001234567  /data/app/.../libUnreal.so (Foo::Bar()+12) (BuildId: 0a1b)",
+# libraries loaded from inside the apk also have "(offset 0x...)" after the path
+TOMBSTONE_FRAME_MATCH = re.compile(
+    r"^\s*#(\d+) pc ([0-9a-f]+) +(\S+)(?: \(offset 0x[0-9a-f]+\))?"
+    r"(?: \((?!BuildId: )(.+)\+\d+\))?(?: \(BuildId: ([0-9a-f]+)\))?"
+)
+SANITIZER_RUNTIME_MODULES = ("libclang_rt.", "libc.so")
+# builds whose libraries are kept in the symbol store
+SYMBOL_STORE_KEEP = 10
+# parallel builds store symbols from their own threads
+SYMBOL_STORE_LOCK = threading.Lock()
+
+
+@dataclass
+class StackFrame:
+    module: str | None
+    offset: int
+    build_id: str | None = None
+    # [(function, file:line)], innermost inlined function first
+    symbols: list | None = None
+
+    def key(self):
+        if self.symbols:
+            return self.symbols[0][0]
+        return f"{self.module}+0x{self.offset:x}"
+
+    def __str__(self):
+        if not self.symbols:
+            return f"{self.module}+0x{self.offset:x}"
+        return " / ".join(
+            f"{function} {location}".strip() for function, location in self.symbols
         )
 
-    # run it
-    subprocess.check_call(
-        [
-            "adb",
-            "shell",
-            "am",
-            "start",
-            "-n",
-            "com.YourCompany.DirectVideoExample/com.epicgames.unreal.GameActivity",
+
+class CrashReport:
+    def __init__(self, kind, title, timestamp, pid):
+        self.kind = kind
+        self.title = title
+        self.summary = title
+        self.timestamp = timestamp
+        self.pid = pid
+        self.lines = []
+        self.stacks = []
+        self.complete = False
+
+    def parse_frame(self, message):
+        m = SANITIZER_FRAME_MATCH.match(message)
+        if m:
+            module = m.group(3).rpartition("!")[2].rpartition("/")[2]
+            frame = StackFrame(module, int(m.group(4), 16), m.group(5))
+            if m.group(2):
+                frame.symbols = [(m.group(2), "")]
+            return int(m.group(1)), frame
+        m = SYMBOLIZED_FRAME_MATCH.match(message)
+        if m:
+            frame = StackFrame(None, 0, None, [(m.group(2), m.group(3))])
+            return int(m.group(1)), frame
+        m = TOMBSTONE_FRAME_MATCH.match(message)
+        if m:
+            module = m.group(3).rpartition("!")[2].rpartition("/")[2]
+            frame = StackFrame(module, int(m.group(2), 16), m.group(5))
+            if m.group(4):
+                frame.symbols = [(m.group(4), "")]
+            return int(m.group(1)), frame
+        return None, None
+
+    def accepts(self, message):
+        # single line reports end at the first line after them which isn't a stack frame
+        if self.kind == "ubsan" or (self.kind == "tombstone" and self.stacks):
+            return self.parse_frame(message)[1] is not None
+        return True
+
+    def add(self, message):
+        self.lines.append(message)
+        if len(self.lines) == 1:
+            self.summary = message.strip()
+        index, frame = self.parse_frame(message)
+        if frame is not None:
+            if index == 0 or not self.stacks:
+                self.stacks.append([])
+            self.stacks[-1].append(frame)
+        elif message.startswith("SUMMARY: "):
+            self.summary = message.removeprefix("SUMMARY: ")
+            self.complete = True
+        elif self.kind == "tombstone":
+            m = TOMBSTONE_SIGNAL_MATCH.match(message)
+            if m:
+                self.title = f"{m.group(1)} ({m.group(2)})"
+                self.summary = message
+            elif message.startswith("Abort message: "):
+                self.summary = message
+        if len(self.lines) > 500:
+            self.complete = True
+
+    def signature(self, depth=5):
+        # the top of the first stack, not counting frames in the sanitizer runtime
+        frames = [
+            f
+            for f in (self.stacks[0] if self.stacks else [])
+            if f.module is None or not f.module.startswith(SANITIZER_RUNTIME_MODULES)
         ]
-    )
+        if len(frames) == 0:
+            return (self.kind, self.summary, ())
+        return (self.kind, self.title, tuple(f.key() for f in frames[:depth]))
 
-    # log it
-    if args.grablog:
-        if args.logname:
-            log_name = args.logname
+
+def read_crash_reports(log_paths):
+    reports = []
+    open_reports = {}
+    for log_path in log_paths:
+        with open_log(log_path) as f:
+            for line in f:
+                m = LOGCAT_LINE_MATCH.match(line.rstrip("\n"))
+                if m is None:
+                    continue
+                timestamp, pid, tid, tag, message = m.groups()
+                # a report is written by one thread, other threads' lines in the
+                # middle of it aren't part of it
+                key = (pid, tid, tag)
+                report = open_reports.get(key)
+                if report is not None and not report.accepts(message):
+                    del open_reports[key]
+                    report = None
+                if report is None:
+                    if tag == "DEBUG" and message.strip() == TOMBSTONE_START:
+                        report = CrashReport("tombstone", "crash", timestamp, pid)
+                    for kind, match in REPORT_START_MATCHES:
+                        start = match.search(message)
+                        if start:
+                            report = CrashReport(kind, start.group(1), timestamp, pid)
+                            break
+                    if report is None:
+                        continue
+                    open_reports[key] = report
+                    reports.append(report)
+                report.add(message)
+                if report.complete:
+                    del open_reports[key]
+    return reports
+
+
+def elf_build_id(path):
+    # the GNU build ID note, which is what crash reports identify libraries by
+    with open(path, "rb") as f:
+        if f.read(4) != b"\x7fELF":
+            return None
+        elf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        if elf[4] == 2:
+            (section_offset,) = struct.unpack_from("<Q", elf, 0x28)
+            entry_size, section_count = struct.unpack_from("<HH", elf, 0x3A)
+            section_format = "<4xI16xQQ"
         else:
-            now = datetime.now()
-            log_name = now.strftime(
-                f"{project_short_name}-%Y_%m_%d-%H_%M_%S.txt"
+            (section_offset,) = struct.unpack_from("<I", elf, 0x20)
+            entry_size, section_count = struct.unpack_from("<HH", elf, 0x2E)
+            section_format = "<4xI8xII"
+        for section in range(section_count):
+            section_type, offset, size = struct.unpack_from(
+                section_format, elf, section_offset + section * entry_size
             )
-        print(f"Grabbing log to {log_name}. Press ctrl+c to exit")
-        subprocess.check_call(
-            ["adb", "logcat", ">", str(log_name)],
-            shell=True,
-            cwd=str(project_folder),
-        )
+            # SHT_NOTE
+            if section_type != 7:
+                continue
+            pos = offset
+            while pos + 12 <= offset + size:
+                name_size, desc_size, note_type = struct.unpack_from("<III", elf, pos)
+                name_start = pos + 12
+                desc_start = name_start + (name_size + 3) // 4 * 4
+                # NT_GNU_BUILD_ID
+                if note_type == 3 and elf[name_start : name_start + 4] == b"GNU\0":
+                    return elf[desc_start : desc_start + desc_size].hex()
+                pos = desc_start + (desc_size + 3) // 4 * 4
+        return None
+    finally:
+        elf.close()
+
+
+def symbol_store():
+    return project_folder / "Saved" / "Symbols"
+
+
+def symbol_build_records():
+    # [(record file, {library name: build id})] for each build in the symbol store,
+    # oldest first
+    records = []
+    if symbol_store().exists():
+        for path in sorted(symbol_store().glob("build-*.json")):
+            try:
+                records.append((path, json.loads(path.read_text())))
+            except (OSError, ValueError):
+                # removed by another process storing symbols
+                continue
+    return records
+
+
+def stored_symbol_builds():
+    return [build for _, build in symbol_build_records()]
+
+
+def store_symbols(binaries_folder: Path):
+    # keep unstripped libraries from each build under their build ID, so crashes
+    # from any recent build can be symbolized
+    with SYMBOL_STORE_LOCK:
+        build = {}
+        for library in binaries_folder.glob("*.so"):
+            build_id = elf_build_id(library)
+            if build_id is None:
+                continue
+            folder = symbol_store() / build_id
+            folder.mkdir(parents=True, exist_ok=True)
+            stored_library = folder / library.name
+            if not stored_library.exists():
+                # a copy, as the next build rewrites the workspace binaries in place,
+                # written under another name so a half copied library is never used
+                partial = folder / f"{library.name}.partial{os.getpid()}"
+                shutil.copy2(library, partial)
+                os.replace(partial, stored_library)
+            build[library.name] = build_id
+        if len(build) == 0:
+            return
+        # each build is recorded in a file of its own, and only the libraries of
+        # builds whose records are removed are deleted, so builds in other processes
+        # can store their symbols at the same time
+        record = symbol_store() / f"build-{time.time_ns():020}-{os.getpid()}.json"
+        temp_record = record.with_suffix(".tmp")
+        temp_record.write_text(json.dumps(build))
+        os.replace(temp_record, record)
+        kept = []
+        removed = []
+        for path, stored in reversed(symbol_build_records()):
+            # a rebuild of the same code replaces its older record
+            if len(kept) < SYMBOL_STORE_KEEP and stored not in kept:
+                kept.append(stored)
+            else:
+                removed.append((path, stored))
+        kept_ids = {build_id for x in kept for build_id in x.values()}
+        for path, stored in removed:
+            path.unlink(missing_ok=True)
+            for build_id in set(stored.values()) - kept_ids:
+                shutil.rmtree(symbol_store() / build_id, ignore_errors=True)
+
+
+def symbol_files(extra_paths):
+    # {build id: library}
+    files = {}
+    if symbol_store().exists():
+        for folder in sorted(symbol_store().iterdir()):
+            for library in folder.glob("*.so"):
+                files[folder.name] = library
+    for path in extra_paths or []:
+        for library in path.rglob("*.so") if path.is_dir() else [path]:
+            build_id = elf_build_id(library)
+            if build_id:
+                files[build_id] = library
+    return files
+
+
+def addr2line_tool():
+    tool = os.environ.get("ADDR2LINE")
+    if tool:
+        return tool
+    for env_name in ["ANDROID_NDK_ROOT", "ANDROID_NDK_HOME", "NDKROOT"]:
+        if os.environ.get(env_name):
+            found = sorted(
+                Path(os.environ[env_name]).glob(
+                    "toolchains/llvm/prebuilt/*/bin/llvm-addr2line*"
+                )
+            )
+            if found:
+                return str(found[0])
+    return shutil.which("llvm-addr2line") or shutil.which("addr2line")
+
+
+def run_addr2line(tool, library, addresses):
+    # one call for all the addresses in a library
+    # returns {address: [(function, file:line)]}
+    result = subprocess.run(
+        [tool, "-a", "-f", "-C", "-i", "-e", str(library)],
+        input="".join(f"0x{address:x}\n" for address in addresses),
+        capture_output=True,
+        text=True,
+    )
+    symbols = {}
+    lines = result.stdout.splitlines()
+    address = None
+    pos = 0
+    while pos < len(lines):
+        if lines[pos].startswith("0x"):
+            address = int(lines[pos], 16)
+            symbols[address] = []
+            pos += 1
+        else:
+            location = lines[pos + 1] if pos + 1 < len(lines) else "??:0"
+            symbols.setdefault(address, []).append((lines[pos], location))
+            pos += 2
+    return symbols
+
+
+class SymbolCache:
+    # (build id, address) -> symbols, kept between runs as symbolizing is slow
+    def __init__(self, path: Path):
+        self.path = path
+        self.symbols = {}
+        if path.exists():
+            self.symbols = json.loads(path.read_text())
+
+    def get(self, build_id, address):
+        return self.symbols.get(build_id, {}).get(f"{address:x}")
+
+    def set(self, build_id, address, symbols):
+        self.symbols.setdefault(build_id, {})[f"{address:x}"] = symbols
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.write_text(json.dumps(self.symbols))
+
+
+def symbolize_reports(reports, extra_symbols=None):
+    cache = SymbolCache(project_folder / "Saved" / "symbol_cache.json")
+    libraries = symbol_files(extra_symbols)
+    # our libraries without a build ID are assumed to be from the latest build that
+    # stored them, or else from the libraries given with --symbols
+    latest_build_ids = {}
+    for build in stored_symbol_builds():
+        latest_build_ids.update(build)
+    for build_id, library in libraries.items():
+        latest_build_ids.setdefault(library.name, build_id)
+    wanted = {}
+    frames = []
+    for report in reports:
+        for stack in report.stacks:
+            for index, frame in enumerate(stack):
+                if frame.module is None:
+                    continue
+                build_id = frame.build_id
+                if build_id is None:
+                    build_id = latest_build_ids.get(frame.module)
+                if build_id not in libraries:
+                    continue
+                # return addresses point after the call, so look up the call itself
+                address = frame.offset - 1 if index > 0 else frame.offset
+                frames.append((frame, build_id, address))
+                if cache.get(build_id, address) is None:
+                    wanted.setdefault(build_id, set()).add(address)
+
+    tool = addr2line_tool()
+    if wanted and tool is None:
+        print("No addr2line found (set ADDR2LINE or ANDROID_NDK_ROOT), not symbolizing")
+        wanted = {}
+    for build_id, addresses in wanted.items():
+        start_time = time.perf_counter()
+        found = run_addr2line(tool, libraries[build_id], sorted(addresses))
+        for address in addresses:
+            cache.set(build_id, address, found.get(address) or [])
+        print(
+            f"Symbolized {len(addresses)} addresses in {libraries[build_id].name} "
+            f"in {time.perf_counter() - start_time:.1f}s"
+        )
+    if wanted:
+        cache.save()
+    for frame, build_id, address in frames:
+        symbols = cache.get(build_id, address)
+        if symbols and symbols[0][0] != "??":
+            frame.symbols = [tuple(x) for x in symbols]
+
+
+def summarise_reports(reports):
+    # unique issues, most frequent first
+    issues = {}
+    for report in reports:
+        # sanitizers abort after reporting, which also makes a tombstone
+        if report.kind == "tombstone" and "Sanitizer" in report.summary:
+            continue
+        issues.setdefault(report.signature(), []).append(report)
+    ranked = sorted(issues.values(), key=lambda x: (-len(x), x[0].timestamp))
+    return [
+        {
+            "count": len(same),
+            "kind": same[0].kind,
+            "title": same[0].title,
+            "summary": same[0].summary,
+            "first_seen": same[0].timestamp,
+            "pids": sorted({r.pid for r in same}),
+            "frames": [str(f) for f in (same[0].stacks[0] if same[0].stacks else [])],
+            "report": same[0].lines,
+        }
+        for same in ranked
+    ]
+
+
+def command_crashes(args):
+    logs = args.logs or [latest_log()]
+    if logs[0] is None:
+        print("No logs found")
+        sys.exit(-1)
+    results = []
+    for log_path in logs:
+        segments = log_segments(log_path)
+        if len(segments) == 0:
+            print(f"No log found: {log_path}")
+            sys.exit(-1)
+        reports = read_crash_reports(segments)
+        symbolize_reports(reports, args.symbols)
+        issues = summarise_reports(reports)
+        results.append(
+            {"log": str(log_path), "reports": len(reports), "issues": issues}
+        )
+        print(f"{log_path}: {len(reports)} reports, {len(issues)} unique issues")
+        for rank, issue in enumerate(issues, 1):
+            print(
+                f"{rank:3d}. {issue['count']}x {issue['kind']} {issue['title']} "
+                f"(first at {issue['first_seen']})"
+            )
+            if issue["summary"] != issue["title"]:
+                print(f"       {issue['summary']}")
+            for number, frame in enumerate(issue["frames"][: args.frames]):
+                print(f"       #{number} {frame}")
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=4))
+        print(f"Saved results to {args.json}")
+    if any(result["issues"] for result in results):
+        sys.exit(1)
+
+
+# render modes are switched by loading the map for that mode
+BENCHMARK_MODES = {
+    "texture": "/Game/texturerendering",
+    "mesh": "/Game/meshrendering",
+}
+
+
+def benchmark_modes(mode_args):
+    modes = {}
+    for mode in mode_args:
+        name, _, map_name = mode.partition("=")
+        if not map_name:
+            if name not in BENCHMARK_MODES:
+                print(f"Unknown render mode {name}")
+                sys.exit(-1)
+            map_name = BENCHMARK_MODES[name]
+        modes[name] = map_name
+    return modes
+
+
+def benchmark_run(serial, log_path, map_name, duration, warmup):
+    # one fixed length run of the app on a single map, returns frame stats
+    stop_app(serial)
+    subprocess.check_call(adb_command(serial, "logcat", "-c"))
+    capture = LogcatCapture(log_path, serial=serial)
+    capture.start()
+    try:
+        launch_app(map_name, serial)
+        time.sleep(warmup + duration)
+    finally:
+        capture.stop()
+        stop_app(serial)
+    results = analyze_logs(capture.segments, warmup_seconds=warmup)
+    return {
+        "log": str(log_path),
+        "drops": results["drops"],
+        **results["overall"],
+    }
+
+
+def summarise_runs(runs):
+    # median over the repeated runs, so one bad run doesn't skew things
+    summary = {"samples": sum(run["samples"] for run in runs)}
+    sources = {run["source"] for run in runs if "source" in run}
+    if len(sources) == 1:
+        summary["source"] = sources.pop()
+    for key in ["mean_fps", "mean_ms", "p50_ms", "p95_ms", "p99_ms", "hitches", "drops"]:
+        values = sorted(run[key] for run in runs if key in run)
+        if len(values) > 0:
+            summary[key] = values[len(values) // 2]
+    return summary
+
+
+def check_regressions(results, baseline, max_regression):
+    failures = []
+    limit = max_regression / 100
+    for mode, mode_results in results["modes"].items():
+        if mode not in baseline["modes"]:
+            continue
+        old = baseline["modes"][mode]["summary"]
+        new = mode_results["summary"]
+        if "mean_fps" not in old or "mean_fps" not in new:
+            continue
+        if new["mean_fps"] < old["mean_fps"] * (1 - limit):
+            failures.append(
+                f"{mode}: mean fps {new['mean_fps']:.1f} "
+                f"vs baseline {old['mean_fps']:.1f}"
+            )
+        if new["p95_ms"] > old["p95_ms"] * (1 + limit):
+            failures.append(
+                f"{mode}: p95 frame time {new['p95_ms']:.2f}ms "
+                f"vs baseline {old['p95_ms']:.2f}ms"
+            )
+    return failures
+
+
+def command_benchmark(args):
+    current_flavour = find_flavour(args.device)
+    modes = benchmark_modes(args.modes)
+    serial = wait_for_device()[0].serial
+    if args.install:
+        platform_folder = release_folder / current_flavour.flavour_name
+        deploy_build(
+            platform_folder,
+            plan_deploy(platform_folder),
+            serial,
+            DeployManifest(project_folder / "Saved" / "deploy_manifest.json"),
+        )
+
+    start_time = datetime.now()
+    benchmark_folder = (
+        project_folder
+        / "Benchmarks"
+        / start_time.strftime(f"{current_flavour.flavour_name}-%Y_%m_%d-%H_%M_%S")
+    )
+    benchmark_folder.mkdir(parents=True, exist_ok=True)
+    results = {
+        "flavour": current_flavour.flavour_name,
+        "development": args.development,
+        "date": start_time.isoformat(timespec="seconds"),
+        "duration": args.duration,
+        "warmup": args.warmup,
+        "modes": {
+            name: {"map": map_name, "runs": []} for name, map_name in modes.items()
+        },
+    }
+    # interleave the modes so that e.g. the headset warming up affects them equally
+    for repeat in range(args.repeats):
+        for name, map_name in modes.items():
+            print(
+                f"Benchmarking {name} ({map_name}), run {repeat + 1}/{args.repeats}"
+            )
+            run = benchmark_run(
+                serial,
+                benchmark_folder / f"{name}-{repeat}.txt",
+                map_name,
+                args.duration,
+                args.warmup,
+            )
+            results["modes"][name]["runs"].append(run)
+            print_frame_stats(name, run)
+
+    for name, mode_results in results["modes"].items():
+        mode_results["summary"] = summarise_runs(mode_results["runs"])
+        print_frame_stats(name, mode_results["summary"])
+
+    output = args.output or benchmark_folder / "results.json"
+    output.write_text(json.dumps(results, indent=4))
+    print(f"Saved results to {output}")
+
+    if args.baseline:
+        failures = check_regressions(
+            results, json.loads(args.baseline.read_text()), args.max_regression
+        )
+        if failures:
+            print("Performance regressions against", args.baseline)
+            for failure in failures:
+                print("  ", failure)
+            sys.exit(1)
+        print("No regressions against", args.baseline)
+
+
+# Pipeline state (PSO) harvesting: a development build run with -logPSO records every
+# pipeline it has to compile while drawing, the recordings are expanded against the
+# shader stable keys from the cook into the stable pipeline cache, which the next cook
+# bundles so those pipelines are precompiled at startup instead of hitching on first use
+PSO_CACHE_FOLDER = Path("Build") / "Android" / "PipelineCaches"
+PSO_ENGINE_SETTINGS = [
+    ("DevOptions.Shaders", "NeedsShaderStableKeys", "True"),
+    ("/Script/Engine.RendererSettings", "r.ShaderPipelineCache.Enabled", "1"),
+]
+# depending on packaging settings Saved/CollectedPSOs is in one of these
+PSO_DEVICE_FOLDERS = [
+    f"/sdcard/Android/data/{PACKAGE_NAME}/files",
+    "/sdcard/UnrealGame",
+]
+# seconds to give the app to write out its recording once it is in the background
+PSO_SAVE_SECONDS = 5
+PSO_DEFAULT_SHADER_FORMAT = "SF_VULKAN_ES31_ANDROID"
+# logged for each pipeline that wasn't in the cache, when it is compiled at draw time
+PSO_MISSED_MATCH = re.compile(r"Encountered a new (?:graphics|compute) PSO:? (\w+)")
+# logged when the bundled cache is opened and when precompiling it is done
+PSO_PRECOMPILED_MATCH = re.compile(
+    r"(?:ShaderPipelineCache|pipeline cache).*?(?:enqueued|completed) (\d+)"
+    r"(?: of \d+)? tasks",
+    re.IGNORECASE,
+)
+SHADER_FORMAT_MATCH = re.compile(
+    r"((?:SF|GLSL)_[A-Z0-9_]+?)(?:_[\d._-]+)?\.rec\.upipelinecache$"
+)
+
+
+def recorded_pso_files(serial):
+    folders = " ".join(shlex.quote(x) for x in PSO_DEVICE_FOLDERS)
+    output = adb_shell_output(
+        serial, f"find {folders} -name '*.rec.upipelinecache' 2>/dev/null"
+    )
+    return [line.strip() for line in output.splitlines() if line.strip() != ""]
+
+
+def clear_recorded_psos(serial):
+    # so that only recordings from this harvest get pulled
+    remote_paths = recorded_pso_files(serial)
+    if len(remote_paths) > 0:
+        quoted = " ".join(shlex.quote(x) for x in remote_paths)
+        adb_shell_output(serial, f"rm -f {quoted}")
+
+
+def pull_recorded_psos(serial, folder: Path):
+    pulled = []
+    for remote_path in recorded_pso_files(serial):
+        local_path = folder / remote_path.rsplit("/", 1)[-1]
+        subprocess.check_call(
+            adb_command(serial, "pull", remote_path, str(local_path)),
+            stdout=subprocess.DEVNULL,
+        )
+        pulled.append(local_path)
+    return pulled
+
+
+def count_psos(log_paths):
+    # (pipelines precompiled from the bundled cache, hashes of pipelines it missed)
+    precompiled = 0
+    missed = set()
+    for log_path in log_paths:
+        with open_log(log_path) as f:
+            for line in f:
+                m = PSO_MISSED_MATCH.search(line)
+                if m is not None:
+                    missed.add(m.group(1))
+                    continue
+                m = PSO_PRECOMPILED_MATCH.search(line)
+                if m is not None:
+                    precompiled = max(precompiled, int(m.group(1)))
+    return precompiled, missed
+
+
+def pso_run(serial, log_path, map_name, duration):
+    # like a benchmark run, but the app is sent to the background before it is
+    # stopped, which is when it writes out the pipelines it recorded
+    stop_app(serial)
+    subprocess.check_call(adb_command(serial, "logcat", "-c"))
+    capture = LogcatCapture(log_path, serial=serial)
+    capture.start()
+    try:
+        launch_app(f"{map_name} -logPSO", serial)
+        time.sleep(duration)
+        subprocess.check_call(
+            adb_command(serial, "shell", "input", "keyevent", "KEYCODE_HOME")
+        )
+        time.sleep(PSO_SAVE_SECONDS)
+    finally:
+        capture.stop()
+        stop_app(serial)
+    return count_psos(capture.segments)
+
+
+def pso_pass(flavour: BuildFlavour, serial, folder: Path, modes, duration, label):
+    platform_folder = release_folder / flavour.flavour_name
+    deploy_build(
+        platform_folder,
+        plan_deploy(platform_folder),
+        serial,
+        DeployManifest(project_folder / "Saved" / "deploy_manifest.json"),
+    )
+    precompiled = 0
+    missed = set()
+    for name, map_name in modes.items():
+        print(f"Recording pipelines for {flavour.flavour_name} {name} ({map_name})")
+        run_precompiled, run_missed = pso_run(
+            serial, folder / f"{label}-{name}.txt", map_name, duration
+        )
+        precompiled = max(precompiled, run_precompiled)
+        missed |= run_missed
+    return {"precompiled": precompiled, "missed": len(missed)}
+
+
+def stable_key_files(flavour: BuildFlavour):
+    # written by the cook, in whichever folder the flavour was last built in
+    found = []
+    workspace = project_folder / "Workspaces" / flavour.flavour_name
+    for folder in [project_folder, workspace]:
+        found += folder.glob("Saved/Cooked/Android*/*/Metadata/PipelineCaches/*.shk")
+    return found
+
+
+def merge_pso_recordings(args, flavour: BuildFlavour, recordings, folder: Path):
+    engine_version = flavour_engine_version(args, flavour)
+    editor_path = (
+        Path(args.ue_path)
+        / f"UE_{engine_version}"
+        / "Engine"
+        / "Binaries"
+        / "Win64"
+        / "UnrealEditor-Cmd.exe"
+    )
+    stable_keys = stable_key_files(flavour)
+    if len(stable_keys) == 0:
+        print(f"No shader stable keys found for {flavour.flavour_name}")
+        sys.exit(-1)
+    by_format = {}
+    for path in recordings:
+        m = SHADER_FORMAT_MATCH.search(path.name)
+        shader_format = m.group(1) if m is not None else PSO_DEFAULT_SHADER_FORMAT
+        by_format.setdefault(shader_format, []).append(path)
+
+    cache_folder = project_folder / PSO_CACHE_FOLDER
+    cache_folder.mkdir(parents=True, exist_ok=True)
+    for shader_format, paths in by_format.items():
+        cache_file = cache_folder / f"PSO_{project_file.stem}_{shader_format}.spc"
+        inputs = [str(x) for x in paths]
+        # the current cache is an input too, so pipelines from earlier harvests
+        # (and other flavours) are kept
+        if cache_file.exists():
+            inputs.append(str(cache_file))
+        format_keys = [x for x in stable_keys if shader_format in x.name]
+        inputs += [str(x) for x in (format_keys or stable_keys)]
+        merged_file = folder / cache_file.name
+        cmdline = [
+            str(editor_path),
+            str(project_file),
+            "-run=ShaderPipelineCacheTools",
+            "expand",
+            *inputs,
+            str(merged_file),
+            "-unattended",
+            "-nosplash",
+            "-nop4",
+        ]
+        print(f"Merging {len(paths)} recordings into {cache_file}")
+        result = subprocess.run(
+            cmdline, capture_output=True, text=True, errors="replace"
+        )
+        if result.returncode != 0 or not merged_file.exists():
+            print(result.stdout[-4000:])
+            print(f"Merging pipeline recordings for {shader_format} failed")
+            sys.exit(-1)
+        shutil.copyfile(merged_file, cache_file)
+
+
+def command_harvest_pso(args):
+    if "all" in args.device:
+        flavours = [f for f in BUILD_FLAVOURS if not f.dont_build]
+    else:
+        flavours = [find_flavour(x) for x in args.device]
+    if args.devices is None and len(flavours) > 1:
+        print("Give a device serial for each flavour with --devices")
+        sys.exit(-1)
+    if args.devices is not None and len(args.devices) != len(flavours):
+        print(f"Need one device serial per flavour, for {len(flavours)} flavours")
+        sys.exit(-1)
+    modes = benchmark_modes(args.modes)
+
+    build_args = parse_arguments(
+        [
+            "build",
+            *[f.flavour_name for f in flavours],
+            "--development",
+            # the validation layer slows down drawing, and its pipelines aren't shipped
+            "--novalidation",
+            "--ue-path",
+            str(args.ue_path),
+            "--engine-version",
+            args.engine_version,
+            "--jobs",
+            str(args.jobs),
+        ]
+    )
+    # without these the cook writes no stable keys, and the app ignores bundled
+    # caches. They only go into the build's copy of DefaultEngine.ini, so harvest
+    # builds are cached separately from everyday ones.
+    build_args.engine_settings = PSO_ENGINE_SETTINGS
+    command_build(build_args)
+
+    start_time = datetime.now()
+    harvests = []
+    for index, flavour in enumerate(flavours):
+        serial = args.devices[index] if args.devices is not None else None
+        serial = wait_for_device(serial)[0].serial
+        folder = (
+            project_folder
+            / "PSOHarvest"
+            / start_time.strftime(f"{flavour.flavour_name}-%Y_%m_%d-%H_%M_%S")
+        )
+        folder.mkdir(parents=True, exist_ok=True)
+        clear_recorded_psos(serial)
+        before = pso_pass(flavour, serial, folder, modes, args.duration, "harvest")
+        recordings = pull_recorded_psos(serial, folder)
+        if len(recordings) == 0:
+            print(f"No pipeline recordings found on {serial}")
+            sys.exit(-1)
+        merge_pso_recordings(args, flavour, recordings, folder)
+        harvests.append((flavour, serial, folder, before, recordings))
+
+    # the stable cache is a build input, so this only rebuilds what it changed
+    command_build(build_args)
+
+    for flavour, serial, folder, before, recordings in harvests:
+        after = pso_pass(flavour, serial, folder, modes, args.duration, "verify")
+        results = {
+            "flavour": flavour.flavour_name,
+            "date": start_time.isoformat(timespec="seconds"),
+            "recordings": [str(x) for x in recordings],
+            "before": before,
+            "after": after,
+        }
+        (folder / "results.json").write_text(json.dumps(results, indent=4))
+        print(
+            f"{flavour.flavour_name}: before {before['precompiled']} precompiled, "
+            f"{before['missed']} missed; after {after['precompiled']} precompiled, "
+            f"{after['missed']} missed"
+        )
+
+
+
+# Stress testing video playback: each test clip is put on the device once, then moved
+# in place of the app's movie for each run, which is a rename rather than a copy.
+# Files in the project folder on the device are used over those packaged in the OBB.
+STRESS_CLIP_FOLDER = "StressClips"
+MOVIE_PATH = "Content/Movies/nasa.mp4"
+# where a movie that was already in the project folder on the device is kept meanwhile
+STRESS_BACKUP_FOLDER = "StressBackup"
+
+
+def stress_clips(clip_args):
+    # (path, video info) of each clip, from files or folders of .mp4 files
+    paths = []
+    for clip_arg in clip_args:
+        if clip_arg.is_dir():
+            paths += sorted(clip_arg.glob("*.mp4"))
+        else:
+            paths.append(clip_arg)
+    clips = []
+    names = set()
+    for path in paths:
+        if path.name in names:
+            print(f"Two clips are called {path.name}, clip names must be unique")
+            sys.exit(-1)
+        names.add(path.name)
+        info = inspect_video(path)
+        if info is None or "fps" not in info:
+            print(f"{path}: can't read video track")
+            sys.exit(-1)
+        clips.append((path, info))
+    # lightest first, so that the table reads as a ramp up to the device's limits
+    clips.sort(
+        key=lambda clip: (
+            clip[1]["codec"],
+            clip[1]["width"] * clip[1]["height"],
+            clip[1]["mean_bitrate_mbps"],
+        )
+    )
+    return clips
+
+
+def push_stress_clips(serial, clips, manifest):
+    # returns the remote path of each clip, pushing only ones that aren't there already
+    clip_folder = f"{device_project_folder()}/{STRESS_CLIP_FOLDER}"
+    hash_cache = FileHashCache(project_folder / "Saved" / "build_hash_cache.json")
+    clip_files = [
+        DeployFile(
+            path,
+            f"{clip_folder}/{path.name}",
+            path.stat().st_size,
+            hash_cache.file_hash(path),
+        )
+        for path, _ in clips
+    ]
+    hash_cache.save()
+    adb_shell_output(serial, f"mkdir -p {clip_folder}")
+    stats = remote_stats(serial, [x.remote_path for x in clip_files])
+    for clip in clip_files:
+        if remote_unchanged(serial, clip, clip.remote_path, stats, manifest):
+            continue
+        print(f"{serial}: pushing {clip.local_path.name}")
+        subprocess.check_call(
+            adb_command(serial, "push", str(clip.local_path), clip.remote_path),
+            stdout=subprocess.DEVNULL,
+        )
+        manifest.set(
+            serial,
+            clip.remote_path,
+            {
+                "path": clip.remote_path,
+                "stat": remote_stats(serial, [clip.remote_path]).get(clip.remote_path),
+                "sha256": clip.sha256,
+            },
+        )
+    return [x.remote_path for x in clip_files]
+
+
+def playable(run, min_fps, max_drop_rate):
+    return (
+        run.get("mean_fps", 0) >= min_fps
+        and run["drops_per_minute"] <= max_drop_rate
+    )
+
+
+def print_capability_table(flavour_name, clips, results, modes):
+    print(f"Video capability for {flavour_name}")
+    header = f"{'clip':32} {'codec':6} {'resolution':>11} {'Mbps':>6} {'fps':>5}"
+    for name in modes:
+        header += f" | {name + ' fps':>12} {'drops/min':>9} {'ok':>3}"
+    print(header)
+    for (path, info), clip_results in zip(clips, results["clips"]):
+        row = (
+            f"{path.name[:32]:32} {info['codec']:6} "
+            f"{str(info['width']) + 'x' + str(info['height']):>11} "
+            f"{info['mean_bitrate_mbps']:6.1f} {info['fps']:5.1f}"
+        )
+        for name in modes:
+            run = clip_results["modes"][name]
+            row += (
+                f" | {run.get('mean_fps', 0):12.1f} {run['drops_per_minute']:9.1f} "
+                f"{'yes' if run['playable'] else 'no':>3}"
+            )
+        print(row)
+    for name in modes:
+        if len(results["ceiling"][name]) == 0:
+            print(f"{name}: none of the clips were playable")
+        for codec, best in results["ceiling"][name].items():
+            print(
+                f"{name} {codec}: up to {best['width']}x{best['height']} "
+                f"at {best['mean_bitrate_mbps']:.1f}Mbps"
+            )
+
+
+def command_stress_video(args):
+    current_flavour = find_flavour(args.device)
+    modes = benchmark_modes(args.modes)
+    clips = stress_clips(args.clips)
+    if len(clips) == 0:
+        print("No clips to test")
+        sys.exit(-1)
+    serial = wait_for_device()[0].serial
+    movie_path = shlex.quote(f"{device_project_folder()}/{MOVIE_PATH}")
+    movie_name = MOVIE_PATH.rsplit("/", 1)[-1]
+    backup_path = shlex.quote(
+        f"{device_project_folder()}/{STRESS_BACKUP_FOLDER}/{movie_name}"
+    )
+    restore_movie = f"if [ -e {backup_path} ]; then mv {backup_path} {movie_path}; fi"
+    # in case an earlier run was stopped before it put the movie back
+    adb_shell_output(serial, restore_movie)
+    manifest = DeployManifest(project_folder / "Saved" / "deploy_manifest.json")
+    if args.install:
+        platform_folder = release_folder / current_flavour.flavour_name
+        deploy_build(platform_folder, plan_deploy(platform_folder), serial, manifest)
+    remote_clips = push_stress_clips(serial, clips, manifest)
+
+    start_time = datetime.now()
+    stress_folder = (
+        project_folder
+        / "StressTests"
+        / start_time.strftime(f"{current_flavour.flavour_name}-%Y_%m_%d-%H_%M_%S")
+    )
+    stress_folder.mkdir(parents=True, exist_ok=True)
+    results = {
+        "flavour": current_flavour.flavour_name,
+        "development": args.development,
+        "date": start_time.isoformat(timespec="seconds"),
+        "duration": args.duration,
+        "warmup": args.warmup,
+        "clips": [],
+    }
+    adb_shell_output(
+        serial,
+        f"if [ -e {movie_path} ]; then mkdir -p $(dirname {backup_path}) && "
+        f"mv {movie_path} {backup_path}; fi",
+    )
+    try:
+        for (path, info), remote_clip in zip(clips, remote_clips):
+            clip_results = {"clip": path.name, **info, "modes": {}}
+            remote_clip = shlex.quote(remote_clip)
+            adb_shell_output(
+                serial,
+                f"mkdir -p $(dirname {movie_path}) && mv {remote_clip} {movie_path}",
+            )
+            try:
+                for name, map_name in modes.items():
+                    print(f"Playing {path.name} in {name} ({map_name})")
+                    run = benchmark_run(
+                        serial,
+                        stress_folder / f"{path.stem}-{name}.txt",
+                        map_name,
+                        args.duration,
+                        args.warmup,
+                    )
+                    run["drops_per_minute"] = run["drops"] * 60 / args.duration
+                    clip_results["modes"][name] = run
+                    print_frame_stats(name, run)
+            finally:
+                # put the clip back, so it is there for the next run
+                adb_shell_output(serial, f"mv {movie_path} {remote_clip}")
+            results["clips"].append(clip_results)
+    finally:
+        adb_shell_output(serial, restore_movie)
+
+    # the app's frame rate with the lightest clips is the baseline it should keep up
+    results["ceiling"] = {}
+    for name in modes:
+        runs = [clip["modes"][name] for clip in results["clips"]]
+        min_fps = args.min_fps
+        if min_fps is None:
+            min_fps = 0.9 * max(run.get("mean_fps", 0) for run in runs)
+        ceiling = {}
+        for (path, info), run in zip(clips, runs):
+            run["playable"] = playable(run, min_fps, args.max_drop_rate)
+            best = ceiling.get(info["codec"])
+            if run["playable"] and (
+                best is None
+                or (info["width"] * info["height"], info["mean_bitrate_mbps"])
+                > (best["width"] * best["height"], best["mean_bitrate_mbps"])
+            ):
+                ceiling[info["codec"]] = {
+                    "clip": path.name,
+                    "width": info["width"],
+                    "height": info["height"],
+                    "mean_bitrate_mbps": info["mean_bitrate_mbps"],
+                }
+        results["ceiling"][name] = ceiling
+
+    print_capability_table(current_flavour.flavour_name, clips, results, modes)
+    output = args.output or stress_folder / "results.json"
+    output.write_text(json.dumps(results, indent=4))
+    print(f"Saved results to {output}")
+
+
+def latest_log():
+    logs = [
+        p
+        for p in project_folder.glob(f"{glob.escape(project_short_name)}-*.txt*")
+        if p.suffix != ".idx"
+    ]
+    if len(logs) == 0:
+        return None
+    latest = max(logs, key=lambda p: p.stat().st_mtime)
+    # for a rotated log, query all its segments
+    return latest.with_name(re.sub(r"-\d{3}(\.txt)(\.gz)?$", r"\1", latest.name))
+
+
+def parse_log_time(text, log_start):
+    if text is None:
+        return None
+    if text.startswith("+"):
+        return log_start + float(text[1:])
+    start_date = datetime.fromtimestamp(log_start)
+    for time_format in ("%m-%d %H:%M:%S.%f", "%m-%d %H:%M:%S"):
+        try:
+            parsed = datetime.strptime(text, time_format)
+            return parsed.replace(year=start_date.year).timestamp()
+        except ValueError:
+            pass
+    for time_format in ("%H:%M:%S.%f", "%H:%M:%S"):
+        try:
+            parsed = datetime.strptime(text, time_format)
+            return datetime.combine(start_date.date(), parsed.time()).timestamp()
+        except ValueError:
+            pass
+    print(f"Can't understand time {text}")
+    sys.exit(-1)
+
+
+def command_log(args):
+    if args.log_command == "index":
+        for log_path in args.logs:
+            start_time = time.perf_counter()
+            build_log_index(log_path)
+            print(f"Indexed {log_path} in {time.perf_counter() - start_time:.1f}s")
+        return
+
+    logs = args.logs or [latest_log()]
+    if logs[0] is None:
+        print("No logs found")
+        sys.exit(-1)
+    segments = [segment for log_path in logs for segment in log_segments(log_path)]
+    if len(segments) == 0:
+        print("No logs found:", *logs)
+        sys.exit(-1)
+    grep = None
+    if args.grep:
+        grep = re.compile(
+            args.grep.encode("utf-8"),
+            re.MULTILINE | (re.IGNORECASE if args.ignore_case else 0),
+        )
+    start_time = time.perf_counter()
+    indexes = [open_log_index(segment) for segment in segments]
+    log_start = min(
+        (i.header["start_time"] for i in indexes if i.header["start_time"]),
+        default=0,
+    )
+    since = parse_log_time(args.since, log_start)
+    until = parse_log_time(args.until, log_start)
+    count = 0
+    try:
+        for index in indexes:
+            header = index.header
+            if header["start_time"] is None or (
+                (since is not None and header["end_time"] < since)
+                or (until is not None and header["start_time"] > until)
+            ):
+                continue
+            for line in index.query(args.tag, args.pid, since, until, grep):
+                print(line)
+                count += 1
+    finally:
+        for index in indexes:
+            index.close()
+    print(
+        f"{count} lines in {(time.perf_counter() - start_time) * 1000:.1f}ms",
+        file=sys.stderr,
+    )
+
+
+def command_inspect_video(args):
+    videos = args.videos or sorted((project_folder / "Content" / "Movies").glob("*.mp4"))
+    if len(videos) == 0:
+        print("No videos to inspect")
+        sys.exit(-1)
+    flavours = [
+        f
+        for f in BUILD_FLAVOURS
+        if f.decoder_limits is not None
+        and (args.device is None or f.flavour_name in args.device)
+    ]
+    results = []
+    failed = False
+    for video in videos:
+        start_time = time.perf_counter()
+        info = inspect_video(video, args.window)
+        parse_time = time.perf_counter() - start_time
+        if info is None:
+            print(f"{video}: no video track found")
+            failed = True
+            continue
+        print(f"{video} ({parse_time * 1000:.1f}ms)")
+        print(
+            f"    {info['codec']} profile {info['profile']} level {info['level']} "
+            f"{info['width']}x{info['height']}"
+        )
+        if info.get("fragmented"):
+            print("    fragmented MP4, no sample tables to check")
+        else:
+            print(
+                f"    {info['fps']:.2f}fps, {info['duration']:.1f}s, "
+                f"bitrate mean {info['mean_bitrate_mbps']:.1f}Mbps "
+                f"peak {info['peak_bitrate_mbps']:.1f}Mbps, "
+                f"keyframes every {info['mean_keyframe_interval']:.2f}s "
+                f"(max {info['max_keyframe_interval']:.2f}s)"
+            )
+        info["video"] = str(video)
+        info["devices"] = {}
+        for flavour in flavours:
+            problems = check_video(info, flavour.decoder_limits)
+            info["devices"][flavour.flavour_name] = problems
+            if problems:
+                failed = True
+                print(f"    {flavour.flavour_name}: " + "; ".join(problems))
+            else:
+                print(f"    {flavour.flavour_name}: ok")
+        results.append(info)
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=4))
+        print(f"Saved results to {args.json}")
+    if failed:
+        sys.exit(1)
+
+
+def parse_size(text):
+    units = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+    m = re.fullmatch(r"([0-9.]+)\s*([KMGT]?)B?", text.strip().upper())
+    if m is None:
+        print(f"Bad size {text}, should be like 500M or 100G")
+        sys.exit(-1)
+    return int(float(m.group(1)) * units[m.group(2)])
+
+
+def format_size(size):
+    for unit in ["B", "K", "M", "G"]:
+        if size < 1024:
+            return f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}T"
+
+
+def ddc_files(folder):
+    # (last used time, size, path) for every file in a cache - access times are
+    # often not updated, so the later of access and modified time is used
+    files = []
+    folders = [folder]
+    while folders:
+        with os.scandir(folders.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    folders.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    stat = entry.stat(follow_symlinks=False)
+                    files.append(
+                        (max(stat.st_atime, stat.st_mtime), stat.st_size, entry.path)
+                    )
+    return files
+
+
+def ddc_caches():
+    # {(engine version, flavour): folder}
+    caches = {}
+    ddc_root = project_folder / "DerivedDataCache"
+    if ddc_root.exists():
+        for engine_folder in sorted(ddc_root.iterdir()):
+            if engine_folder.is_dir():
+                for flavour_folder in sorted(engine_folder.iterdir()):
+                    if flavour_folder.is_dir():
+                        caches[(engine_folder.name, flavour_folder.name)] = flavour_folder
+    return caches
+
+
+def remove_empty_folders(folder):
+    for dirpath, dirnames, filenames in os.walk(folder, topdown=False):
+        if dirpath != str(folder) and not os.listdir(dirpath):
+            os.rmdir(dirpath)
+
+
+def ddc_report(args):
+    total = 0
+    for (engine_version, flavour_name), folder in ddc_caches().items():
+        files = ddc_files(folder)
+        size = sum(x[1] for x in files)
+        total += size
+        last_used = "never"
+        if len(files) > 0:
+            last_used = datetime.fromtimestamp(max(x[0] for x in files)).strftime(
+                "%Y-%m-%d %H:%M"
+            )
+        print(
+            f"{engine_version:8} {flavour_name:12} {format_size(size):>10} "
+            f"{len(files):8d} files, last used {last_used}"
+        )
+    print(f"Total {format_size(total)}")
+
+
+def ddc_evict(args):
+    budget = parse_size(args.budget)
+    files = []
+    for folder in ddc_caches().values():
+        files += ddc_files(folder)
+    total = sum(x[1] for x in files)
+    print(f"Cache size {format_size(total)}, budget {format_size(budget)}")
+    files.sort()
+    evicted = 0
+    for last_used, size, path in files:
+        if total <= budget:
+            break
+        if not args.dry_run:
+            try:
+                os.remove(path)
+            except OSError:
+                # in use by a running build
+                continue
+        total -= size
+        evicted += size
+    if args.dry_run:
+        print(f"Would evict {format_size(evicted)}")
+    else:
+        for folder in ddc_caches().values():
+            remove_empty_folders(folder)
+        print(f"Evicted {format_size(evicted)}, cache is now {format_size(total)}")
+
+
+def ddc_prune(args):
+    in_use = set(args.engine_version)
+    in_use.update(
+        f.engine_version_override for f in BUILD_FLAVOURS if f.engine_version_override
+    )
+    ddc_root = project_folder / "DerivedDataCache"
+    if not ddc_root.exists():
+        return
+    for engine_folder in sorted(ddc_root.iterdir()):
+        if engine_folder.is_dir() and engine_folder.name not in in_use:
+            size = sum(x[1] for x in ddc_files(engine_folder))
+            if args.dry_run:
+                print(f"Would delete {engine_folder} ({format_size(size)})")
+            else:
+                print(f"Deleting {engine_folder} ({format_size(size)})")
+                shutil.rmtree(engine_folder, ignore_errors=True)
+
+
+def ddc_prewarm(args):
+    # Runs the DerivedDataCache commandlet in the flavour's build workspace,
+    # which fills the cache with shaders, textures etc. for the target platform.
+    current_flavour = find_flavour(args.device)
+    engine_version = flavour_engine_version(args, current_flavour)
+    editor_path = (
+        Path(args.ue_path)
+        / f"UE_{engine_version}"
+        / "Engine"
+        / "Binaries"
+        / "Win64"
+        / "UnrealEditor-Cmd.exe"
+    )
+    if not editor_path.exists():
+        print(f"Can't find editor {editor_path}")
+        sys.exit(-1)
+    flavour_files = make_flavour_files(
+        project_file.read_text(),
+        defaultengine_file.read_text(),
+        [current_flavour],
+        False,
+    )
+    workspace = make_workspace(current_flavour, *flavour_files[args.device])
+    cache_folder = ddc_folder(engine_version, current_flavour.flavour_name)
+    cache_folder.mkdir(parents=True, exist_ok=True)
+    env = os.environ.copy()
+    env["UE-LocalDataCachePath"] = str(cache_folder)
+    cmdline = [
+        str(editor_path),
+        str(workspace / project_file.name),
+        "-run=DerivedDataCache",
+        "-fill",
+        f"-TargetPlatform={args.target_platform}",
+        "-unattended",
+        "-nosplash",
+        "-nop4",
+    ]
+    log_path = cache_folder.with_name(f"{current_flavour.flavour_name}-prewarm.log")
+    with open(log_path, "wb") as log_file:
+        if sys.platform == "win32":
+            detach = {
+                "creationflags": subprocess.CREATE_NEW_PROCESS_GROUP
+                | subprocess.DETACHED_PROCESS
+            }
+        else:
+            detach = {"start_new_session": True}
+        proc = subprocess.Popen(
+            cmdline,
+            env=env,
+            stdout=log_file,
+            stderr=subprocess.STDOUT,
+            stdin=subprocess.DEVNULL,
+            **detach,
+        )
+    print(f"Prewarming {cache_folder} in process {proc.pid}, log in {log_path}")
+    if args.wait:
+        if proc.wait() != 0:
+            print(f"Prewarm failed, see {log_path}")
+            sys.exit(-1)
+        print("Prewarm finished")
+
+
+def command_ddc(args):
+    {
+        "report": ddc_report,
+        "evict": ddc_evict,
+        "prune": ddc_prune,
+        "prewarm": ddc_prewarm,
+    }[args.ddc_command](args)
+
+
+# plugins whose content should never end up in a packaged build
+EDITOR_ONLY_PLUGINS = {
+    "ModelingToolsEditorMode",
+    "RenderDocPlugin",
+    "PixWinPlugin",
+    "PluginBrowser",
+    "EditorScriptingUtilities",
+    "GeometryMode",
+    "PythonScriptPlugin",
+}
+PAK_MAGIC = 0x5A6F12E1
+UTOC_MAGIC = b"-==--==--==--==-"
+# the newest formats we know how to read, newer engines may change the layout
+PAK_MAX_VERSION = 11
+# utoc files only have file names from DirectoryIndex (2) on
+UTOC_VERSIONS = range(2, 9)
+CONTAINER_SUFFIXES = {".apk", ".obb", ".zip", ".pak", ".utoc", ".ucas"}
+
+
+@dataclass
+class PackagedFile:
+    container: str
+    path: str
+    size: int
+    uncompressed_size: int
+
+
+class BinaryReader:
+    # little endian reader for Unreal archive formats
+    def __init__(self, data, pos=0):
+        self.data = data
+        self.pos = pos
+
+    def unpack(self, fmt):
+        values = struct.unpack_from("<" + fmt, self.data, self.pos)
+        self.pos += struct.calcsize("<" + fmt)
+        return values if len(values) > 1 else values[0]
+
+    def bytes(self, count):
+        self.pos += count
+        return bytes(self.data[self.pos - count : self.pos])
+
+    def fstring(self):
+        # length includes the terminating null, negative means UTF-16
+        length = self.unpack("i")
+        if length < 0:
+            return self.bytes(-length * 2).decode("utf-16-le").rstrip("\0")
+        return self.bytes(length).decode("utf-8", "replace").rstrip("\0")
+
+
+def read_pak_entry(reader: BinaryReader, version):
+    # FPakEntry as stored in the index, returns (compressed size, uncompressed size)
+    _offset, size, uncompressed_size = reader.unpack("qqq")
+    if version < 8:
+        compression = reader.unpack("i")
+    elif version == 8:
+        compression = reader.unpack("B")
+    else:
+        compression = reader.unpack("I")
+    if version <= 1:
+        reader.unpack("q")
+    reader.bytes(20)
+    if version >= 3:
+        if compression != 0:
+            reader.bytes(reader.unpack("i") * 16)
+        reader.bytes(5)
+    return size, uncompressed_size
+
+
+def decode_pak_entry(data, pos):
+    # the bit packed entries of version 10+ pak indexes
+    reader = BinaryReader(data, pos)
+    flags = reader.unpack("I")
+    if flags & 0x3F == 0x3F:
+        reader.unpack("I")
+    reader.unpack("I" if flags & (1 << 31) else "q")
+    uncompressed_size = reader.unpack("I" if flags & (1 << 30) else "q")
+    size = uncompressed_size
+    if (flags >> 23) & 0x3F:
+        size = reader.unpack("I" if flags & (1 << 29) else "q")
+    block_count = (flags >> 6) & 0xFFFF
+    if block_count > 0 and (flags & (1 << 22) or block_count != 1):
+        reader.bytes(block_count * 4)
+    return size, uncompressed_size, reader.pos
+
+
+def read_pak_index(data):
+    # returns (mount point, [(file name, compressed size, uncompressed size)])
+    tail_start = max(0, len(data) - 512)
+    magic_pos = bytes(data[tail_start:]).rfind(struct.pack("<I", PAK_MAGIC))
+    if magic_pos == -1:
+        raise ValueError("no pak footer")
+    footer = BinaryReader(data, tail_start + magic_pos + 4)
+    version, index_offset, index_size = footer.unpack("iqq")
+    if not 1 <= version <= PAK_MAX_VERSION:
+        raise ValueError(f"unsupported pak version {version}")
+    # the encrypted index flag comes just before the magic, from version 4 on
+    if version >= 4 and data[tail_start + magic_pos - 1] != 0:
+        raise ValueError("pak index is encrypted")
+    index = BinaryReader(data[index_offset : index_offset + index_size])
+    mount_point = index.fstring()
+    entry_count = index.unpack("i")
+    files = []
+    if version < 10:
+        for _ in range(entry_count):
+            name = index.fstring()
+            files.append((name, *read_pak_entry(index, version)))
+        return mount_point, files
+
+    index.unpack("Q")
+    if index.unpack("I"):
+        index.bytes(36)
+    has_directory_index = index.unpack("I")
+    if has_directory_index:
+        directory_offset, directory_size = index.unpack("qq")
+        index.bytes(20)
+    encoded = index.bytes(index.unpack("i"))
+    unencoded = [read_pak_entry(index, version) for _ in range(index.unpack("i"))]
+    if not has_directory_index:
+        # no file names, so just total up the entries
+        pos = 0
+        while pos < len(encoded):
+            size, uncompressed_size, pos = decode_pak_entry(encoded, pos)
+            files.append(("(unnamed)", size, uncompressed_size))
+        files += [("(unnamed)", *entry) for entry in unencoded]
+        return mount_point, files
+
+    directories = BinaryReader(
+        data[directory_offset : directory_offset + directory_size]
+    )
+    for _ in range(directories.unpack("i")):
+        directory = directories.fstring().lstrip("/")
+        for _ in range(directories.unpack("i")):
+            name = directories.fstring()
+            location = directories.unpack("i")
+            if location >= 0:
+                size, uncompressed_size, _ = decode_pak_entry(encoded, location)
+            elif location != -(2**31):
+                size, uncompressed_size = unencoded[-location - 1]
+            else:
+                continue
+            files.append((directory + name, size, uncompressed_size))
+    return mount_point, files
+
+
+def read_utoc_index(data):
+    # IO store table of contents, the .ucas next to it holds the data
+    # returns (mount point, [(file name, compressed size, uncompressed size)])
+    if bytes(data[:16]) != UTOC_MAGIC:
+        raise ValueError("not a utoc file")
+    header = BinaryReader(data, 16)
+    version = header.unpack("B")
+    if version not in UTOC_VERSIONS:
+        raise ValueError(f"unsupported utoc version {version}")
+    header.bytes(3)
+    (
+        header_size,
+        entry_count,
+        block_count,
+        block_entry_size,
+        method_count,
+        method_length,
+        block_size,
+        directory_index_size,
+    ) = header.unpack("8I")
+    header.bytes(4 + 8 + 16)
+    container_flags = header.unpack("B")
+    header.bytes(3)
+    perfect_hash_seeds = header.unpack("I")
+    header.bytes(8)
+    chunks_without_perfect_hash = header.unpack("I")
+
+    pos = header_size + entry_count * 12
+    offsets_pos = pos
+    pos += entry_count * 10
+    if version >= 4:
+        pos += perfect_hash_seeds * 4
+    if version >= 5:
+        pos += chunks_without_perfect_hash * 4
+    blocks_pos = pos
+    pos += block_count * block_entry_size + method_count * method_length
+    if container_flags & 4:
+        # signed, skip the signatures and block hashes
+        (hash_size,) = struct.unpack_from("<i", data, pos)
+        pos += 4 + hash_size * 2 + block_count * 20
+    if not container_flags & 8 or directory_index_size == 0:
+        raise ValueError("utoc has no directory index")
+    if container_flags & 2:
+        raise ValueError("utoc directory index is encrypted")
+
+    def chunk_sizes(chunk):
+        entry = bytes(data[offsets_pos + chunk * 10 : offsets_pos + chunk * 10 + 10])
+        offset = int.from_bytes(entry[:5], "big")
+        length = int.from_bytes(entry[5:], "big")
+        size = 0
+        last_block = (offset + length - 1) // block_size
+        for block in range(offset // block_size, last_block + 1):
+            block_pos = blocks_pos + block * block_entry_size
+            size += int.from_bytes(data[block_pos + 5 : block_pos + 8], "little")
+        return size, length
+
+    index = BinaryReader(data[pos : pos + directory_index_size])
+    mount_point = index.fstring()
+    directory_entries = [index.unpack("4I") for _ in range(index.unpack("i"))]
+    file_entries = [index.unpack("3I") for _ in range(index.unpack("i"))]
+    strings = [index.fstring() for _ in range(index.unpack("i"))]
+    none = 0xFFFFFFFF
+    files = []
+    # walk the directory tree from the root, which has no name
+    pending = [(0, "")]
+    while pending:
+        directory, parent_path = pending.pop()
+        name, first_child, next_sibling, first_file = directory_entries[directory]
+        path = parent_path if name == none else parent_path + strings[name] + "/"
+        if next_sibling != none:
+            pending.append((next_sibling, parent_path))
+        if first_child != none:
+            pending.append((first_child, path))
+        file_entry = first_file
+        while file_entry != none:
+            file_name, file_entry, chunk = file_entries[file_entry]
+            files.append((path + strings[file_name], *chunk_sizes(chunk)))
+    return mount_point, files
+
+
+def packaged_asset_path(mount_point, file_name):
+    # turn pak paths into the paths used in the editor where there is one,
+    # e.g. ../../../DirectVideoExample/Content/Movies/x.uasset -> /Game/Movies/x.uasset
+    path = (mount_point + file_name).replace("\\", "/")
+    while path.startswith("../"):
+        path = path[3:]
+    m = re.match(r"(?:.*/)?Plugins/(?:.*/)?([^/]+)/Content/(.*)", path)
+    if m:
+        return f"/{m.group(1)}/{m.group(2)}"
+    if path.startswith(f"{project_file.stem}/Content/"):
+        return "/Game/" + path.removeprefix(f"{project_file.stem}/Content/")
+    if path.startswith("Engine/Content/"):
+        return "/Engine/" + path.removeprefix("Engine/Content/")
+    return path
+
+
+def zip_member_data(archive_map, archive: zipfile.ZipFile, info: zipfile.ZipInfo):
+    # stored members are read straight out of the mapped file without copying
+    if info.compress_type == zipfile.ZIP_STORED and archive_map is not None:
+        name_length, extra_length = struct.unpack_from(
+            "<HH", archive_map, info.header_offset + 26
+        )
+        start = info.header_offset + 30 + name_length + extra_length
+        return memoryview(archive_map)[start : start + info.file_size]
+    return archive.read(info)
+
+
+def packaged_files(container, data, archive_map=None):
+    # everything in an APK / OBB / zip / pak / utoc, looking inside nested containers
+    suffix = Path(container).suffix.lower()
+    files = []
+    if suffix in (".apk", ".obb", ".zip"):
+        zip_data = io.BytesIO(data) if archive_map is None else archive_map
+        with zipfile.ZipFile(zip_data) as z:
+            for info in z.infolist():
+                if info.is_dir():
+                    continue
+                member_suffix = Path(info.filename).suffix.lower()
+                if member_suffix == ".ucas":
+                    # accounted for by the matching .utoc
+                    continue
+                if member_suffix in CONTAINER_SUFFIXES:
+                    files += packaged_files(
+                        f"{container}/{info.filename}",
+                        zip_member_data(archive_map, z, info),
+                    )
+                else:
+                    files.append(
+                        PackagedFile(
+                            container, info.filename, info.compress_size, info.file_size
+                        )
+                    )
+        return files
+    try:
+        if suffix == ".pak":
+            mount_point, entries = read_pak_index(data)
+        elif suffix == ".utoc":
+            mount_point, entries = read_utoc_index(data)
+        else:
+            return files
+    except (ValueError, struct.error, IndexError) as e:
+        print(f"Can't read {container}: {e}")
+        return [PackagedFile(container, "(unreadable)", len(data), len(data))]
+    return [
+        PackagedFile(container, packaged_asset_path(mount_point, name), size, full_size)
+        for name, size, full_size in entries
+    ]
+
+
+def release_packaged_files(target: Path):
+    # a release folder, or a single apk / obb / zip / pak / utoc
+    paths = [target]
+    if target.is_dir():
+        paths = sorted(
+            p
+            for p in target.rglob("*")
+            if p.suffix.lower() in CONTAINER_SUFFIXES - {".ucas"}
+        )
+    files = []
+    for path in paths:
+        with open(path, "rb") as f:
+            if path.stat().st_size == 0:
+                continue
+            archive_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                files += packaged_files(
+                    str(path.relative_to(target.parent)), archive_map, archive_map
+                )
+            finally:
+                archive_map.close()
+    return files
+
+
+def folder_sizes(files, depth):
+    # {folder: [file count, compressed size, uncompressed size]}
+    folders = {}
+    for f in files:
+        parts = f.path.split("/")
+        if f.path.startswith("/"):
+            folder = "/".join(parts[: min(depth + 1, len(parts) - 1)])
+        else:
+            folder = "/".join(parts[: min(depth, len(parts) - 1)]) or "(root)"
+        totals = folders.setdefault(folder, [0, 0, 0])
+        totals[0] += 1
+        totals[1] += f.size
+        totals[2] += f.uncompressed_size
+    return folders
+
+
+def editor_only_plugins():
+    plugins = set(EDITOR_ONLY_PLUGINS)
+    uproject = json.loads(project_file.read_text())
+    for plugin in uproject.get("Plugins", []):
+        allowed = plugin.get("TargetAllowList")
+        if allowed is not None and set(allowed) <= {"Editor"}:
+            plugins.add(plugin["Name"])
+    return plugins
+
+
+def editor_plugin_content(files):
+    # {plugin: [file count, compressed size]} for editor plugins found in the build
+    plugins = editor_only_plugins()
+    found = {}
+    for f in files:
+        for part in set(f.path.split("/")) & plugins:
+            totals = found.setdefault(part, [0, 0])
+            totals[0] += 1
+            totals[1] += f.size
+    return found
+
+
+def size_target(name):
+    if name in [x.flavour_name for x in BUILD_FLAVOURS]:
+        return release_folder / name
+    return Path(name)
+
+
+def print_size_row(name, count, size, full_size):
+    print(f"{format_size(size):>10} {format_size(full_size):>10} {count:>7}  {name}")
+
+
+def print_size_changes(base, current, top):
+    rows = []
+    for folder in base.keys() | current.keys():
+        old = base.get(folder, [0, 0, 0])
+        new = current.get(folder, [0, 0, 0])
+        if old != new:
+            rows.append((folder, old, new))
+    rows.sort(key=lambda row: -abs(row[2][1] - row[1][1]))
+    for folder, old, new in rows[:top]:
+        delta = new[1] - old[1]
+        sign = "+" if delta >= 0 else "-"
+        note = " (new)" if old[0] == 0 else " (removed)" if new[0] == 0 else ""
+        print(
+            f"{format_size(old[1]):>9} -> {format_size(new[1]):>9} "
+            f"{sign}{format_size(abs(delta)):>9}  {folder}{note}"
+        )
+    if len(rows) > top:
+        print(f"... and {len(rows) - top} more changed folders")
+    return rows
+
+
+def command_size(args):
+    target = size_target(args.target)
+    if not target.exists():
+        print(f"{target} not found")
+        sys.exit(-1)
+    files = release_packaged_files(target)
+    if len(files) == 0:
+        print(f"No packaged files found in {target}")
+        sys.exit(-1)
+    results = {"target": str(target)}
+
+    containers = {}
+    for f in files:
+        totals = containers.setdefault(f.container, [0, 0, 0])
+        totals[0] += 1
+        totals[1] += f.size
+        totals[2] += f.uncompressed_size
+    print(f"{'compressed':>10} {'full size':>10} {'files':>7}")
+    for container, totals in containers.items():
+        print_size_row(container, *totals)
+    print()
+
+    folders = folder_sizes(files, args.depth)
+    results["containers"] = containers
+    results["folders"] = folders
+    if args.diff is None:
+        ordered = sorted(folders.items(), key=lambda x: -x[1][1])
+        for folder, totals in ordered[: args.top]:
+            print_size_row(folder, *totals)
+        if len(ordered) > args.top:
+            print(f"... and {len(ordered) - args.top} more folders")
+    else:
+        base_target = size_target(args.diff)
+        base_files = release_packaged_files(base_target)
+        base_folders = folder_sizes(base_files, args.depth)
+        old_total = sum(f.size for f in base_files)
+        new_total = sum(f.size for f in files)
+        print(
+            f"{base_target} -> {target}: {format_size(old_total)} -> "
+            f"{format_size(new_total)}"
+        )
+        changes = print_size_changes(base_folders, folders, args.top)
+        results["diff"] = {
+            "base": str(base_target),
+            "changes": {folder: [old, new] for folder, old, new in changes},
+        }
+
+    plugins = editor_plugin_content(files)
+    results["editor_plugins"] = plugins
+    for plugin, (count, size) in plugins.items():
+        print(
+            f"Editor-only plugin {plugin} is in the build: "
+            f"{count} files, {format_size(size)}"
+        )
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=4))
+        print(f"Saved results to {args.json}")
+    if len(plugins) > 0:
+        sys.exit(1)
+
+
+# Daemon mode: one long-lived process queues build, run and benchmark jobs from thin
+# clients over a local socket. Identical concurrent requests share one job, jobs that
+# would clobber each other (a serial build's config edits, a flavour's workspace or
+# build folder, a device) wait their turn, and job output is streamed to every client
+# attached to it. It is a scheduler, not a cache: jobs run as child processes, because
+# commands change the project files and module state and exit on errors, so each job
+# still reads the project and connects to its devices itself. What the daemon holds
+# is the adb device tracking connection, which it uses to hand jobs a free device.
+DAEMON_COMMANDS = ["build", "run", "benchmark"]
+# finished jobs kept for status
+DAEMON_KEEP_JOBS = 20
+# how long a cancelled job has to clean up before it is killed
+DAEMON_CANCEL_SECONDS = 30
+
+
+def daemon_info_path():
+    return project_folder / "Saved" / "daemon.json"
+
+
+def job_resources(job_args):
+    # things a job needs to itself while it runs
+    resources = set()
+    flavour_names = job_args.device
+    if isinstance(flavour_names, str):
+        flavour_names = [flavour_names]
+    if "all" in flavour_names:
+        flavour_names = [f.flavour_name for f in BUILD_FLAVOURS if not f.dont_build]
+    folder = "DevReleases" if job_args.development else "Releases"
+    for flavour_name in flavour_names:
+        resources.add(f"{folder}/{flavour_name}")
+    if job_args.command == "build":
+        if job_args.jobs == 1:
+            # serial builds switch flavour by editing the uproject and DefaultEngine.ini
+            resources.add("project")
+        else:
+            # parallel builds build each flavour in its own workspace
+            for flavour_name in flavour_names:
+                resources.add(f"workspace:{flavour_name}")
+    return resources
+
+
+def job_devices(job_args):
+    # None for a job that doesn't use a device, the serials it was given, [] for one
+    # that can use any device, or ["all"] for one that uses every connected device
+    device_options = [
+        "install", "run", "grablog", "logname", "trace", "telemetry", "patch"
+    ]
+    if job_args.command == "build" and not any(
+        getattr(job_args, name, None) for name in device_options
+    ):
+        return None
+    if not hasattr(job_args, "devices"):
+        # commands without --devices use the first device, which could be any of them
+        return ["all"]
+    if job_args.devices is None:
+        return []
+    if "all" in job_args.devices:
+        return ["all"]
+    return job_args.devices
+
+
+def device_resources(serials):
+    if serials == [] or serials == ["all"]:
+        return {"devices"}
+    return {f"device:{serial}" for serial in serials}
+
+
+def resources_clash(resources, blocked):
+    if resources & blocked:
+        return True
+    # "devices" is every device, so it clashes with each single one, and workspaces
+    # are made from the project's files, which "project" edits
+    for whole, prefix in [("devices", "device:"), ("project", "workspace:")]:
+        if whole in resources and any(x.startswith(prefix) for x in blocked):
+            return True
+        if whole in blocked and any(x.startswith(prefix) for x in resources):
+            return True
+    return False
+
+
+def stop_process_group(proc, timeout=DAEMON_CANCEL_SECONDS):
+    # stops a process started in a group of its own, and everything it started
+    if sys.platform == "win32":
+        subprocess.run(
+            ["taskkill", "/T", "/F", "/PID", str(proc.pid)], capture_output=True
+        )
+        return
+    try:
+        # ctrl+c first, so a serial build puts the project's config files back
+        os.killpg(proc.pid, signal.SIGINT)
+        proc.wait(timeout)
+    except subprocess.TimeoutExpired:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        # already finished
+        pass
+
+
+class DaemonJob:
+    def __init__(self, job_id, argv, cwd):
+        job_args = parse_arguments(argv)
+        self.id = job_id
+        self.argv = argv
+        self.cwd = cwd
+        # the same command with the same options, from the same folder
+        self.key = json.dumps([cwd, sorted(vars(job_args).items())], default=str)
+        self.resources = job_resources(job_args)
+        self.devices = job_devices(job_args)
+        # what is run, which has a device added if the job can use any
+        self.run_argv = argv
+        self.state = "queued"
+        self.proc = None
+        self.cancelled = False
+        self.waiting_for = None
+        self.output = []
+        self.returncode = None
+        self.clients = 0
+        self.submitted = datetime.now().isoformat(timespec="seconds")
+
+    def status(self):
+        return {
+            "id": self.id,
+            "command": shlex.join(self.run_argv),
+            "state": self.state,
+            "clients": self.clients,
+            "submitted": self.submitted,
+            "returncode": self.returncode,
+        }
+
+
+class BuildDaemon:
+    def __init__(self):
+        self.token = os.urandom(16).hex()
+        # guards everything below, and is notified whenever any of it changes
+        self.changed = threading.Condition()
+        self.jobs = []
+        self.next_id = 1
+        # None until the adb server has told us what is connected
+        self.devices = None
+
+    def submit(self, argv, cwd):
+        # returns the job, and whether it was merged with one already submitted
+        with self.changed:
+            new_job = DaemonJob(self.next_id, argv, cwd)
+            for job in self.jobs:
+                if job.state != "done" and job.key == new_job.key:
+                    job.clients += 1
+                    return job, True
+            self.next_id += 1
+            new_job.clients += 1
+            self.jobs.append(new_job)
+            self._schedule()
+            return new_job, False
+
+    def _schedule(self):
+        # start queued jobs in order, unless something running or queued earlier
+        # needs the same resources
+        blocked = set()
+        for job in self.jobs:
+            if job.state == "running":
+                blocked |= job.resources
+        ready = None
+        if self.devices is not None:
+            ready = [device.serial for device in self.devices if device.ready()]
+        for job in self.jobs:
+            if job.state != "queued":
+                continue
+            resources = set(job.resources)
+            run_argv = job.argv
+            waiting_for = None
+            if job.devices is None:
+                pass
+            elif ready is None or job.devices == ["all"]:
+                # without device tracking, or using every device, it needs them all
+                resources |= device_resources(job.devices)
+                if ready == []:
+                    waiting_for = "a device to be connected"
+            elif job.devices == []:
+                free = [
+                    serial
+                    for serial in ready
+                    if not resources_clash({f"device:{serial}"}, blocked)
+                ]
+                if len(ready) == 0:
+                    waiting_for = "a device to be connected"
+                elif len(free) == 0:
+                    # all busy, so it waits its turn like any other clash
+                    resources.add("devices")
+                else:
+                    resources.add(f"device:{free[0]}")
+                    run_argv = [*job.argv, "--devices", free[0]]
+            else:
+                resources |= device_resources(job.devices)
+                missing = [serial for serial in job.devices if serial not in ready]
+                if len(missing) > 0:
+                    waiting_for = f"{', '.join(missing)} to be connected"
+            if waiting_for is not None and waiting_for != job.waiting_for:
+                job.output.append(f"Waiting for {waiting_for}\n")
+            job.waiting_for = waiting_for
+            if waiting_for is not None:
+                blocked |= job.resources
+                continue
+            if resources_clash(resources, blocked):
+                # so later jobs don't jump ahead of it
+                blocked |= resources
+                continue
+            job.state = "running"
+            job.resources = resources
+            job.run_argv = run_argv
+            blocked |= resources
+            threading.Thread(target=self._run_job, args=(job,), daemon=True).start()
+        self.changed.notify_all()
+
+    def job_command(self, job):
+        return [sys.executable, str(Path(__file__).resolve()), *job.run_argv]
+
+    def _run_job(self, job):
+        env = os.environ.copy()
+        env["PYTHONUNBUFFERED"] = "1"
+        # in a group of its own, so a cancel stops the tools it runs as well
+        if sys.platform == "win32":
+            group = {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+        else:
+            group = {"start_new_session": True}
+        try:
+            proc = subprocess.Popen(
+                self.job_command(job),
+                cwd=job.cwd,
+                env=env,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                text=True,
+                errors="replace",
+                **group,
+            )
+            with self.changed:
+                job.proc = proc
+                cancelled = job.cancelled
+            if cancelled:
+                # cancelled while it was starting
+                threading.Thread(target=stop_process_group, args=(proc,)).start()
+            for line in proc.stdout:
+                with self.changed:
+                    job.output.append(line)
+                    self.changed.notify_all()
+            returncode = proc.wait()
+        except OSError as e:
+            job.output.append(f"Couldn't start job: {e}\n")
+            returncode = -1
+        with self.changed:
+            job.proc = None
+            self._finish(job, returncode)
+
+    def _finish(self, job, returncode):
+        # called with self.changed held, frees the job's resources for the next jobs
+        job.returncode = returncode
+        job.state = "done"
+        finished = [x for x in self.jobs if x.state == "done"]
+        for old_job in finished[:-DAEMON_KEEP_JOBS]:
+            self.jobs.remove(old_job)
+        self._schedule()
+
+    def cancel(self, job_id):
+        # returns the job, or None if there is no job with that ID
+        with self.changed:
+            job = next((x for x in self.jobs if x.id == job_id), None)
+            if job is None or job.state == "done" or job.cancelled:
+                return job
+            job.cancelled = True
+            job.output.append("Cancelled\n")
+            if job.state == "queued":
+                self._finish(job, -1)
+                return job
+            # a running job finishes once its process has exited
+            proc = job.proc
+        if proc is not None:
+            stop_process_group(proc)
+        with self.changed:
+            self.changed.wait_for(lambda: job.state == "done", timeout=5)
+        return job
+
+    def _track_devices(self):
+        while True:
+            try:
+                with DeviceTracker() as tracker:
+                    for devices in tracker.updates():
+                        with self.changed:
+                            self.devices = devices
+                            self._schedule()
+            except OSError:
+                # no adb server (yet), jobs start adb themselves so don't hold them up
+                with self.changed:
+                    self.devices = None
+                    self._schedule()
+                time.sleep(5)
+
+    def follow(self, job, send):
+        # sends the job's output so far and then as it comes, then its exit code
+        sent = 0
+        try:
+            while True:
+                with self.changed:
+                    while job.state != "done" and sent == len(job.output):
+                        self.changed.wait()
+                    lines = job.output[sent:]
+                    done = job.state == "done"
+                for line in lines:
+                    send({"output": line})
+                sent += len(lines)
+                if done and sent == len(job.output):
+                    send({"exit": job.returncode})
+                    return
+        finally:
+            with self.changed:
+                job.clients -= 1
+
+    def status(self):
+        with self.changed:
+            return {
+                "devices": (
+                    None if self.devices is None else [str(x) for x in self.devices]
+                ),
+                "jobs": [job.status() for job in self.jobs],
+            }
+
+
+class DaemonRequestHandler(socketserver.StreamRequestHandler):
+    # one JSON request line from the client, then JSON lines back
+    def handle(self):
+        daemon = self.server.daemon
+
+        def send(message):
+            self.wfile.write(json.dumps(message).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+        try:
+            request = json.loads(self.rfile.readline())
+        except ValueError:
+            return
+        if request.get("token") != daemon.token:
+            send({"error": "bad token"})
+            return
+        if "cancel" in request:
+            job = daemon.cancel(request["cancel"])
+            if job is None:
+                send({"error": f"no job {request['cancel']}"})
+            else:
+                send({"cancelled": job.id, "state": job.state})
+            return
+        if "argv" not in request:
+            send(daemon.status())
+            return
+        argv = request["argv"]
+        if len(argv) == 0 or argv[0] not in DAEMON_COMMANDS:
+            send({"error": f"the daemon only runs {', '.join(DAEMON_COMMANDS)}"})
+            return
+        try:
+            job, merged = daemon.submit(argv, request["cwd"])
+        except SystemExit:
+            send({"error": f"bad arguments: {shlex.join(argv)}"})
+            return
+        send({"job": job.id, "merged": merged, "state": job.state})
+        try:
+            daemon.follow(job, send)
+        except OSError:
+            # the client went away, the job carries on
+            pass
+
+
+def command_daemon(args):
+    info_path = daemon_info_path()
+    if info_path.exists():
+        info = json.loads(info_path.read_text())
+        try:
+            socket.create_connection(("127.0.0.1", info["port"]), timeout=2).close()
+            print(f"A daemon is already running, process {info['pid']}")
+            sys.exit(-1)
+        except OSError:
+            pass
+    daemon = BuildDaemon()
+    server = socketserver.ThreadingTCPServer(
+        ("127.0.0.1", args.port), DaemonRequestHandler
+    )
+    server.daemon_threads = True
+    server.daemon = daemon
+    port = server.server_address[1]
+    # clients find the daemon, and prove they can read the project folder, from this
+    info_path.parent.mkdir(parents=True, exist_ok=True)
+    info_path.write_text(
+        json.dumps({"port": port, "token": daemon.token, "pid": os.getpid()})
+    )
+    threading.Thread(target=daemon._track_devices, daemon=True).start()
+    print(f"Daemon listening on port {port}, press ctrl+c to stop")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Stopping daemon")
+    finally:
+        server.server_close()
+        info_path.unlink(missing_ok=True)
+
+
+def command_submit(args):
+    info_path = daemon_info_path()
+    if not info_path.exists():
+        print("No daemon running, start one with 'make_releases.py daemon'")
+        sys.exit(-1)
+    info = json.loads(info_path.read_text())
+    request = {"token": info["token"]}
+    if args.cancel is not None:
+        request["cancel"] = args.cancel
+    elif len(args.job) > 0:
+        if args.job[0] not in DAEMON_COMMANDS:
+            print(f"The daemon only runs {', '.join(DAEMON_COMMANDS)}")
+            sys.exit(-1)
+        # shows usage errors here rather than in the daemon
+        parser.parse_args(args.job)
+        request.update({"argv": args.job, "cwd": os.getcwd()})
+    try:
+        connection = socket.create_connection(("127.0.0.1", info["port"]))
+    except OSError as e:
+        print(f"Can't connect to the daemon: {e}")
+        sys.exit(-1)
+    with connection, connection.makefile("rwb") as stream:
+        stream.write(json.dumps(request).encode("utf-8") + b"\n")
+        stream.flush()
+        try:
+            for line in stream:
+                message = json.loads(line)
+                if "error" in message:
+                    print(message["error"])
+                    sys.exit(-1)
+                elif "jobs" in message:
+                    print("Devices:", message["devices"])
+                    for job in message["jobs"]:
+                        print(
+                            f"{job['id']:4} {job['state']:8} "
+                            f"{job['clients']} clients  {job['submitted']}  "
+                            f"{job['command']}"
+                        )
+                elif "cancelled" in message:
+                    print(f"Cancelled job {message['cancelled']} ({message['state']})")
+                elif "job" in message:
+                    joined = "joined identical" if message["merged"] else "submitted"
+                    print(
+                        f"Daemon {joined} job {message['job']} ({message['state']})"
+                    )
+                elif "output" in message:
+                    print(message["output"], end="", flush=True)
+                elif "exit" in message:
+                    sys.exit(message["exit"])
+        except KeyboardInterrupt:
+            print("Detached, the job carries on in the daemon")
+            sys.exit(-1)
+
 
+def main():
+    # arguments are only parsed here, so that process pool workers can import this
+    global release_folder
+    args = parse_arguments()
+    if (args.command != "release") and getattr(args, "development", False):
+        release_folder = Path(__file__).parent / "DevReleases"
+    globals()["command_" + args.command.replace("-", "_")](args)
 
 
-locals()["command_" + args.command](args)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import make_releases  # noqa: E402
+
+FAKE_ADB = Path(__file__).resolve().parent / "fake_adb.py"
+
+
+@pytest.fixture
+def mr():
+    return make_releases
+
+
+class FakeAdb:
+    def __init__(self, folder: Path, monkeypatch):
+        self.folder = folder
+        self.calls_path = folder / "adb_calls.jsonl"
+        self.monkeypatch = monkeypatch
+        monkeypatch.setattr(make_releases, "ADB", str(FAKE_ADB))
+        monkeypatch.setenv("ADB", str(FAKE_ADB))
+        monkeypatch.setenv("FAKE_ADB_CALLS", str(self.calls_path))
+
+    def logcat(self, entries):
+        # [priority, tag, message, time, pid, tid] entries for logcat -B to send,
+        # or {text: entries} to pick them by what is in the app's launch command line
+        path = self.folder / "logcat.json"
+        path.write_text(json.dumps(entries))
+        self.monkeypatch.setenv("FAKE_ADB_LOGCAT", str(path))
+
+    def shell(self, responses):
+        # [(regex, output)], the output for the first regex a shell command matches
+        path = self.folder / "shell.json"
+        path.write_text(json.dumps(responses))
+        self.monkeypatch.setenv("FAKE_ADB_SHELL", str(path))
+
+    def files(self):
+        # the device's storage, for push and pull
+        path = self.folder / "device"
+        path.mkdir(exist_ok=True)
+        self.monkeypatch.setenv("FAKE_ADB_FILES", str(path))
+        return path
+
+    def devices(self, text):
+        self.monkeypatch.setenv("FAKE_ADB_DEVICES", text)
+
+    def calls(self):
+        if not self.calls_path.exists():
+            return []
+        return [json.loads(line) for line in self.calls_path.read_text().splitlines()]
+
+
+@pytest.fixture
+def fake_adb(tmp_path, monkeypatch):
+    return FakeAdb(tmp_path, monkeypatch)
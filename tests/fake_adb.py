@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# Stand-in for adb, selected with the ADB environment variable. Behaviour is set with:
+#   FAKE_ADB_LOGCAT  JSON file of [priority, tag, message, time, pid, tid] entries,
+#                    which `exec-out logcat -B` writes out as binary log entries. Or
+#                    {text: entries}, to send the entries for whichever text is in the
+#                    app's next launch command line, e.g. a map name
+#   FAKE_ADB_DEVICES output for `devices -l`
+#   FAKE_ADB_SHELL   JSON file of [regex, output] pairs, the output of the first one
+#                    that matches a shell command is printed. `shell` on its own runs
+#                    a session reading one command per line, of which only a trailing
+#                    `; echo WORD` is run
+#   FAKE_ADB_CALLS   file that each command line is appended to, as JSON
+#   FAKE_ADB_FILES   folder standing in for the device's storage for push and pull,
+#                    e.g. /sdcard/x is FAKE_ADB_FILES/sdcard/x
+import json
+import os
+import re
+import shutil
+import struct
+import sys
+import time
+
+
+def logger_entry(priority, tag, message, timestamp, pid, tid):
+    # struct logger_entry v3, as adb logcat -B writes it
+    payload = bytes([priority]) + tag.encode() + b"\0" + message.encode() + b"\0"
+    sec = int(timestamp)
+    nsec = round((timestamp - sec) * 1e9)
+    return struct.pack("<HHiIIiI", len(payload), 24, pid, tid, sec, nsec, 0) + payload
+
+
+def next_launch(timeout=10):
+    # the app is launched after logcat is started, so wait for the launch to be logged
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with open(os.environ["FAKE_ADB_CALLS"]) as f:
+            calls = [json.loads(line) for line in f]
+        launch = None
+        for call in calls:
+            if "logcat" in call and "-c" in call:
+                launch = None
+            elif "am" in call and "start" in call:
+                launch = " ".join(call)
+        if launch is not None:
+            return launch
+        time.sleep(0.02)
+    return ""
+
+
+def shell_output(command):
+    with open(os.environ["FAKE_ADB_SHELL"]) as f:
+        responses = json.load(f)
+    for match, output in responses:
+        if re.search(match, command):
+            return output
+    return ""
+
+
+def main(args):
+    if "FAKE_ADB_CALLS" in os.environ:
+        with open(os.environ["FAKE_ADB_CALLS"], "a") as f:
+            f.write(json.dumps(args) + "\n")
+    if args[:1] == ["-s"]:
+        args = args[2:]
+    if args[:3] == ["exec-out", "logcat", "-B"]:
+        with open(os.environ["FAKE_ADB_LOGCAT"]) as f:
+            entries = json.load(f)
+        if isinstance(entries, dict):
+            launch = next_launch()
+            entries = next((v for k, v in entries.items() if k in launch), [])
+        for entry in entries:
+            sys.stdout.buffer.write(logger_entry(*entry))
+        sys.stdout.buffer.flush()
+        return 0
+    if args[:1] == ["devices"]:
+        print("List of devices attached")
+        print(os.environ.get("FAKE_ADB_DEVICES", ""))
+        return 0
+    if args[:1] in (["push"], ["pull"]) and "FAKE_ADB_FILES" in os.environ:
+        local_path, remote_path = args[1:3] if args[0] == "push" else args[2:0:-1]
+        storage = os.environ["FAKE_ADB_FILES"]
+        device_path = os.path.join(storage, remote_path.lstrip("/"))
+        if args[0] == "push":
+            os.makedirs(os.path.dirname(device_path), exist_ok=True)
+            shutil.copyfile(local_path, device_path)
+        elif os.path.exists(device_path):
+            shutil.copyfile(device_path, local_path)
+        else:
+            print(f"adb: error: remote object '{remote_path}' does not exist")
+            return 1
+        return 0
+    if args == ["shell"] and "FAKE_ADB_SHELL" in os.environ:
+        for line in sys.stdin:
+            m = re.fullmatch(r"(.*); echo (\S+)", line.rstrip("\n"))
+            sys.stdout.write(shell_output(m.group(1) if m else line.rstrip("\n")))
+            if m:
+                print(m.group(2))
+            sys.stdout.flush()
+        return 0
+    if args[:1] == ["shell"] and "FAKE_ADB_SHELL" in os.environ:
+        sys.stdout.write(shell_output(" ".join(args[1:])))
+        return 0
+    # everything else (push, install, logcat -c...) succeeds with no output
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
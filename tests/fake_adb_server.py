@@ -0,0 +1,57 @@
+# Stand-in for the adb server's host:track-devices-l service. Each connection plays one
+# session: a list of device lists to send in turn, then stays open until the server
+# stops. A session of "FAIL <message>" refuses the request, and "close" in a session
+# drops the connection there, as when the adb server is restarted.
+import socketserver
+import threading
+import time
+
+
+def adb_message(text):
+    data = text.encode("utf-8")
+    return b"%04x" % len(data) + data
+
+
+class TrackDevicesHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        server = self.server
+        length = int(self.rfile.read(4), 16)
+        server.requests.append(self.rfile.read(length).decode("utf-8"))
+        with server.lock:
+            session = server.sessions.pop(0) if server.sessions else []
+        if len(session) > 0 and session[0].startswith("FAIL"):
+            self.wfile.write(b"FAIL" + adb_message(session[0][5:]))
+            return
+        self.wfile.write(b"OKAY")
+        for item in session:
+            if item == "close":
+                return
+            self.wfile.write(adb_message(item))
+            self.wfile.flush()
+            time.sleep(0.05)
+        server.stopping.wait()
+
+
+class FakeAdbServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, sessions):
+        super().__init__(("127.0.0.1", 0), TrackDevicesHandler)
+        self.sessions = list(sessions)
+        self.requests = []
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopping.set()
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,188 @@
+# Stand-in for the parts of the GitHub releases API that ReleaseApi uses, for pointing
+# GITHUB_API_URL at. Releases and assets are kept in memory. Failures can be queued up
+# with fail(), to test retries.
+import hashlib
+import http.server
+import json
+import re
+import threading
+import urllib.parse
+
+
+class ReleaseApiHandler(http.server.BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body=None):
+        content_type = "application/json"
+        if body is None:
+            data = b""
+        elif isinstance(body, bytes):
+            data = body
+            content_type = "application/octet-stream"
+        else:
+            data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self):
+        server = self.server
+        url = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        body = b""
+        if "Content-Length" in self.headers:
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+        with server.lock:
+            server.requests.append((self.command, url.path))
+            # download links are public, everything else needs the token
+            authorized = self.headers.get("Authorization") == f"Bearer {server.token}"
+            if not authorized and not url.path.startswith("/download/"):
+                return self._send(401, {"message": "Bad credentials"})
+            failure = server.take_failure(self.command, url.path)
+            if failure is not None and not failure["after"]:
+                return self._send(failure["status"], {"message": "injected"})
+            status, response = server.route(self.command, url.path, query, body)
+            if failure is not None:
+                # the request did its work, but the reply is lost
+                return self._send(failure["status"], {"message": "injected"})
+        self._send(status, response)
+
+    do_GET = do_POST = do_DELETE = _handle
+
+
+class FakeReleaseApi(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, repo="owner/repo", token="token", digests=True):
+        super().__init__(("127.0.0.1", 0), ReleaseApiHandler)
+        self.repo = repo
+        self.token = token
+        # whether assets report a sha256 digest, as newer GitHub uploads do
+        self.digests = digests
+        self.lock = threading.Lock()
+        self.releases = {}
+        self.assets = {}
+        self.next_id = 1
+        self.requests = []
+        self.failures = []
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def fail(self, method, path_match, status=502, times=1, after=False):
+        # fail the next matching requests, after=True does the work first
+        self.failures.append(
+            {
+                "method": method,
+                "match": re.compile(path_match),
+                "status": status,
+                "times": times,
+                "after": after,
+            }
+        )
+
+    def take_failure(self, method, path):
+        for failure in self.failures:
+            if failure["method"] == method and failure["match"].search(path):
+                failure["times"] -= 1
+                if failure["times"] == 0:
+                    self.failures.remove(failure)
+                return failure
+        return None
+
+    def _new_id(self):
+        self.next_id += 1
+        return self.next_id - 1
+
+    def release_assets(self, release_id):
+        return [a for a in self.assets.values() if a["release_id"] == release_id]
+
+    def asset_named(self, release_id, name):
+        for asset in self.release_assets(release_id):
+            if asset["name"] == name:
+                return asset
+        return None
+
+    def _asset_json(self, asset):
+        info = {
+            key: asset[key] for key in ["id", "name", "size", "browser_download_url"]
+        }
+        if self.digests:
+            info["digest"] = "sha256:" + hashlib.sha256(asset["data"]).hexdigest()
+        return info
+
+    def route(self, method, path, query, body):
+        repo_path = f"/repos/{self.repo}/"
+        if path.startswith("/download/"):
+            asset = self.assets.get(int(path.split("/")[2]))
+            if asset is None:
+                return 404, {"message": "Not Found"}
+            return 200, asset["data"]
+        if path.startswith("/uploads" + repo_path) and method == "POST":
+            release_id = int(path.split("/")[-2])
+            name = query["name"][0]
+            if self.asset_named(release_id, name) is not None:
+                return 422, {"message": "already_exists"}
+            asset_id = self._new_id()
+            self.assets[asset_id] = {
+                "id": asset_id,
+                "release_id": release_id,
+                "name": name,
+                "size": len(body),
+                "data": body,
+                "browser_download_url": f"{self.url}/download/{asset_id}",
+            }
+            return 201, self._asset_json(self.assets[asset_id])
+        if not path.startswith(repo_path):
+            return 404, {"message": "Not Found"}
+        path = path[len(repo_path) :]
+        if path.startswith("releases/tags/") and method == "GET":
+            tag = urllib.parse.unquote(path.removeprefix("releases/tags/"))
+            for release in self.releases.values():
+                if release["tag_name"] == tag:
+                    return 200, release
+            return 404, {"message": "Not Found"}
+        if path == "releases" and method == "POST":
+            tag = json.loads(body)["tag_name"]
+            if any(r["tag_name"] == tag for r in self.releases.values()):
+                return 422, {"message": "Validation Failed"}
+            release_id = self._new_id()
+            self.releases[release_id] = {
+                "id": release_id,
+                "tag_name": tag,
+                "upload_url": (
+                    f"{self.url}/uploads{repo_path}releases/{release_id}"
+                    "/assets{?name,label}"
+                ),
+            }
+            return 201, self.releases[release_id]
+        m = re.fullmatch(r"releases/(\d+)/assets", path)
+        if m is not None and method == "GET":
+            assets = self.release_assets(int(m.group(1)))
+            per_page = int(query["per_page"][0])
+            page = int(query["page"][0])
+            page_assets = assets[(page - 1) * per_page : page * per_page]
+            return 200, [self._asset_json(asset) for asset in page_assets]
+        m = re.fullmatch(r"releases/assets/(\d+)", path)
+        if m is not None and method == "DELETE":
+            if self.assets.pop(int(m.group(1)), None) is None:
+                return 404, {"message": "Not Found"}
+            return 204, None
+        return 404, {"message": "Not Found"}
+
+    def asset_data(self, tag):
+        # {name: bytes} of a release's assets
+        release = next(r for r in self.releases.values() if r["tag_name"] == tag)
+        return {a["name"]: a["data"] for a in self.release_assets(release["id"])}
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
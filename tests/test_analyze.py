@@ -0,0 +1,42 @@
+def write_log(path, lines):
+    path.write_text(
+        "".join(
+            f"10-17 10:00:{i // 10:02d}.{i % 10}00  100  101 I UE: {line}\n"
+            for i, line in enumerate(lines)
+        )
+    )
+
+
+def test_fps_readings_are_labelled_as_sampled(mr, tmp_path, capsys):
+    log = tmp_path / "fps.txt"
+    write_log(log, [f"FPS: {fps}" for fps in [72, 72, 30, 72, 72, 72]])
+    results = mr.analyze_logs([log])
+    overall = results["overall"]
+    assert overall["source"] == "sampled fps"
+    assert overall["samples"] == 6
+    assert overall["hitches"] == 1
+    mr.print_frame_stats("overall", overall)
+    assert "6 fps samples" in capsys.readouterr().out
+
+
+def test_frame_times_are_used_over_fps_readings(mr, tmp_path, capsys):
+    log = tmp_path / "frames.txt"
+    lines = ["FPS: 60"] + [f"frame time: {ms} ms" for ms in [10, 10, 10, 40]]
+    write_log(log, lines)
+    overall = mr.analyze_logs([log])["overall"]
+    assert overall["source"] == "frame times"
+    assert overall["samples"] == 4
+    assert overall["max_ms"] == 40
+    assert overall["hitches"] == 1
+    mr.print_frame_stats("overall", overall)
+    assert "4 frames" in capsys.readouterr().out
+
+
+def test_summary_keeps_source(mr):
+    runs = [
+        {"source": "sampled fps", "samples": 2, "mean_fps": 70.0},
+        {"source": "sampled fps", "samples": 3, "mean_fps": 72.0},
+    ]
+    summary = mr.summarise_runs(runs)
+    assert summary["source"] == "sampled fps"
+    assert summary["samples"] == 5
@@ -0,0 +1,55 @@
+import json
+
+import pytest
+
+
+def frame_entries(fps, count=20):
+    start = 1760000000.0
+    return [
+        [4, "UE", f"LogTemp: FPS: {fps}", start + i * 0.1, 100, 101]
+        for i in range(count)
+    ]
+
+
+@pytest.fixture
+def benchmark(mr, fake_adb, tmp_path, monkeypatch):
+    monkeypatch.setattr(mr, "project_folder", tmp_path)
+    monkeypatch.setattr(
+        mr, "wait_for_device", lambda serial=None: [mr.AdbDevice("SERIAL", "device")]
+    )
+
+    def run(texture_fps, mesh_fps, *options):
+        fake_adb.logcat(
+            {
+                mr.BENCHMARK_MODES["texture"]: frame_entries(texture_fps),
+                mr.BENCHMARK_MODES["mesh"]: frame_entries(mesh_fps),
+            }
+        )
+        output = tmp_path / f"results-{texture_fps}-{mesh_fps}.json"
+        argv = ["benchmark", "quest", "--duration", "0.5", "--warmup", "0"]
+        argv += ["--repeats", "2", "--output", str(output), *options]
+        mr.command_benchmark(mr.parse_arguments(argv))
+        return output
+
+    return run
+
+
+def test_summary_for_each_mode(benchmark):
+    results = json.loads(benchmark(72, 60).read_text())
+    assert list(results["modes"]) == ["texture", "mesh"]
+    for mode, fps in [("texture", 72), ("mesh", 60)]:
+        mode_results = results["modes"][mode]
+        assert len(mode_results["runs"]) == 2
+        summary = mode_results["summary"]
+        assert summary["source"] == "sampled fps"
+        assert summary["samples"] == 40
+        assert summary["mean_fps"] == pytest.approx(fps)
+
+
+def test_regression_fails(benchmark):
+    baseline = benchmark(72, 60)
+    # within the allowed regression
+    benchmark(72, 59, "--baseline", str(baseline))
+    with pytest.raises(SystemExit) as e:
+        benchmark(72, 45, "--baseline", str(baseline))
+    assert e.value.code == 1
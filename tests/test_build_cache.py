@@ -0,0 +1,66 @@
+import shutil
+import zipfile
+
+import pytest
+
+
+@pytest.fixture
+def build(mr, tmp_path, monkeypatch):
+    # a project with some content, and empty release and artifact cache folders
+    project = tmp_path / "project"
+    (project / "Content").mkdir(parents=True)
+    (project / "Content" / "Map.umap").write_bytes(b"map")
+    monkeypatch.setattr(mr, "project_folder", project)
+    monkeypatch.setattr(mr, "release_folder", tmp_path / "Releases")
+    args = mr.parse_arguments(
+        ["build", "quest", "--artifact-cache", str(tmp_path / "cache")]
+    )
+    flavour = mr.find_flavour("quest")
+    return args, flavour
+
+
+def input_hash(mr, args, flavour, tmp_path):
+    hash_cache = mr.FileHashCache(tmp_path / "hash_cache.json")
+    return mr.build_input_hash(args, flavour, "uproject", "engine ini", hash_cache)
+
+
+def fake_build(mr, args, flavour, input_hash):
+    platform_folder = mr.release_folder / flavour.flavour_name
+    platform_folder.mkdir(parents=True)
+    (platform_folder / "app.apk").write_bytes(b"apk")
+    mr.write_build_manifest(args, flavour, platform_folder, input_hash)
+    mr.store_cached_build(args, flavour, input_hash)
+    return platform_folder
+
+
+def test_cache_hit(mr, build, tmp_path):
+    args, flavour = build
+    first_hash = input_hash(mr, args, flavour, tmp_path)
+    platform_folder = fake_build(mr, args, flavour, first_hash)
+    assert mr.restore_cached_build(args, flavour, first_hash)
+
+    # another machine, or a release folder that has since been cleared
+    shutil.rmtree(platform_folder)
+    assert mr.restore_cached_build(args, flavour, first_hash)
+    assert (platform_folder / "app.apk").read_bytes() == b"apk"
+    assert mr.read_build_manifest(platform_folder)["input_hash"] == first_hash
+
+
+def test_cache_miss_after_input_changes(mr, build, tmp_path):
+    args, flavour = build
+    first_hash = input_hash(mr, args, flavour, tmp_path)
+    fake_build(mr, args, flavour, first_hash)
+    (mr.project_folder / "Content" / "Map.umap").write_bytes(b"changed map")
+    changed_hash = input_hash(mr, args, flavour, tmp_path)
+    assert changed_hash != first_hash
+    assert not mr.restore_cached_build(args, flavour, changed_hash)
+    args.rebuild = True
+    assert not mr.restore_cached_build(args, flavour, first_hash)
+
+
+def test_release_zip_leaves_out_build_manifest(mr, build, tmp_path):
+    args, flavour = build
+    platform_folder = fake_build(mr, args, flavour, "hash")
+    zip_path, _ = mr.make_release_zip(platform_folder, tmp_path / "quest.zip")
+    with zipfile.ZipFile(zip_path) as zf:
+        assert zf.namelist() == ["quest/app.apk"]
@@ -0,0 +1,41 @@
+def parse_build(mr, name, lines):
+    parser = mr.BuildLogParser(name)
+    for line in lines:
+        parser.feed(line)
+    parser.finish(0)
+    return parser
+
+
+UAT_OUTPUT = [
+    "********** BUILD COMMAND STARTED **********",
+    "warning C4996: deprecated",
+    "********** BUILD COMMAND COMPLETED **********",
+    "********** COOK COMMAND STARTED **********",
+    "LogShaderCompilers: Display: shaders left to compile 120",
+    "Error: missing asset",
+    "********** COOK COMMAND COMPLETED **********",
+]
+
+
+def test_timing(mr):
+    timing = parse_build(mr, "quest", UAT_OUTPUT).timing()
+    assert [p["name"] for p in timing["phases"]] == ["startup", "build", "cook"]
+    assert timing["shaders_to_compile"] == 120
+    assert (timing["warning_count"], timing["error_count"]) == (1, 1)
+
+
+def test_trace_has_integer_pids_and_process_names(mr):
+    quest = parse_build(mr, "quest", UAT_OUTPUT).trace()["traceEvents"]
+    pico = parse_build(mr, "pico", UAT_OUTPUT).trace()["traceEvents"]
+    assert quest[0] == {
+        "name": "process_name",
+        "ph": "M",
+        "pid": quest[1]["pid"],
+        "args": {"name": "quest"},
+    }
+    assert all(isinstance(event["pid"], int) for event in quest + pico)
+    assert all(isinstance(event["tid"], int) for event in quest[1:] + pico[1:])
+    assert len({event["pid"] for event in quest}) == 1
+    assert quest[1]["pid"] != pico[1]["pid"]
+    # the same flavour keeps its pid between builds
+    assert parse_build(mr, "quest", []).trace()["traceEvents"][0] == quest[0]
@@ -0,0 +1,135 @@
+import struct
+import threading
+
+
+def make_elf(path, build_id):
+    # a 64 bit ELF with just a GNU build ID note section
+    desc = bytes.fromhex(build_id)
+    note = struct.pack("<III", 4, len(desc), 3) + b"GNU\0" + desc
+    section_offset = 64 + len(note)
+    header = b"\x7fELF\x02\x01\x01" + bytes(33) + struct.pack("<Q", section_offset)
+    header += bytes(0x3A - len(header)) + struct.pack("<HH", 64, 1)
+    header += bytes(64 - len(header))
+    section = struct.pack("<II16xQQ", 0, 7, 64, len(note)) + bytes(24)
+    path.write_bytes(header + note + section)
+
+
+def logcat_lines(pid, tid, tag, messages):
+    return [f"01-02 03:04:05.678 {pid:5} {tid:5} E {tag}: {m}\n" for m in messages]
+
+
+def test_tombstone_frame_keeps_whole_symbol(mr):
+    report = mr.CrashReport("tombstone", "crash", "", "1")
+    index, frame = report.parse_frame(
+        "      #01 pc 00000000001d3e5c  /data/app/x/base.apk!libUnreal.so "
+        "(offset 0x5a4000) (Foo::Bar(int)+12) (BuildId: 0a1b)"
+    )
+    assert index == 1
+    assert frame.module == "libUnreal.so"
+    assert frame.offset == 0x1D3E5C
+    assert frame.build_id == "0a1b"
+    assert frame.symbols == [("Foo::Bar(int)", "")]
+
+
+def test_reports_ignore_other_threads(mr, tmp_path):
+    log = tmp_path / "log.txt"
+    asan = "libUnreal.so"
+    lines = logcat_lines(
+        100, 101, asan, ["==100==ERROR: AddressSanitizer: heap-use-after-free"]
+    )
+    lines += logcat_lines(100, 102, "UE", ["LogTemp: another thread"])
+    lines += logcat_lines(100, 101, "UE", ["LogTemp: same thread, other tag"])
+    lines += logcat_lines(
+        100,
+        101,
+        asan,
+        [
+            "    #0 0x7a1b2c (/data/app/x/lib/arm64/libUnreal.so+0x1234)",
+            "SUMMARY: AddressSanitizer: heap-use-after-free",
+        ],
+    )
+    log.write_text("".join(lines))
+    (report,) = mr.read_crash_reports([log])
+    assert report.kind == "asan"
+    assert not any("LogTemp" in line for line in report.lines)
+    assert report.stacks[0][0].offset == 0x1234
+    assert report.complete
+
+
+def test_store_symbols_from_parallel_builds(mr, tmp_path, monkeypatch):
+    monkeypatch.setattr(mr, "project_folder", tmp_path / "project")
+    builds = []
+    for n in range(3 * mr.SYMBOL_STORE_KEEP):
+        binaries = tmp_path / f"build{n}"
+        binaries.mkdir()
+        make_elf(binaries / "libUnreal.so", f"{n:08x}")
+        builds.append(binaries)
+    errors = []
+
+    def store(binaries):
+        try:
+            mr.store_symbols(binaries)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=store, args=(b,)) for b in builds]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    stored = [x for x in mr.symbol_store().iterdir() if x.is_dir()]
+    assert len(stored) == mr.SYMBOL_STORE_KEEP
+    for folder in stored:
+        # copies, not links to binaries that the next build overwrites
+        assert (folder / "libUnreal.so").stat().st_nlink == 1
+    assert mr.elf_build_id(stored[0] / "libUnreal.so") == stored[0].name
+
+
+def test_symbol_store_keeps_whole_builds(mr, tmp_path, monkeypatch):
+    monkeypatch.setattr(mr, "project_folder", tmp_path / "project")
+    monkeypatch.setattr(mr, "SYMBOL_STORE_KEEP", 2)
+    for n in range(3):
+        binaries = tmp_path / f"build{n}"
+        binaries.mkdir()
+        make_elf(binaries / "libUnreal.so", f"{n:08x}")
+        make_elf(binaries / "libOther.so", f"{n + 100:08x}")
+        mr.store_symbols(binaries)
+    stored = sorted(x.name for x in mr.symbol_store().iterdir() if x.is_dir())
+    assert stored == ["00000001", "00000002", "00000065", "00000066"]
+    assert mr.stored_symbol_builds() == [
+        {"libUnreal.so": "00000001", "libOther.so": "00000065"},
+        {"libUnreal.so": "00000002", "libOther.so": "00000066"},
+    ]
+
+
+def test_frames_without_build_id_use_latest_stored_build(mr, tmp_path, monkeypatch):
+    monkeypatch.setattr(mr, "project_folder", tmp_path / "project")
+    monkeypatch.setenv("ADDR2LINE", "addr2line")
+    for n in range(2):
+        binaries = tmp_path / f"build{n}"
+        binaries.mkdir()
+        make_elf(binaries / "libUnreal.so", f"{n:08x}")
+        mr.store_symbols(binaries)
+    # an older libUnreal given with --symbols, and another library
+    extra = tmp_path / "extra"
+    extra.mkdir()
+    make_elf(extra / "libUnreal.so", "ffffffff")
+    make_elf(extra / "libExtra.so", "eeeeeeee")
+    symbolized = []
+
+    def run_addr2line(tool, library, addresses):
+        symbolized.append((mr.elf_build_id(library), library.name))
+        return {address: [("Foo()", "Foo.cpp:1")] for address in addresses}
+
+    monkeypatch.setattr(mr, "run_addr2line", run_addr2line)
+    report = mr.CrashReport("asan", "crash", "", "1")
+    report.add("    #0 0x7a1b2c (/data/app/x/lib/arm64/libUnreal.so+0x1234)")
+    report.add("    #1 0x7a1b2c (/data/app/x/lib/arm64/libExtra.so+0x1234)")
+    mr.symbolize_reports([report], [extra / "libUnreal.so", extra / "libExtra.so"])
+    assert sorted(symbolized) == [
+        ("00000001", "libUnreal.so"),
+        ("eeeeeeee", "libExtra.so"),
+    ]
+    for frame in report.stacks[0]:
+        assert frame.symbols == [("Foo()", "Foo.cpp:1")]
@@ -0,0 +1,105 @@
+import sys
+import threading
+
+
+def make_daemon(mr, monkeypatch, serials):
+    # a daemon whose jobs start but never finish
+    monkeypatch.setattr(mr.BuildDaemon, "_run_job", lambda self, job: None)
+    daemon = mr.BuildDaemon()
+    daemon.devices = [mr.AdbDevice(serial, "device") for serial in serials]
+    return daemon
+
+
+def test_jobs_on_different_devices_run_together(mr, monkeypatch):
+    daemon = make_daemon(mr, monkeypatch, ["A", "B"])
+    on_a, _ = daemon.submit(["run", "quest", "--devices", "A"], "/")
+    on_b, _ = daemon.submit(["run", "quest", "-d", "--devices", "B"], "/")
+    again_on_a, _ = daemon.submit(["run", "quest", "-d", "--devices", "A"], "/")
+    assert (on_a.state, on_b.state) == ("running", "running")
+    assert again_on_a.state == "queued"
+
+
+def test_jobs_are_given_a_free_device(mr, monkeypatch):
+    daemon = make_daemon(mr, monkeypatch, ["A", "B"])
+    on_a, _ = daemon.submit(["run", "quest", "--devices", "A"], "/")
+    any_device, _ = daemon.submit(["run", "quest", "-d"], "/")
+    assert any_device.state == "running"
+    assert any_device.run_argv == ["run", "quest", "-d", "--devices", "B"]
+    # benchmark always uses the first device, so it needs them all
+    benchmark, _ = daemon.submit(["benchmark", "quest"], "/")
+    assert benchmark.state == "queued"
+
+
+def test_jobs_wait_for_their_device(mr, monkeypatch):
+    daemon = make_daemon(mr, monkeypatch, ["A"])
+    job, _ = daemon.submit(["run", "quest", "--devices", "B"], "/")
+    assert job.state == "queued"
+    assert job.output == ["Waiting for B to be connected\n"]
+    with daemon.changed:
+        daemon.devices.append(mr.AdbDevice("B", "device"))
+        daemon._schedule()
+    assert job.state == "running"
+
+
+def test_concurrent_submits_get_unique_ids(mr, monkeypatch):
+    daemon = make_daemon(mr, monkeypatch, [])
+    jobs = []
+
+    def submit(n):
+        jobs.append(daemon.submit(["build", "quest", "--jobs", str(n)], "/")[0])
+
+    threads = [threading.Thread(target=submit, args=(n,)) for n in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(job.id for job in jobs) == list(range(1, 21))
+
+
+def test_parallel_builds_of_different_flavours_run_together(mr, monkeypatch):
+    daemon = make_daemon(mr, monkeypatch, [])
+    quest, _ = daemon.submit(["build", "quest", "--jobs", "2"], "/")
+    pico, _ = daemon.submit(["build", "pico", "--jobs", "2"], "/")
+    quest_again, _ = daemon.submit(["build", "quest", "-d", "--jobs", "2"], "/")
+    # serial builds edit the files the workspaces are made from
+    serial, _ = daemon.submit(["build", "android"], "/")
+    assert (quest.state, pico.state) == ("running", "running")
+    assert (quest_again.state, serial.state) == ("queued", "queued")
+
+
+def test_cancel_queued_job(mr, monkeypatch):
+    daemon = make_daemon(mr, monkeypatch, [])
+    first, _ = daemon.submit(["build", "quest"], "/")
+    second, _ = daemon.submit(["build", "pico"], "/")
+    assert daemon.cancel(second.id) is second
+    assert (second.state, second.returncode) == ("done", -1)
+    assert second.output == ["Cancelled\n"]
+    assert daemon.cancel(99) is None
+
+
+def test_cancel_stops_running_job_and_frees_its_resources(mr, monkeypatch):
+    # a job that cleans up when interrupted, like a serial build restoring the project
+    script = (
+        "import time\n"
+        "try:\n"
+        "    print('started')\n"
+        "    time.sleep(60)\n"
+        "finally:\n"
+        "    print('cleaned up')\n"
+    )
+    monkeypatch.setattr(
+        mr.BuildDaemon, "job_command", lambda self, job: [sys.executable, "-c", script]
+    )
+    daemon = mr.BuildDaemon()
+    daemon.devices = []
+    first, _ = daemon.submit(["build", "quest"], "/")
+    second, _ = daemon.submit(["build", "pico"], "/")
+    with daemon.changed:
+        assert daemon.changed.wait_for(lambda: "started\n" in first.output, timeout=10)
+    assert second.state == "queued"
+    daemon.cancel(first.id)
+    assert first.state == "done"
+    assert first.returncode != 0
+    assert "cleaned up\n" in first.output
+    assert second.state == "running"
+    daemon.cancel(second.id)
@@ -0,0 +1,56 @@
+import os
+
+import pytest
+
+
+@pytest.fixture
+def ddc(mr, tmp_path, monkeypatch):
+    monkeypatch.setattr(mr, "project_folder", tmp_path)
+    root = tmp_path / "DerivedDataCache"
+
+    def add(relative_path, last_used, size=100):
+        path = root / relative_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(bytes(size))
+        os.utime(path, (last_used, last_used))
+        return path
+
+    return root, add
+
+
+def ddc_command(mr, *argv):
+    mr.command_ddc(mr.parse_arguments(["ddc", *argv]))
+
+
+def test_evict_oldest_first_down_to_budget(mr, ddc):
+    root, add = ddc
+    # used in the order 1..5, spread over caches and subfolders
+    files = [
+        add("5.5/quest/a/1.udd", 1000),
+        add("5.5/pico/2.udd", 2000),
+        add("5.5/quest/b/3.udd", 3000),
+        add("5.3/quest/4.udd", 4000),
+        add("5.5/pico/5.udd", 5000),
+    ]
+    ddc_command(mr, "evict", "250", "--dry-run")
+    assert all(path.exists() for path in files)
+
+    ddc_command(mr, "evict", "250")
+    assert [path.exists() for path in files] == [False, False, False, True, True]
+    # emptied folders go, but not the caches themselves
+    assert not (root / "5.5" / "quest" / "a").exists()
+    assert (root / "5.5" / "quest").exists()
+
+
+def test_prune_removes_only_unused_engine_versions(mr, ddc):
+    root, add = ddc
+    add("5.5/quest/1.udd", 1000)
+    add("5.4/quest/2.udd", 1000)
+    # used by a flavour's engine override
+    add("5.3/quest/3.udd", 1000)
+    add("4.27/pico/4.udd", 1000)
+    ddc_command(mr, "prune", "--dry-run")
+    assert len(list(root.iterdir())) == 4
+
+    ddc_command(mr, "prune", "--engine-version", "5.5", "5.4")
+    assert sorted(x.name for x in root.iterdir()) == ["5.3", "5.4", "5.5"]
@@ -0,0 +1,84 @@
+import hashlib
+import shlex
+
+import pytest
+
+APK_PATH = "/data/app/x/base.apk"
+
+
+@pytest.fixture
+def deploy(mr, fake_adb, tmp_path, monkeypatch):
+    # a build to deploy, and a device that has (something like) it already
+    monkeypatch.setattr(mr, "project_folder", tmp_path)
+    platform_folder = tmp_path / "Releases" / "quest"
+    platform_folder.mkdir(parents=True)
+    (platform_folder / "app.apk").write_bytes(b"apk" * 100)
+    (platform_folder / "main.obb").write_bytes(b"obb" * 100)
+    files = mr.plan_deploy(platform_folder)
+    manifest = mr.DeployManifest(tmp_path / "Saved" / "deploy_manifest.json")
+
+    def device_has(sizes, hashes):
+        # the remote files' sizes and sha256 hashes, in the order of files
+        remote_paths = [APK_PATH] + [x.remote_path for x in files[1:]]
+        stat = "".join(
+            f"{size} 1760000000 {path}\n" for size, path in zip(sizes, remote_paths)
+        )
+        responses = [("^pm path", f"package:{APK_PATH}\n"), ("^stat ", stat)]
+        for path, sha256 in zip(remote_paths, hashes):
+            responses.append((f"^sha256sum {shlex.quote(path)}", f"{sha256}  {path}\n"))
+        fake_adb.shell(responses)
+
+    def run():
+        start = len(fake_adb.calls())
+        mr.deploy_build(platform_folder, files, "SERIAL", manifest)
+        return [call[2:] for call in fake_adb.calls()[start:]]
+
+    return files, manifest, device_has, run
+
+
+def pushes(calls):
+    return [call[0] for call in calls if call[0] in ("install", "push")]
+
+
+def hashed(calls):
+    return [call for call in calls if "sha256sum" in call[-1]]
+
+
+def test_missing_manifest_entry_hashes_on_device(deploy):
+    files, manifest, device_has, run = deploy
+    device_has([x.size for x in files], [x.sha256 for x in files])
+    calls = run()
+    assert pushes(calls) == []
+    assert len(hashed(calls)) == 2
+    assert manifest.get("SERIAL", "apk")["sha256"] == files[0].sha256
+
+
+def test_unchanged_files_are_skipped_from_manifest(deploy):
+    files, manifest, device_has, run = deploy
+    device_has([x.size for x in files], [x.sha256 for x in files])
+    run()
+    # the manifest matches what is on the device, so nothing is hashed this time
+    calls = run()
+    assert pushes(calls) == []
+    assert hashed(calls) == []
+
+
+def test_size_mismatch_is_pushed(deploy):
+    files, manifest, device_has, run = deploy
+    device_has([x.size for x in files], [x.sha256 for x in files])
+    run()
+    device_has([files[0].size, files[1].size + 1], [x.sha256 for x in files])
+    calls = run()
+    assert pushes(calls) == ["push"]
+    assert hashed(calls) == []
+
+
+def test_different_contents_are_pushed(deploy):
+    files, manifest, device_has, run = deploy
+    device_has([x.size for x in files], [hashlib.sha256(b"other").hexdigest()] * 2)
+    assert pushes(run()) == ["install", "push"]
+
+
+def test_launch_cmdline_is_quoted(mr):
+    launch = mr.launch_args("/Game/Map -log='it''s'")
+    assert shlex.split(launch[-1]) == ["/Game/Map -log='it''s'"]
@@ -0,0 +1,97 @@
+import socket
+
+import pytest
+
+from fake_adb_server import FakeAdbServer
+
+QUEST = "1WMHH000000000 device usb:1-1 product:eureka model:Quest_3 transport_id:2"
+
+
+@pytest.fixture
+def adb_server(monkeypatch, fake_adb):
+    def start(sessions):
+        server = FakeAdbServer(sessions)
+        monkeypatch.setenv("ANDROID_ADB_SERVER_PORT", str(server.port))
+        return server
+
+    return start
+
+
+def test_parse_device_list(mr):
+    devices = mr.parse_device_list(
+        "List of devices attached\n" + QUEST + "\nFAKE2          offline\n\n"
+    )
+    assert [(d.serial, d.state, d.model) for d in devices] == [
+        ("1WMHH000000000", "device", "Quest_3"),
+        ("FAKE2", "offline", None),
+    ]
+    assert [d.ready() for d in devices] == [True, False]
+
+
+def test_tracker_updates(mr, adb_server):
+    with adb_server([["", "FAKE1 unauthorized usb:1", QUEST]]) as server:
+        with mr.DeviceTracker() as tracker:
+            updates = tracker.updates()
+            assert next(updates) == []
+            assert [d.state for d in next(updates)] == ["unauthorized"]
+            assert [str(d) for d in next(updates)] == ["1WMHH000000000 (Quest_3)"]
+    assert server.requests == ["host:track-devices-l"]
+
+
+def test_wait_for_device_reports_problems(mr, adb_server, capsys):
+    session = ["", "FAKE1 unauthorized usb:1", "FAKE1 offline usb:1", QUEST]
+    with adb_server([session]):
+        ready = mr.wait_for_device()
+    assert [d.serial for d in ready] == ["1WMHH000000000"]
+    out = capsys.readouterr().out
+    assert "No Android device detected" in out
+    assert "FAKE1 is unauthorized, accept USB debugging" in out
+    assert "FAKE1 is offline, waiting for it" in out
+    assert "Found connected Android device 1WMHH000000000 (Quest_3)" in out
+
+
+def test_wait_for_device_by_serial(mr, adb_server):
+    with adb_server([[QUEST, QUEST + "\nOTHER device usb:2"]]):
+        ready = mr.wait_for_device("OTHER")
+    assert [d.serial for d in ready] == ["OTHER"]
+
+
+def test_wait_for_device_reconnects(mr, adb_server, fake_adb):
+    # the adb server going away mid wait, e.g. being restarted
+    sessions = [["FAKE1 unauthorized usb:1", "close"], [QUEST]]
+    with adb_server(sessions) as server:
+        ready = mr.wait_for_device()
+    assert [d.serial for d in ready] == ["1WMHH000000000"]
+    assert len(server.requests) == 2
+    assert ["start-server"] in fake_adb.calls()
+
+
+def test_refused_tracking_closes_socket(mr, adb_server, monkeypatch):
+    sockets = []
+    create_connection = socket.create_connection
+
+    def recording_create_connection(*args, **kwargs):
+        sockets.append(create_connection(*args, **kwargs))
+        return sockets[-1]
+
+    monkeypatch.setattr(socket, "create_connection", recording_create_connection)
+    with adb_server([["FAIL unknown host service"]]):
+        with pytest.raises(ConnectionError, match="unknown host service"):
+            with mr.DeviceTracker():
+                pass
+    assert sockets[0].fileno() == -1
+
+
+def test_falls_back_to_adb_without_server(mr, fake_adb, monkeypatch):
+    # nothing listening, so device tracking fails and adb itself is asked
+    with socket.socket() as unused:
+        unused.bind(("127.0.0.1", 0))
+        port = unused.getsockname()[1]
+    monkeypatch.setenv("ANDROID_ADB_SERVER_PORT", str(port))
+    fake_adb.devices(QUEST)
+    ready = mr.wait_for_device()
+    assert [d.serial for d in ready] == ["1WMHH000000000"]
+    calls = fake_adb.calls()
+    assert ["start-server"] in calls
+    assert ["wait-for-device"] in calls
+    assert ["devices", "-l"] in calls
@@ -0,0 +1,197 @@
+import gzip
+import io
+import re
+import struct
+from datetime import datetime
+
+import pytest
+
+from fake_adb import logger_entry
+
+# logcat lines have no year, so indexes made from the text assume the current one
+BASE_TIME = datetime(datetime.now().year, 1, 2).timestamp()
+
+
+def make_entries(count=3000):
+    entries = []
+    for i in range(count):
+        timestamp = BASE_TIME + i * 0.01
+        if i % 3 == 0:
+            entry = [4, "UE", f"[2026.10.17-10.00.00:000][{i}]LogTemp: frame {i}"]
+        elif i % 3 == 1:
+            entry = [3, "chatty", f"noise {i}"]
+        elif i % 30 == 2:
+            entry = [5, "DirectVideo", f"dropped frame {i}\nsecond line {i}"]
+        else:
+            entry = [6, "DEBUG", f"error {i}"]
+        entries.append(entry + [timestamp, 100 if i % 2 else 200, 7])
+    return entries
+
+
+def formatted(mr, entries):
+    return [
+        line
+        for priority, tag, message, timestamp, pid, tid in entries
+        for line in mr.LogEntry(timestamp, pid, tid, priority, tag, message)
+        .format()
+        .splitlines()
+    ]
+
+
+def capture(mr, fake_adb, tmp_path, entries, **options):
+    fake_adb.logcat(entries)
+    log_path = tmp_path / "test.txt"
+    log_capture = mr.LogcatCapture(log_path, "S1", **options)
+    log_capture.run()
+    return log_path, log_capture
+
+
+def test_read_logcat_binary(mr):
+    v1_entry = struct.pack("<HHiIIi", 7, 0, 1, 2, 10, 500000000) + b"\x04T\0msg\0"
+    short_entry = struct.pack("<HHiIIiI", 1, 24, 1, 2, 10, 0, 0) + b"\x04"
+    v3_entry = logger_entry(6, "Tag", "two\nlines\n", 11.25, 3, 4)
+    truncated = logger_entry(4, "Tag", "cut off", 12, 3, 4)[:-3]
+    entries = list(
+        mr.read_logcat_binary(io.BytesIO(v1_entry + short_entry + v3_entry + truncated))
+    )
+    fields = [
+        (e.timestamp, e.pid, e.tid, e.priority, e.tag, e.message) for e in entries
+    ]
+    assert fields == [
+        (10.5, 1, 2, 4, "T", "msg"),
+        (11.25, 3, 4, 6, "Tag", "two\nlines"),
+    ]
+
+
+def test_capture_filters(mr, fake_adb, tmp_path):
+    entries = make_entries(300)
+    log_path, log_capture = capture(
+        mr, fake_adb, tmp_path, entries, tags=["DirectVideo", "Temp"], min_priority="I"
+    )
+    wanted = [
+        e
+        for e in entries
+        if e[1] == "DirectVideo" or (e[1] == "UE" and "LogTemp" in e[2])
+    ]
+    assert log_path.read_text().splitlines() == formatted(mr, wanted)
+    assert log_capture.entry_count == len(wanted)
+    assert ["-s", "S1", "exec-out", "logcat", "-B"] in fake_adb.calls()
+    assert mr.log_index_path(log_path).exists()
+
+
+def test_capture_rotation(mr, fake_adb, tmp_path, monkeypatch):
+    monkeypatch.setattr(mr, "LOG_INDEX_BLOCK", 1024)
+    entries = make_entries()
+    log_path, log_capture = capture(mr, fake_adb, tmp_path, entries, rotate_bytes=16384)
+    segments = mr.log_segments(log_path)
+    assert len(segments) > 3
+    assert segments == log_capture.segments
+    assert all(segment.name.endswith(".txt.gz") for segment in segments)
+    # segments are whole gzip files, made of one member per index block
+    text = b"".join(gzip.decompress(segment.read_bytes()) for segment in segments)
+    assert text.decode().splitlines() == formatted(mr, entries)
+    # and each block can be read on its own
+    lines = []
+    blocks = 0
+    for segment in segments:
+        index = mr.open_log_index(segment)
+        assert index.header["compressed"]
+        blocks += index.header["blocks"]
+        lines += index.query(tags=["DirectVideo"])
+        index.close()
+    assert blocks > len(segments)
+    assert lines == formatted(mr, [e for e in entries if e[1] == "DirectVideo"])
+
+
+@pytest.fixture
+def indexed_log(mr, fake_adb, tmp_path, monkeypatch):
+    monkeypatch.setattr(mr, "LOG_INDEX_BLOCK", 2048)
+    entries = make_entries()
+    log_path, _ = capture(mr, fake_adb, tmp_path, entries)
+    return log_path, entries
+
+
+def reference_query(
+    mr, entries, tags=None, pids=None, since=None, until=None, grep=None
+):
+    # what a query should return, by checking every line
+    lines = []
+    timestamps = mr.LogTimestamps()
+    for entry in entries:
+        priority, tag, message, _, pid, _ = entry
+        category = mr.LogEntry(0, pid, 0, priority, tag, message).category()
+        if tags and tag not in tags and category not in tags:
+            continue
+        if pids and pid not in pids:
+            continue
+        for line in formatted(mr, [entry]):
+            timestamp = timestamps.parse(line)
+            if since is not None and timestamp < since:
+                continue
+            if until is not None and timestamp > until:
+                continue
+            if grep is not None and not re.search(grep, line):
+                continue
+            lines.append(line)
+    return lines
+
+
+QUERIES = [
+    {"tags": ["DirectVideo"]},
+    {"tags": ["LogTemp", "DEBUG"]},
+    {"pids": [100]},
+    {"tags": ["chatty"], "pids": [200]},
+    {"since": BASE_TIME + 5, "until": BASE_TIME + 7.5},
+    {"grep": "second line"},
+    {"tags": ["DEBUG"], "since": BASE_TIME + 20, "grep": "error [0-9]*5$"},
+]
+
+
+def run_query(index, query):
+    grep = query.get("grep")
+    if grep is not None:
+        query = dict(query, grep=re.compile(grep.encode(), re.MULTILINE))
+    return index.query(**query)
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_index_query(mr, indexed_log, query):
+    log_path, entries = indexed_log
+    index = mr.open_log_index(log_path)
+    assert index.header["blocks"] > 10
+    try:
+        assert list(run_query(index, query)) == reference_query(mr, entries, **query)
+    finally:
+        index.close()
+
+
+def test_time_query_skips_blocks(mr, indexed_log):
+    log_path, _ = indexed_log
+    index = mr.open_log_index(log_path)
+    blocks = index.blocks_between(BASE_TIME + 5, BASE_TIME + 7.5)
+    assert 0 < len(blocks) < index.header["blocks"] / 2
+    index.close()
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_rebuilt_index_matches(mr, indexed_log, query):
+    # an index built from the text gives the same answers as one made while capturing
+    log_path, entries = indexed_log
+    mr.log_index_path(log_path).unlink()
+    index = mr.open_log_index(log_path)
+    try:
+        assert list(run_query(index, query)) == reference_query(mr, entries, **query)
+    finally:
+        index.close()
+
+
+def test_stale_index_is_rebuilt(mr, indexed_log):
+    log_path, entries = indexed_log
+    extra = mr.LogEntry(BASE_TIME + 100, 300, 1, 4, "Late", "appended").format()
+    with open(log_path, "a") as f:
+        f.write(extra)
+    index = mr.open_log_index(log_path)
+    try:
+        assert list(index.query(pids=[300])) == extra.splitlines()
+    finally:
+        index.close()
@@ -0,0 +1,76 @@
+import struct
+
+import pytest
+
+
+def box(box_type, payload):
+    return struct.pack(">I4s", 8 + len(payload), box_type) + payload
+
+
+def full_box(box_type, payload):
+    return box(box_type, b"\0\0\0\0" + payload)
+
+
+def make_mp4(sizes, timescale=30000, delta=1000, keyframe_every=30):
+    # a video track with just the boxes Mp4Parser reads, and no media data
+    frame_count = len(sizes)
+    hvcc = box(b"hvcC", bytes([1, 1]) + b"\0" * 10 + bytes([153]) + b"\0" * 10)
+    entry = b"\0" * 6 + b"\0\1" + b"\0" * 16 + struct.pack(">HH", 3840, 1920)
+    entry = box(b"hvc1", entry + b"\0" * 50 + hvcc)
+    keyframes = range(1, frame_count + 1, keyframe_every)
+    stbl = box(
+        b"stbl",
+        full_box(b"stsd", struct.pack(">I", 1) + entry)
+        + full_box(b"stts", struct.pack(">III", 1, frame_count, delta))
+        + full_box(
+            b"stss",
+            struct.pack(">I", len(keyframes))
+            + b"".join(struct.pack(">I", k) for k in keyframes),
+        )
+        + full_box(
+            b"stsz",
+            struct.pack(">II", 0, frame_count)
+            + b"".join(struct.pack(">I", size) for size in sizes),
+        ),
+    )
+    mdhd = full_box(
+        b"mdhd", struct.pack(">IIII", 0, 0, timescale, frame_count * delta) + b"\0" * 4
+    )
+    hdlr = full_box(b"hdlr", b"\0" * 4 + b"vide" + b"\0" * 13)
+    moov = box(b"moov", box(b"trak", box(b"mdia", mdhd + hdlr + box(b"minf", stbl))))
+    return box(b"ftyp", b"isom\0\0\0\0") + box(b"mdat", b"") + moov
+
+
+def test_inspect(mr, tmp_path):
+    path = tmp_path / "video.mp4"
+    path.write_bytes(make_mp4([200000] + [50000] * 299))
+    info = mr.inspect_video(path)
+    assert (info["codec"], info["width"], info["height"]) == ("hvc1", 3840, 1920)
+    assert info["level"] == pytest.approx(5.1)
+    assert info["frames"] == 300
+    assert info["fps"] == pytest.approx(30)
+    assert info["duration"] == pytest.approx(10)
+    assert info["keyframes"] == 10
+    assert info["max_keyframe_interval"] == pytest.approx(1)
+    assert info["peak_bitrate_time"] == 0
+    assert info["peak_bitrate_mbps"] == pytest.approx((200000 + 29 * 50000) * 8 / 1e6)
+
+
+def test_peak_window_holds_exactly_one_second_of_frames(mr, tmp_path):
+    # at 30fps a 1s window is 30 frames, float seconds rounded some windows to 31
+    path = tmp_path / "constant.mp4"
+    path.write_bytes(make_mp4([55000] * 300))
+    info = mr.inspect_video(path)
+    assert info["peak_bitrate_mbps"] == pytest.approx(13.2)
+    assert info["mean_bitrate_mbps"] == pytest.approx(13.2)
+
+
+def test_parse_error_is_not_hidden(mr, tmp_path):
+    # a sample size table cut short, which used to turn into a BufferError on close
+    path = tmp_path / "truncated.mp4"
+    data = bytearray(make_mp4([55000] * 300))
+    sample_count = data.index(b"stsz") + 12
+    data[sample_count : sample_count + 4] = struct.pack(">I", 10**6)
+    path.write_bytes(data)
+    with pytest.raises(ValueError):
+        mr.inspect_video(path)
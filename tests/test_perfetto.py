@@ -0,0 +1,38 @@
+import subprocess
+
+import pytest
+
+
+def test_start_stop_and_pull(mr, fake_adb, tmp_path):
+    device = fake_adb.files()
+    fake_adb.shell([("perfetto --txt -c -", "[perfetto] started\n12345\n")])
+    trace = mr.PerfettoTrace(tmp_path / "run.perfetto-trace", serial="SERIAL")
+    trace.start()
+    config = (device / mr.PERFETTO_CONFIG_PATH.lstrip("/")).read_text()
+    assert f'atrace_apps: "{mr.PACKAGE_NAME}"' in config
+    assert not (tmp_path / "run.perfetto-trace.pbtxt").exists()
+
+    # what perfetto wrote on the device while it ran
+    remote_trace = device / trace.remote_path.lstrip("/")
+    remote_trace.parent.mkdir(parents=True)
+    remote_trace.write_bytes(b"trace data")
+    assert trace.stop() == tmp_path / "run.perfetto-trace"
+    assert (tmp_path / "run.perfetto-trace").read_bytes() == b"trace data"
+
+    shell_commands = [
+        " ".join(call[3:]) for call in fake_adb.calls() if call[2] == "shell"
+    ]
+    assert shell_commands[0] == "setprop persist.traced.enable 1"
+    assert shell_commands[2].startswith("kill -TERM 12345;")
+    assert shell_commands[3] == f"rm -f {trace.remote_path}"
+    # stopping again does nothing
+    assert trace.stop() is None
+
+
+def test_start_fails_without_a_pid(mr, fake_adb, tmp_path):
+    fake_adb.files()
+    fake_adb.shell([("perfetto", "perfetto: Could not start tracing\n")])
+    trace = mr.PerfettoTrace(tmp_path / "run.perfetto-trace", serial="SERIAL")
+    with pytest.raises(subprocess.CalledProcessError):
+        trace.start()
+    assert trace.stop() is None
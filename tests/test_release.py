@@ -0,0 +1,123 @@
+import hashlib
+import zipfile
+
+import pytest
+
+from fake_release_api import FakeReleaseApi
+
+
+@pytest.fixture
+def release_project(mr, tmp_path, monkeypatch):
+    # a Releases folder with two flavours in, and a release API to upload to
+    releases = tmp_path / "Releases"
+    for flavour in ["quest", "pico"]:
+        (releases / flavour).mkdir(parents=True)
+        (releases / flavour / "app.apk").write_bytes(flavour.encode() * 1000)
+        (releases / flavour / "main.obb").write_bytes(b"obb" * 1000)
+    monkeypatch.setattr(mr, "project_folder", tmp_path)
+    monkeypatch.setattr(mr, "release_folder", releases)
+    monkeypatch.setenv("GITHUB_REPOSITORY", "owner/repo")
+    monkeypatch.setenv("GITHUB_TOKEN", "token")
+    # retries back off for seconds at a time
+    monkeypatch.setattr(mr.time, "sleep", lambda seconds: None)
+    return releases
+
+
+def start_api(monkeypatch, **options):
+    api = FakeReleaseApi(**options)
+    monkeypatch.setenv("GITHUB_API_URL", api.url)
+    return api
+
+
+def release(mr, *options):
+    mr.command_release(mr.parse_arguments(["release", "1.0", *options]))
+
+
+def uploads(api):
+    return [path for method, path in api.requests if path.startswith("/uploads")]
+
+
+def test_zip_stores_compressed_files(mr, release_project, tmp_path):
+    quest = release_project / "quest"
+    (quest / "Manifest.txt").write_text("files\n" * 100)
+    zip_path, checksum = mr.make_release_zip(quest, tmp_path / "quest.zip")
+    with zipfile.ZipFile(zip_path) as zf:
+        assert zf.testzip() is None
+        compress_types = {info.filename: info.compress_type for info in zf.infolist()}
+    assert compress_types == {
+        "quest/Manifest.txt": zipfile.ZIP_DEFLATED,
+        "quest/app.apk": zipfile.ZIP_STORED,
+        "quest/main.obb": zipfile.ZIP_STORED,
+    }
+    assert checksum == hashlib.sha256(zip_path.read_bytes()).hexdigest()
+    assert mr.checksum_file(zip_path).read_text() == f"{checksum}  quest.zip\n"
+    assert not zip_path.with_name("quest.zip.tmp").exists()
+
+
+def test_create_and_upload(mr, release_project, monkeypatch):
+    with start_api(monkeypatch) as api:
+        release(mr)
+        assets = api.asset_data("v1.0")
+    assert sorted(assets) == [
+        "pico.zip",
+        "pico.zip.sha256",
+        "quest.zip",
+        "quest.zip.sha256",
+    ]
+    assert assets["quest.zip"] == (release_project / "quest.zip").read_bytes()
+    checksum = mr.hash_file(release_project / "quest.zip").hexdigest()
+    assert assets["quest.zip.sha256"].decode() == f"{checksum}  quest.zip\n"
+    manifest_path = release_project.parent / "Saved" / "release_manifest.json"
+    manifest = mr.ReleaseManifest(manifest_path)
+    assert manifest.get("v1.0", "quest.zip")["sha256"] == checksum
+
+
+def test_existing_release_needs_force(mr, release_project, monkeypatch):
+    with start_api(monkeypatch):
+        release(mr)
+        with pytest.raises(SystemExit):
+            release(mr)
+
+
+@pytest.mark.parametrize("digests", [True, False])
+def test_unchanged_assets_are_skipped(
+    mr, release_project, monkeypatch, capsys, digests
+):
+    with start_api(monkeypatch, digests=digests) as api:
+        release(mr)
+        # without our record of the uploads, the digest or .sha256 asset is checked
+        (release_project.parent / "Saved/release_manifest.json").unlink()
+        api.requests.clear()
+        release(mr, "--force")
+        assert uploads(api) == []
+        assert "Nothing to upload" in capsys.readouterr().out
+
+        (release_project / "pico" / "main.obb").write_bytes(b"new obb")
+        release(mr, "--force")
+        # just the changed zip and its checksum
+        assert len(uploads(api)) == 2
+        assets = api.asset_data("v1.0")
+    assert assets["pico.zip"] == (release_project / "pico.zip").read_bytes()
+    assert len(assets) == 4
+
+
+def test_retries(mr, release_project, monkeypatch):
+    with start_api(monkeypatch) as api:
+        # a create which works but whose reply is lost must not create it twice
+        api.fail("POST", r"/releases$", after=True)
+        api.fail("POST", r"^/uploads", status=503, times=2)
+        api.fail("GET", r"/assets$", status=500)
+        release(mr)
+        assets = api.asset_data("v1.0")
+    assert len(api.releases) == 1
+    assert len(assets) == 4
+    assert assets["quest.zip"] == (release_project / "quest.zip").read_bytes()
+
+
+def test_client_errors_are_not_retried(mr, release_project, monkeypatch):
+    with start_api(monkeypatch) as api:
+        api.fail("POST", r"^/uploads", status=403, times=100)
+        with pytest.raises(SystemExit):
+            release(mr)
+    # one attempt per file
+    assert len(uploads(api)) == 4
@@ -0,0 +1,100 @@
+import json
+import subprocess
+
+import pytest
+
+
+def test_device_failure_is_recorded(mr, fake_adb, tmp_path, monkeypatch):
+    (tmp_path / "Saved").mkdir()
+    monkeypatch.setattr(mr, "project_folder", tmp_path)
+    monkeypatch.setattr(
+        mr,
+        "select_devices",
+        lambda args: [mr.AdbDevice("GOOD", "device"), mr.AdbDevice("BAD", "device")],
+    )
+
+    def deploy_build(platform_folder, deploy_files, serial, manifest):
+        if serial == "BAD":
+            raise ValueError("unexpected date output")
+
+    monkeypatch.setattr(mr, "deploy_build", deploy_build)
+    fake_adb.logcat([[4, "UE", "LogTemp: hello", 1760000000.0, 1, 1]])
+    args = mr.parse_arguments(["run", "quest", "--grablog", "--logname", "run.txt"])
+    with pytest.raises(SystemExit):
+        mr.run_on_devices(args, tmp_path / "Releases" / "quest")
+
+    results = json.loads((tmp_path / "run.devices.json").read_text())
+    assert [(r["serial"], r["error"]) for r in results] == [
+        ("GOOD", None),
+        ("BAD", "unexpected date output"),
+    ]
+    assert results[0]["log_lines"] == 1
+    assert (tmp_path / "run-GOOD.txt").exists()
+
+
+def test_only_pushed_patches_are_removed(mr, fake_adb, tmp_path, monkeypatch):
+    monkeypatch.setattr(mr, "project_folder", tmp_path)
+    monkeypatch.setattr(
+        mr, "select_devices", lambda args: [mr.AdbDevice("SERIAL", "device")]
+    )
+    patch = tmp_path / "pakchunk0-Android_P.pak"
+    patch.write_bytes(b"patch")
+    args = mr.parse_arguments(["build", "quest", "--patch"])
+    mr.push_patch(args, [patch])
+    mr.push_patch(args, [patch])
+    manifest = mr.DeployManifest(tmp_path / "Saved" / "deploy_manifest.json")
+    mr.remove_pushed_patch("SERIAL", manifest)
+    mr.remove_pushed_patch("SERIAL", manifest)
+
+    remote_path = f"{mr.device_pak_folder()}/{patch.name}"
+    removes = [call[-1] for call in fake_adb.calls() if "rm" in call[-1]]
+    # once before the second push and once for the deploy, never a wildcard
+    assert removes == [f"rm -f {remote_path}"] * 2
+    assert manifest.get("SERIAL", "patch") == {"paths": []}
+
+
+def test_stress_video_keeps_existing_movie(mr, tmp_path, monkeypatch):
+    # the device's files are a local folder, with shell commands run locally
+    device = tmp_path / "device"
+    movie = device / mr.MOVIE_PATH
+    movie.parent.mkdir(parents=True)
+    movie.write_bytes(b"original")
+    clip = tmp_path / "clip.mp4"
+    clip.write_bytes(b"clip")
+    info = {"codec": "h264", "width": 640, "height": 480, "mean_bitrate_mbps": 1.0}
+    info["fps"] = 30.0
+
+    def push_stress_clips(serial, clips, manifest):
+        (device / mr.STRESS_CLIP_FOLDER).mkdir(exist_ok=True)
+        remote_clip = device / mr.STRESS_CLIP_FOLDER / clip.name
+        remote_clip.write_bytes(clip.read_bytes())
+        return [str(remote_clip)]
+
+    played = []
+
+    def benchmark_run(serial, log_path, map_name, duration, warmup):
+        played.append(movie.read_bytes())
+        return {"samples": 0, "drops": 0, "mean_fps": 60.0}
+
+    monkeypatch.setattr(mr, "project_folder", tmp_path)
+    monkeypatch.setattr(mr, "device_project_folder", lambda: str(device))
+    monkeypatch.setattr(
+        mr,
+        "adb_shell_output",
+        lambda serial, command: subprocess.run(["sh", "-c", command]),
+    )
+    monkeypatch.setattr(
+        mr, "wait_for_device", lambda serial=None: [mr.AdbDevice("SERIAL", "device")]
+    )
+    monkeypatch.setattr(mr, "stress_clips", lambda clip_args: [(clip, info)])
+    monkeypatch.setattr(mr, "push_stress_clips", push_stress_clips)
+    monkeypatch.setattr(mr, "benchmark_run", benchmark_run)
+    args = mr.parse_arguments(
+        ["stress-video", "quest", str(clip), "--modes", "texture"]
+    )
+    mr.command_stress_video(args)
+
+    assert played == [b"clip"]
+    assert movie.read_bytes() == b"original"
+    assert (device / mr.STRESS_CLIP_FOLDER / clip.name).read_bytes() == b"clip"
+    assert list((device / mr.STRESS_BACKUP_FOLDER).iterdir()) == []
@@ -0,0 +1,149 @@
+import struct
+
+import pytest
+
+NONE = 0xFFFFFFFF
+PAK_MAGIC = 0x5A6F12E1
+# file data comes first in a pak, and isn't read
+PAK_DATA_SIZE = 1000
+
+
+def fstring(text):
+    return struct.pack("<i", len(text) + 1) + text.encode() + b"\0"
+
+
+def pak_entry(size, uncompressed_size, compression, blocks=0, version=11):
+    # FPakEntry as the index stores it, from version 3 on
+    entry = struct.pack("<qqq", 0, size, uncompressed_size)
+    entry += struct.pack("<B" if version == 8 else "<I", compression)
+    entry += bytes(20)
+    if compression != 0:
+        entry += struct.pack("<i", blocks) + bytes(16 * blocks)
+    return entry + bytes(5)
+
+
+def make_pak(version, index, directory_index=b""):
+    # file data, the directory index (which starts at PAK_DATA_SIZE), the index,
+    # then the footer
+    data = bytes(PAK_DATA_SIZE) + directory_index
+    footer = bytes(16) + b"\0"
+    footer += struct.pack("<Iiqq", PAK_MAGIC, version, len(data), len(index))
+    return data + index + footer + bytes(20) + bytes(5 * 32)
+
+
+def test_legacy_pak_index(mr):
+    index = fstring("../../../") + struct.pack("<i", 2)
+    index += fstring("DirectVideoExample/Content/Map.umap")
+    index += pak_entry(400, 1000, 1, blocks=2, version=8)
+    index += fstring("DirectVideoExample/Content/Movies/nasa.mp4")
+    index += pak_entry(5000, 5000, 0, version=8)
+    mount_point, files = mr.read_pak_index(make_pak(8, index))
+    assert mount_point == "../../../"
+    assert files == [
+        ("DirectVideoExample/Content/Map.umap", 400, 1000),
+        ("DirectVideoExample/Content/Movies/nasa.mp4", 5000, 5000),
+    ]
+
+
+def test_pak_with_encoded_entries(mr):
+    # offset and sizes fit in 32 bits, not compressed
+    encoded = struct.pack("<III", (1 << 31) | (1 << 30), 0, 5000)
+    # compressed with the first method in two blocks
+    compressed_pos = len(encoded)
+    flags = (1 << 31) | (1 << 30) | (1 << 29) | (1 << 23) | (2 << 6) | 1
+    encoded += struct.pack("<IIII", flags, 5000, 3000, 1200) + bytes(8)
+    directories = struct.pack("<i", 2)
+    directories += fstring("/") + struct.pack("<i", 1)
+    directories += fstring("DirectVideoExample.uproject") + struct.pack("<i", 0)
+    directories += fstring("/DirectVideoExample/Content/") + struct.pack("<i", 3)
+    directories += fstring("Map.umap") + struct.pack("<i", compressed_pos)
+    directories += fstring("Big.uasset") + struct.pack("<i", -1)
+    # deleted in this patch
+    directories += fstring("Old.uasset") + struct.pack("<i", -(2**31))
+    index = fstring("../../../") + struct.pack("<i", 4)
+    index += struct.pack("<QI", 0, 0)
+    index += struct.pack("<Iqq", 1, PAK_DATA_SIZE, len(directories)) + bytes(20)
+    index += struct.pack("<i", len(encoded)) + encoded
+    index += struct.pack("<i", 1) + pak_entry(700, 2000, 1, blocks=1)
+    pak = make_pak(11, index, directories)
+    mount_point, files = mr.read_pak_index(pak)
+    assert files == [
+        ("DirectVideoExample.uproject", 5000, 5000),
+        ("DirectVideoExample/Content/Map.umap", 1200, 3000),
+        ("DirectVideoExample/Content/Big.uasset", 700, 2000),
+    ]
+    packaged = mr.packaged_files("main.obb/x.pak", pak)
+    assert [x.path for x in packaged] == [
+        "DirectVideoExample.uproject",
+        "/Game/Map.umap",
+        "/Game/Big.uasset",
+    ]
+    assert sum(x.size for x in packaged) == 6900
+    assert sum(x.uncompressed_size for x in packaged) == 10000
+
+
+def make_utoc(version):
+    strings = ["DirectVideoExample", "Content", "Map.umap", "Movie.uasset"]
+    directory_index = fstring("../../../")
+    directory_index += struct.pack("<i", 3)
+    directory_index += struct.pack("<4I", NONE, 1, NONE, NONE)
+    directory_index += struct.pack("<4I", 0, 2, NONE, NONE)
+    directory_index += struct.pack("<4I", 1, NONE, NONE, 0)
+    directory_index += struct.pack("<i", 2)
+    directory_index += struct.pack("<3I", 2, 1, 0)
+    directory_index += struct.pack("<3I", 3, NONE, 1)
+    directory_index += struct.pack("<i", len(strings))
+    directory_index += b"".join(fstring(x) for x in strings)
+
+    block_size = 65536
+    header = b"-==--==--==--==-" + struct.pack("<B3x", version)
+    # header size, chunk count, block count and entry size, compression method
+    # count and name length, block size, directory index size
+    header += struct.pack("<8I", 144, 2, 3, 12, 1, 32, block_size, len(directory_index))
+    # flags: has a directory index
+    header += struct.pack("<IQ", 1, 0) + bytes(16) + struct.pack("<B3x", 8)
+    header += struct.pack("<IQI", 0, 0, 0)
+    header += bytes(144 - len(header))
+    chunk_ids = bytes(2 * 12)
+    # the first chunk spans two blocks, the second is in the third
+    offsets = (0).to_bytes(5, "big") + (100000).to_bytes(5, "big")
+    offsets += (2 * block_size).to_bytes(5, "big") + (1000).to_bytes(5, "big")
+    blocks = b""
+    for offset, size, uncompressed_size in [
+        (0, 30000, block_size),
+        (30000, 20000, 100000 - block_size),
+        (50000, 500, 1000),
+    ]:
+        blocks += offset.to_bytes(5, "little") + size.to_bytes(3, "little")
+        blocks += uncompressed_size.to_bytes(3, "little") + b"\1"
+    method_names = b"Oodle".ljust(32, b"\0")
+    return header + chunk_ids + offsets + blocks + method_names + directory_index
+
+
+def test_utoc_index(mr):
+    mount_point, files = mr.read_utoc_index(make_utoc(5))
+    assert mount_point == "../../../"
+    assert files == [
+        ("DirectVideoExample/Content/Map.umap", 50000, 100000),
+        ("DirectVideoExample/Content/Movie.uasset", 500, 1000),
+    ]
+
+
+@pytest.mark.parametrize(
+    "reader, data",
+    [
+        ("read_pak_index", make_pak(12, fstring("../../../") + bytes(4))),
+        ("read_utoc_index", make_utoc(1)),
+        ("read_utoc_index", make_utoc(99)),
+    ],
+)
+def test_unsupported_versions(mr, reader, data):
+    with pytest.raises(ValueError, match="unsupported"):
+        getattr(mr, reader)(data)
+
+
+def test_unreadable_containers_are_counted_whole(mr, capsys):
+    data = make_utoc(99)
+    packaged = mr.packaged_files("main.obb/x.utoc", data)
+    assert [(x.path, x.size) for x in packaged] == [("(unreadable)", len(data))]
+    assert "unsupported utoc version 99" in capsys.readouterr().out
@@ -0,0 +1,60 @@
+def swap_in(mr, platform_folder, contents, keep_generations):
+    staging_folder = mr.staging_folder_for(platform_folder)
+    staging_folder.mkdir()
+    (staging_folder / "build.txt").write_text(contents)
+    mr.swap_into_place(staging_folder, platform_folder, keep_generations)
+
+
+def generations(platform_folder):
+    # {folder name: contents} of the current and previous builds
+    folders = [platform_folder]
+    previous_folder = platform_folder.parent / ".previous"
+    if previous_folder.exists():
+        folders += sorted(previous_folder.iterdir())
+    return {x.name: (x / "build.txt").read_text() for x in folders}
+
+
+def test_old_generations_are_rotated_out(mr, tmp_path):
+    platform_folder = tmp_path / "Releases" / "quest"
+    platform_folder.parent.mkdir()
+    for n in range(5):
+        swap_in(mr, platform_folder, f"build {n}", 2)
+    assert generations(platform_folder) == {
+        "quest": "build 4",
+        "quest.1": "build 3",
+        "quest.2": "build 2",
+    }
+    assert not mr.staging_folder_for(platform_folder).exists()
+
+
+def test_no_generations_kept(mr, tmp_path):
+    platform_folder = tmp_path / "Releases" / "quest"
+    platform_folder.parent.mkdir()
+    for n in range(3):
+        swap_in(mr, platform_folder, f"build {n}", 0)
+    assert generations(platform_folder) == {"quest": "build 2"}
+
+
+def test_engine_change_invalidates_intermediate_source(mr, tmp_path):
+    workspace = tmp_path / "workspace"
+    generated = workspace / "Intermediate" / "Source" / "Generated.h"
+    engine_path = tmp_path / "UE_5.5"
+    build_version = engine_path / "Engine" / "Build" / "Build.version"
+    build_version.parent.mkdir(parents=True)
+    build_version.write_text('{"Changelist": 1}')
+
+    def build():
+        generated.parent.mkdir(parents=True, exist_ok=True)
+        generated.write_text("generated")
+        mr.invalidate_intermediate_source(workspace, engine_path, "5.5")
+        return generated.exists()
+
+    # no stamp yet, so whatever is there can't be trusted
+    assert not build()
+    assert build()
+    build_version.write_text('{"Changelist": 2}')
+    assert not build()
+    assert build()
+    # a different engine version with the same Build.version
+    mr.invalidate_intermediate_source(workspace, engine_path, "5.6")
+    assert not generated.exists()
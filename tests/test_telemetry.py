@@ -0,0 +1,81 @@
+from datetime import datetime
+
+import pytest
+
+NOW = 1760000000.5
+UPTIME = 100.0
+
+DEVICE_SHELL = [
+    ("^date ", f"{NOW} +0000\n{UPTIME}\n"),
+    (
+        "^for f in /sys/devices/system/cpu/",
+        "/sys/devices/system/cpu/cpufreq/policy0/scaling_cur_freq\n"
+        "/sys/devices/system/cpu/cpufreq/policy4/scaling_cur_freq\n",
+    ),
+    ("^for f in /sys/class/kgsl/", "/sys/class/kgsl/kgsl-3d0/devfreq/cur_freq\n"),
+    ("^for f in /sys/class/power_supply/", "/sys/class/power_supply/battery/temp\n"),
+    (
+        "^for z in /sys/class/thermal/",
+        "/sys/class/thermal/thermal_zone0/temp cpu-0-0\n"
+        "/sys/class/thermal/thermal_zone1/temp pm8150b\n"
+        "/sys/class/thermal/thermal_zone2/temp skin\n",
+    ),
+    # uptime, then each source in order, the gpu clock unreadable this time
+    ("^s$", "105.25 1420800 2419200 nan 312 45000 38\n"),
+    (
+        "^dumpsys meminfo",
+        "App Summary\n"
+        "                       Pss(KB)\n"
+        "           Java Heap:    12000\n"
+        "           TOTAL PSS:   524288       TOTAL RSS:   600000\n",
+    ),
+]
+
+
+def test_samples_are_written_and_read_back(mr, fake_adb, tmp_path):
+    fake_adb.shell(DEVICE_SHELL)
+    sampler = mr.TelemetrySampler(tmp_path / "telemetry.bin", "SERIAL", interval=0.05)
+    sampler.start()
+    while len(sampler.times) < 3 and sampler._thread.is_alive():
+        sampler._stopping.wait(0.05)
+    assert sampler.stop() == tmp_path / "telemetry.bin"
+
+    header, columns = mr.read_telemetry(tmp_path / "telemetry.bin")
+    assert header["serial"] == "SERIAL"
+    assert header["rows"] >= 3
+    assert [(x["name"], x["unit"]) for x in header["columns"]] == [
+        ("time", "s"),
+        ("cpu0", "MHz"),
+        ("cpu1", "MHz"),
+        ("gpu", "MHz"),
+        ("battery", "C"),
+        ("cpu-0-0", "C"),
+        ("skin", "C"),
+        ("app_pss", "MB"),
+    ]
+    assert all(len(x) == header["rows"] for x in columns.values())
+    host_utc_offset = datetime.fromtimestamp(NOW).astimezone().utcoffset()
+    assert columns["time"][0] == pytest.approx(
+        NOW - UPTIME + 105.25 - host_utc_offset.total_seconds()
+    )
+    first = {name: values[0] for name, values in columns.items() if name != "time"}
+    assert first == pytest.approx(
+        {
+            "cpu0": 1420.8,
+            "cpu1": 2419.2,
+            "gpu": float("nan"),
+            "battery": 31.2,
+            "cpu-0-0": 45.0,
+            "skin": 38.0,
+            "app_pss": 512.0,
+        },
+        nan_ok=True,
+    )
+    # memory is sampled less often than the rest
+    assert str(columns["app_pss"][1]) == "nan"
+
+
+def test_other_files_are_not_read_as_telemetry(mr, tmp_path):
+    (tmp_path / "log.bin").write_bytes(b"DVLX" + bytes(16))
+    with pytest.raises(ValueError, match="not a telemetry file"):
+        mr.read_telemetry(tmp_path / "log.bin")
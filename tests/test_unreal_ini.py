@@ -0,0 +1,44 @@
+INI = """[/Script/Engine.RendererSettings]
+vr.MobileMultiView=True
+-vr.MobileMultiView=True
+!vr.MobileMultiView=ClearArray
++vr.MobileMultiView=Added
+"""
+
+
+def test_update_value_only_changes_plain_lines(mr):
+    ini = mr.UnrealIni(INI)
+    ini.update_value(
+        True,
+        ("/Script/Engine.RendererSettings", "vr.MobileMultiView"),
+        lambda enabled, current: "False" if enabled else "True",
+    )
+    assert ini.reconstruct() == INI.replace(
+        "vr.MobileMultiView=True\n-", "vr.MobileMultiView=False\n-", 1
+    )
+
+
+def test_round_trip_and_set_value(mr):
+    text = "[A]\r\nKey=1\r\n\r\n[B]\r\nOther=2"
+    ini = mr.UnrealIni(text)
+    assert ini.reconstruct() == text
+    ini.set_value("A", "Key", "3")
+    ini.set_value("C", "New", "4")
+    assert ini.get_value("A", "Key") == "3"
+    assert ini.reconstruct() == "[A]\r\nKey=3\r\n\r\n[B]\r\nOther=2\r\n\r\n[C]\r\nNew=4"
+
+
+def test_engine_settings_only_go_in_flavour_files(mr):
+    engine_text = mr.defaultengine_file.read_text()
+    flavour = next(f for f in mr.BUILD_FLAVOURS if not f.dont_build)
+    flavour_files = mr.make_flavour_files(
+        mr.project_file.read_text(),
+        engine_text,
+        [flavour],
+        False,
+        mr.PSO_ENGINE_SETTINGS,
+    )
+    ini = mr.UnrealIni(flavour_files[flavour.flavour_name][1])
+    for section, key, value in mr.PSO_ENGINE_SETTINGS:
+        assert ini.get_value(section, key) == value
+    assert mr.defaultengine_file.read_text() == engine_text
@@ -0,0 +1,52 @@
+import os
+
+
+def make_project(root):
+    (root / "Config").mkdir(parents=True)
+    (root / "Config" / "DefaultEngine.ini").write_text("[Engine]\n")
+    (root / "Config" / "DefaultGame.ini").write_text("[Game]\n")
+    (root / "Content" / "Movies").mkdir(parents=True)
+    (root / "Content" / "Movies" / "a.mp4").write_bytes(b"a")
+    (root / "Content" / "Movies" / "b.mp4").write_bytes(b"b")
+    (root / "Test.uproject").write_text("{}")
+    (root / "Releases").mkdir()
+
+
+def test_workspace_mirrors_deletions(mr, tmp_path, monkeypatch):
+    make_project(tmp_path)
+    monkeypatch.setattr(mr, "project_folder", tmp_path)
+    flavour = mr.find_flavour("quest")
+    workspace = mr.make_workspace(flavour, "{}", "[Engine]\n")
+    (workspace / "Intermediate").mkdir()
+    (workspace / "Content" / "Saved").mkdir()
+
+    (tmp_path / "Content" / "Movies" / "b.mp4").unlink()
+    (tmp_path / "Config" / "DefaultGame.ini").unlink()
+    (tmp_path / "Content" / "Old").mkdir()
+    (tmp_path / "Content" / "Old" / "x.uasset").write_bytes(b"x")
+    mr.make_workspace(flavour, "{}", "[Engine]\n")
+    (tmp_path / "Content" / "Old" / "x.uasset").unlink()
+    (tmp_path / "Content" / "Old").rmdir()
+    mr.make_workspace(flavour, "{}", "[Engine]\n")
+
+    assert (workspace / "Content" / "Movies" / "a.mp4").exists()
+    assert not (workspace / "Content" / "Movies" / "b.mp4").exists()
+    assert not (workspace / "Content" / "Old").exists()
+    assert not (workspace / "Config" / "DefaultGame.ini").exists()
+    assert not (workspace / "Releases").exists()
+    # build outputs are kept for incremental builds
+    assert (workspace / "Intermediate").exists()
+    assert (workspace / "Content" / "Saved").exists()
+
+
+def test_workspace_config_is_not_linked(mr, tmp_path, monkeypatch):
+    make_project(tmp_path)
+    monkeypatch.setattr(mr, "project_folder", tmp_path)
+    workspace = mr.make_workspace(mr.find_flavour("quest"), "{}", "[Engine]\n")
+    game_ini = workspace / "Config" / "DefaultGame.ini"
+    assert not os.path.samefile(game_ini, tmp_path / "Config" / "DefaultGame.ini")
+    game_ini.write_text("[Game]\nchanged\n")
+    assert (tmp_path / "Config" / "DefaultGame.ini").read_text() == "[Game]\n"
+    # content is linked where possible
+    movie = workspace / "Content" / "Movies" / "a.mp4"
+    assert movie.read_bytes() == b"a"